@@ -0,0 +1,64 @@
+import asyncio
+
+from models import PHOTO_ADDED, PHOTO_DUPLICATE
+
+
+# Итог по альбому: сколько фото добавлено, сколько повторов и сколько не влезло в лимит
+class Album:
+    __slots__ = ('user_id', 'chat_id', 'media_group_id', 'added', 'duplicates', 'rejected', 'timer')
+
+    def __init__(self, user_id, chat_id, media_group_id):
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.media_group_id = media_group_id
+        self.added = 0
+        self.duplicates = 0
+        self.rejected = 0
+        self.timer = None
+
+    @property
+    def skipped(self):
+        return self.duplicates + self.rejected
+
+
+# Фото альбома (одна media_group_id) приходят отдельными обновлениями почти одновременно.
+# Фото сразу добавляются в черновик, а итог копится здесь: подтверждение уходит
+# в on_complete(album) один раз — когда новых фото этой группы не было window секунд.
+class AlbumCollector:
+    def __init__(self, window=1.0, on_complete=None):
+        self.window = window
+        self.on_complete = on_complete
+        self._albums = {}
+
+    def add(self, user_id, chat_id, media_group_id, status):
+        key = (chat_id, media_group_id)
+        album = self._albums.get(key)
+        if album is None:
+            album = self._albums[key] = Album(user_id, chat_id, media_group_id)
+        else:
+            album.timer.cancel()
+
+        if status == PHOTO_ADDED:
+            album.added += 1
+        elif status == PHOTO_DUPLICATE:
+            album.duplicates += 1
+        else:
+            album.rejected += 1
+
+        album.timer = asyncio.get_running_loop().call_later(self.window, self._complete, key)
+        return album
+
+    def _complete(self, key):
+        album = self._albums.pop(key, None)
+        if album is not None and self.on_complete is not None:
+            self.on_complete(album)
+
+    # Заявка отправлена или отменена: подтверждать альбомы уже незачем
+    def discard(self, user_id):
+        for key, album in list(self._albums.items()):
+            if album.user_id == user_id:
+                album.timer.cancel()
+                del self._albums[key]
+
+    def __len__(self):
+        return len(self._albums)
@@ -0,0 +1,241 @@
+import asyncio
+import json
+import logging
+import os
+import re
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from models import extract_plates, normalize_phone
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS claims (
+        id INTEGER PRIMARY KEY,
+        claim_id TEXT NOT NULL UNIQUE,
+        user_id INTEGER NOT NULL,
+        username TEXT,
+        full_name TEXT,
+        phone TEXT,
+        phone_key TEXT,
+        latitude REAL,
+        longitude REAL,
+        car_details TEXT,
+        accident_details TEXT,
+        plates TEXT,
+        photos TEXT,
+        zone TEXT,
+        incident_id TEXT,
+        created_at TEXT,
+        submitted_at REAL NOT NULL
+    );
+    CREATE INDEX IF NOT EXISTS claims_phone_key ON claims (phone_key);
+    CREATE INDEX IF NOT EXISTS claims_user_id ON claims (user_id);
+    CREATE INDEX IF NOT EXISTS claims_incident_id ON claims (incident_id);
+
+    -- Полнотекстовый индекс поверх claims (без копии текста)
+    CREATE VIRTUAL TABLE IF NOT EXISTS claims_fts USING fts5(
+        car_details, accident_details, plates,
+        content='claims', content_rowid='id'
+    );
+    CREATE TRIGGER IF NOT EXISTS claims_fts_insert AFTER INSERT ON claims BEGIN
+        INSERT INTO claims_fts (rowid, car_details, accident_details, plates)
+        VALUES (new.id, new.car_details, new.accident_details, new.plates);
+    END;
+"""
+
+# Изменения схемы существующего архива: (версия, SQL); номер последней
+# примененной версии хранится в PRAGMA user_version
+MIGRATIONS = (
+    # /recent сортируется по id (порядок вставки), индекс по created_at не нужен
+    (1, "DROP INDEX IF EXISTS claims_created_at"),
+)
+
+COLUMNS = (
+    'claim_id', 'user_id', 'username', 'full_name', 'phone', 'phone_key', 'latitude', 'longitude',
+    'car_details', 'accident_details', 'plates', 'photos', 'zone', 'incident_id', 'created_at', 'submitted_at'
+)
+
+_PHONE_QUERY_RE = re.compile(r"[\d\s+()\-]+")
+
+
+# Архив не удалось открыть: поиск сообщает об ошибке, а не ждет открытия
+class ArchiveUnavailable(RuntimeError):
+    pass
+
+
+# Разбор строки поиска: номер авто/VIN, телефон или произвольный текст
+def parse_query(query):
+    plates = extract_plates(query)
+    if plates:
+        return 'plate', plates[0]
+    if _PHONE_QUERY_RE.fullmatch(query):
+        phone_key = normalize_phone(query)
+        if phone_key:
+            return 'phone', phone_key
+    # Каждое слово — префиксный запрос FTS5; кавычки снимают спецсимволы синтаксиса
+    words = re.findall(r"\w+", query)
+    return 'text', ' '.join(f'"{word}"*' for word in words)
+
+
+# Архив отправленных заявок в SQLite: FTS5 по данным авто и описанию ДТП,
+# индекс по телефону, порядок по времени — по id. Запись, как и в SQLiteStorage, неблокирующая:
+# заявки копятся в памяти и пишутся пачками через единственный поток базы.
+class ClaimArchive:
+    def __init__(self, path, flush_interval=0.05):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._conn = None
+        self._executor = None
+        self._writer_task = None
+        self._wakeup = None
+        self._closing = False
+        self._pending = []
+        self._opened = asyncio.Event()
+        self._open_error = None
+
+    async def open(self):
+        if self._conn is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='claim-archive')
+        try:
+            self._conn = await self._run(self._connect)
+        except Exception as e:
+            self._executor.shutdown(wait=False)
+            self._open_error = e
+            self._opened.set()
+            raise
+        self._open_error = None
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._writer_task = asyncio.create_task(self._writer(), name='claim-archive-writer')
+        # Заявки, отправленные до открытия архива (LAZY_STARTUP)
+        if self._pending:
+            self._wakeup.set()
+        self._opened.set()
+        logger.info("🗄 Архив заявок открыт: %s", self.path)
+
+    async def close(self):
+        if self._conn is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._writer_task
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+        self._conn = None
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        # Архив, созданный до появления incident_id
+        columns = {row['name'] for row in conn.execute("PRAGMA table_info(claims)")}
+        if columns and 'incident_id' not in columns:
+            conn.execute("ALTER TABLE claims ADD COLUMN incident_id TEXT")
+        conn.executescript(SCHEMA)
+        version = conn.execute("PRAGMA user_version").fetchone()[0]
+        for number, statement in MIGRATIONS:
+            if number > version:
+                conn.execute(statement)
+                conn.execute(f"PRAGMA user_version = {number}")
+        return conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # Запись
+
+    def add(self, draft, zone=None, incident_id=None):
+        # Строка собирается сразу: черновик удаляется после отправки
+        self._pending.append((
+            draft.claim_id,
+            draft.user_id,
+            draft.username,
+            draft.full_name,
+            draft.phone,
+            normalize_phone(draft.phone),
+            draft.latitude,
+            draft.longitude,
+            draft.car_details,
+            draft.accident_details,
+            ' '.join(draft.plates()),
+            json.dumps(list(draft.photos)),
+            zone,
+            incident_id or draft.claim_id,
+            draft.created_at,
+            time.time()
+        ))
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _writer(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self.flush_interval and not self._closing:
+                await asyncio.sleep(self.flush_interval)
+            await self._flush_pending()
+            if self._closing and not self._pending:
+                return
+
+    async def _flush_pending(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, []
+        try:
+            await self._run(self._write_batch, batch)
+        except Exception:
+            if self._closing:
+                logger.exception("Ошибка записи архива при остановке, заявок потеряно: %s", len(batch))
+                return
+            logger.exception("Ошибка записи архива, заявки будут записаны повторно")
+            self._pending[:0] = batch
+            await asyncio.sleep(1)
+            self._wakeup.set()
+
+    def _write_batch(self, rows):
+        with self._conn:
+            self._conn.executemany(
+                f"INSERT OR IGNORE INTO claims ({', '.join(COLUMNS)}) VALUES ({', '.join('?' * len(COLUMNS))})",
+                rows
+            )
+
+    # Чтение: новые заявки первыми, limit/offset для постраничного вывода
+
+    async def find(self, query, limit=5, offset=0):
+        kind, value = parse_query(query.strip())
+        if kind == 'phone':
+            sql = "SELECT * FROM claims WHERE phone_key = ? ORDER BY id DESC LIMIT ? OFFSET ?"
+        elif value:
+            if kind == 'plate':
+                value = f'plates : "{value}"'
+            sql = (
+                "SELECT * FROM claims WHERE id IN ("
+                "SELECT rowid FROM claims_fts WHERE claims_fts MATCH ? ORDER BY rowid DESC LIMIT ? OFFSET ?"
+                ") ORDER BY id DESC"
+            )
+        else:
+            return []
+        return await self._read(sql, (value, limit, offset))
+
+    async def recent(self, limit=5, offset=0):
+        return await self._read("SELECT * FROM claims ORDER BY id DESC LIMIT ? OFFSET ?", (limit, offset))
+
+    # Поиск ждет открытия архива: при LAZY_STARTUP оно идет в фоне
+    async def _read(self, query, params):
+        await self._opened.wait()
+        if self._conn is None:
+            raise ArchiveUnavailable(f"Архив заявок {self.path} не открыт") from self._open_error
+        return await self._run(self._fetch, query, params)
+
+    def _fetch(self, query, params):
+        return [dict(row) for row in self._conn.execute(query, params)]
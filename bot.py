@@ -1,131 +1,442 @@
+import time
+
+# Отсчет холодного старта начинается до тяжелых импортов (telegram, httpx)
+STARTED_AT = time.perf_counter()
+
+import asyncio
+import importlib.util
 import os
 import logging
-import asyncio
+import re
+import secrets
+from collections import OrderedDict
 from datetime import datetime
-from telegram import Update, ReplyKeyboardMarkup, KeyboardButton
+import httpx
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup, InputMediaPhoto
+from telegram.helpers import escape_markdown
+from telegram.request import HTTPXRequest
 from telegram.ext import (
     Application,
+    CallbackQueryHandler,
     CommandHandler,
-    MessageHandler,
     ConversationHandler,
+    MessageHandler,
+    TypeHandler,
     filters,
     ContextTypes
 )
-from dotenv import load_dotenv
 
-# Загрузка переменных окружения
-load_dotenv()
+from albums import AlbumCollector
+from archive import ArchiveUnavailable, ClaimArchive
+from broker import partition_for
+from concurrency import PerUserUpdateProcessor
+from dispatch import StateDispatcher
+from dedup import IncidentIndex
+from logconfig import set_claim_resolver, setup_logging
+from metrics import DROPOFF, FUNNEL, REGISTRY, InstrumentedRequest, StartupTimer, instrument_conversation
+from models import PHOTO_ADDED, PHOTO_DUPLICATE, ClaimDraft
+from outbox import OutboundCall, Outbox
+from photos import PhotoPipeline
+from routing import load_router
+from scheduler import INJURY, INJURY_NONE, INJURY_SEVERE, DispatchScheduler, injury_level
+from storage import DraftStore, StoragePersistence, create_storage
+from templates import get_templates, templates_for_language
+
+# Загрузка переменных окружения из .env (рядом с bot.py или в рабочем каталоге).
+# На хостинге переменные задает платформа: без файла python-dotenv даже не импортируется
+ENV_FILE = next((
+    path for path in (os.path.join(os.path.dirname(os.path.abspath(__file__)), '.env'), '.env')
+    if os.path.isfile(path)
+), None)
+if ENV_FILE:
+    from dotenv import load_dotenv
+    
+    load_dotenv(ENV_FILE)
 
-# Настройка логирования
-logging.basicConfig(
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s',
-    level=logging.INFO
+# Настройка логирования: JSON (или text) через очередь и отдельный поток вывода,
+# DEBUG-записи пишутся выборочно (доля LOG_DEBUG_SAMPLE_RATE)
+setup_logging(
+    level=os.getenv('LOG_LEVEL', 'INFO').upper(),
+    fmt=os.getenv('LOG_FORMAT', 'json'),
+    debug_sample_rate=float(os.getenv('LOG_DEBUG_SAMPLE_RATE', '0.1'))
 )
 logger = logging.getLogger(__name__)
 
+# Этапы запуска и время до первого обновления (лог, /health, bot_startup_seconds)
+startup = StartupTimer(STARTED_AT)
+
 # Конфигурация
 TOKEN = os.getenv('TELEGRAM_BOT_TOKEN')
 ADMIN_CHAT_ID = os.getenv('ADMIN_CHAT_ID')
 
+# Свой сервер Bot API (telegram-bot-api или поддельный в бенчмарках), например http://localhost:8081
+BOT_API_URL = os.getenv('BOT_API_URL')
+
+# Соединения с Bot API: пул для обычных вызовов (getUpdates ходит через отдельное соединение,
+# чтобы длинный опрос не занимал место в пуле), HTTP/1.1 или 2
+# (HTTP/2 — пакет h2 из python-telegram-bot[http2]; без него остается HTTP/1.1), время жизни простаивающего соединения
+# и таймауты (с); BOT_API_POOL_TIMEOUT — сколько запрос ждет свободное соединение
+BOT_API_POOL_SIZE = int(os.getenv('BOT_API_POOL_SIZE', '16'))
+BOT_API_HTTP_VERSION = os.getenv('BOT_API_HTTP_VERSION', '1.1')
+if BOT_API_HTTP_VERSION == '2' and importlib.util.find_spec('h2') is None:
+    logger.warning("BOT_API_HTTP_VERSION=2 требует python-telegram-bot[http2] (пакет h2), используется HTTP/1.1")
+    BOT_API_HTTP_VERSION = '1.1'
+BOT_API_KEEPALIVE = float(os.getenv('BOT_API_KEEPALIVE', '60'))
+BOT_API_CONNECT_TIMEOUT = float(os.getenv('BOT_API_CONNECT_TIMEOUT', '5'))
+BOT_API_READ_TIMEOUT = float(os.getenv('BOT_API_READ_TIMEOUT', '10'))
+BOT_API_WRITE_TIMEOUT = float(os.getenv('BOT_API_WRITE_TIMEOUT', '10'))
+BOT_API_MEDIA_WRITE_TIMEOUT = float(os.getenv('BOT_API_MEDIA_WRITE_TIMEOUT', '30'))
+BOT_API_POOL_TIMEOUT = float(os.getenv('BOT_API_POOL_TIMEOUT', '10'))
+# Ответ 429 на прямой вызов из обработчика повторяется, если Telegram просит
+# подождать не дольше BOT_API_RETRY_AFTER_MAX секунд (до BOT_API_RATE_LIMIT_RETRIES раз)
+BOT_API_RATE_LIMIT_RETRIES = int(os.getenv('BOT_API_RATE_LIMIT_RETRIES', '3'))
+BOT_API_RETRY_AFTER_MAX = float(os.getenv('BOT_API_RETRY_AFTER_MAX', '10'))
+
+# Режим вебхука включается, если задан WEBHOOK_URL (например, https://<app>.onrender.com)
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', 'telegram')
+# Секрет вебхука проверяется всегда: без WEBHOOK_SECRET он создается при запуске
+# (бот сам вызывает set_webhook, поэтому Telegram получает тот же секрет)
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET') or secrets.token_urlsafe(32)
+WEBHOOK_LISTEN = os.getenv('WEBHOOK_LISTEN', '0.0.0.0')
+PORT = int(os.getenv('PORT', '8443'))
+DRAIN_TIMEOUT = float(os.getenv('DRAIN_TIMEOUT', '25'))
+
+# Холодный старт: обновления, накопившиеся, пока бот не работал, обрабатываются
+# (DROP_PENDING_UPDATES=1 — сбросить их). С LAZY_STARTUP=1 до первого обновления
+# поднимаются только хранилище диалогов и очередь отправки, архив заявок и хранилище
+# фото открываются в фоне, а сервер вебхука принимает запросы еще до инициализации бота
+DROP_PENDING_UPDATES = os.getenv('DROP_PENDING_UPDATES', '0') == '1'
+LAZY_STARTUP = os.getenv('LAZY_STARTUP', '1') == '1'
+# Фоновый запуск ждет первого обновления, но не дольше (с)
+BACKGROUND_STARTUP_DELAY = 1.0
+
+# Хранилище черновиков и состояний диалогов: sqlite (по умолчанию) или memory
+STORAGE_BACKEND = os.getenv('STORAGE_BACKEND', 'sqlite')
+STORAGE_PATH = os.getenv('STORAGE_PATH', 'data/bot.sqlite3')
+PERSISTENCE_INTERVAL = float(os.getenv('PERSISTENCE_INTERVAL', '5'))
+
+# Сколько обновлений обрабатывается одновременно (шаги одного пользователя всегда по порядку)
+MAX_CONCURRENT_UPDATES = int(os.getenv('MAX_CONCURRENT_UPDATES', '256'))
+
+# Несколько процессов-воркеров: WORKERS > 1 или явная роль процесса.
+# all — прием и дочерние воркеры, ingress — только прием, worker — один воркер (раздел WORKER_INDEX).
+# Брокер: sqlite:///<путь> (один сервер) или redis://... (несколько серверов)
+# Ограничения режима: поиск дублей видит только заявки своего воркера (пользователи
+# раздела), автоназначение комиссаров (COMMISSIONER_USER_IDS) отключено.
+WORKERS = int(os.getenv('WORKERS', '1'))
+BOT_ROLE = os.getenv('BOT_ROLE', 'all')
+WORKER_INDEX = int(os.getenv('WORKER_INDEX', '0'))
+BROKER_URL = os.getenv('BROKER_URL', 'sqlite:///data/broker.sqlite3')
+CLUSTER_MODE = WORKERS > 1 or BOT_ROLE != 'all'
+
+# Очередь отправки: число воркеров и лимит сообщений в минуту на чат
+# (лимит на чат общий для всех процессов, поэтому делится между воркерами)
+# и число сетевых ошибок подряд, после которого доставка считается неудачной
+OUTBOX_WORKERS = int(os.getenv('OUTBOX_WORKERS', '4'))
+OUTBOX_RATE_PER_MINUTE = float(os.getenv('OUTBOX_RATE_PER_MINUTE', '20')) / (WORKERS if CLUSTER_MODE else 1)
+OUTBOX_BURST = int(os.getenv('OUTBOX_BURST', '20'))
+OUTBOX_MAX_ATTEMPTS = int(os.getenv('OUTBOX_MAX_ATTEMPTS', '10'))
+
+# Черновики: срок жизни без активности (с), предельное число в памяти,
+# период очистки (с) и напоминание пользователю об удаленном черновике
+DRAFT_TTL = float(os.getenv('DRAFT_TTL', str(24 * 60 * 60)))
+DRAFT_MAX_ENTRIES = int(os.getenv('DRAFT_MAX_ENTRIES', '100000'))
+DRAFT_SWEEP_INTERVAL = float(os.getenv('DRAFT_SWEEP_INTERVAL', '300'))
+DRAFT_EXPIRY_NOTIFY = os.getenv('DRAFT_EXPIRY_NOTIFY', '1') == '1'
+
+# Архив отправленных заявок (по умолчанию в файле хранилища) и размер страницы /find и /recent
+ARCHIVE_PATH = os.getenv('ARCHIVE_PATH') or (STORAGE_PATH if STORAGE_BACKEND == 'sqlite' else ':memory:')
+ARCHIVE_PAGE_SIZE = int(os.getenv('ARCHIVE_PAGE_SIZE', '5'))
+RECENT_LIMIT = 50
+
+# Поиск дублей: заявки за последние DEDUP_WINDOW секунд в радиусе DEDUP_RADIUS_M метров
+# (или с тем же телефоном/госномером) считаются одним ДТП
+DEDUP_WINDOW = float(os.getenv('DEDUP_WINDOW', '1800'))
+DEDUP_RADIUS_M = float(os.getenv('DEDUP_RADIUS_M', '300'))
+
+# Хранилище фото заявок (пусто — фото не скачиваются, в заявке остаются только file_id):
+# воркеры скачивания, процессы для миниатюр, размер миниатюры (px)
+# и порог похожести снимков (бит перцептивного хеша из 64; похожие помечаются в заявке)
+PHOTO_STORE_DIR = os.getenv('PHOTO_STORE_DIR', 'data/photos')
+PHOTO_DOWNLOAD_WORKERS = int(os.getenv('PHOTO_DOWNLOAD_WORKERS', '4'))
+PHOTO_THUMB_PROCESSES = int(os.getenv('PHOTO_THUMB_PROCESSES', '2'))
+PHOTO_THUMB_SIZE = int(os.getenv('PHOTO_THUMB_SIZE', '320'))
+PHOTO_SIMILARITY_BITS = int(os.getenv('PHOTO_SIMILARITY_BITS', '6'))
+
+# Альбом: подтверждение отправляется, когда новых фото группы нет ALBUM_DEBOUNCE секунд
+ALBUM_DEBOUNCE = float(os.getenv('ALBUM_DEBOUNCE', '1.0'))
+
+# Пользователи с доступом к /find и /recent вне чатов администраторов (через запятую)
+ADMIN_USER_IDS = [int(user_id) for user_id in os.getenv('ADMIN_USER_IDS', '').split(',') if user_id.strip()]
+
+# Зоны комиссаров (JSON); без файла все заявки идут в ADMIN_CHAT_ID
+OPERATORS_CONFIG = os.getenv('OPERATORS_CONFIG')
+
+# Автоназначение заявок комиссарам (только в режиме одного процесса): комиссары (через запятую),
+# SLA назначения (мин), средняя скорость для ETA (км/ч), надбавка к приоритету заявки
+# с пострадавшими (мин, для тяжелых последствий — вдвое больше) и допуск опоздания к ETA (мин)
+COMMISSIONER_USER_IDS = [int(user_id) for user_id in os.getenv('COMMISSIONER_USER_IDS', '').split(',') if user_id.strip()]
+DISPATCH_SLA_MINUTES = float(os.getenv('DISPATCH_SLA_MINUTES', '15'))
+DISPATCH_SPEED_KMH = float(os.getenv('DISPATCH_SPEED_KMH', '30'))
+DISPATCH_INJURY_BOOST_MINUTES = float(os.getenv('DISPATCH_INJURY_BOOST_MINUTES', '15'))
+DISPATCH_ARRIVAL_GRACE_MINUTES = float(os.getenv('DISPATCH_ARRIVAL_GRACE_MINUTES', '10'))
+
 # Состояния для ConversationHandler
 LOCATION, PHONE, CAR_DETAILS, ACCIDENT_DETAILS, PHOTOS = range(5)
 
-# Хранилище данных заявки
-user_data_store = {}
-
-# Клавиатуры
-def get_contact_keyboard():
-    return ReplyKeyboardMarkup([
-        [KeyboardButton("📱 Отправить номер", request_contact=True)]
-    ], resize_keyboard=True, one_time_keyboard=True)
-
-def get_location_keyboard():
-    return ReplyKeyboardMarkup([
-        [KeyboardButton("📍 Отправить местоположение", request_location=True)]
-    ], resize_keyboard=True, one_time_keyboard=True)
-
-def get_car_keyboard():
-    return ReplyKeyboardMarkup([
-        ["🚗 Уже заполнил данные"]
-    ], resize_keyboard=True, one_time_keyboard=True)
-
-def get_accident_keyboard():
-    return ReplyKeyboardMarkup([
-        ["📝 Уже заполнил описание"]
-    ], resize_keyboard=True, one_time_keyboard=True)
-
-def get_photos_keyboard():
-    return ReplyKeyboardMarkup([
-        ["✅ Отправить заявку без фото"],
-        ["📷 Прикрепить фото"]
-    ], resize_keyboard=True, one_time_keyboard=True)
-
-def get_final_keyboard():
-    return ReplyKeyboardMarkup([
-        ["✅ Отправить заявку"]
-    ], resize_keyboard=True, one_time_keyboard=True)
-
-def get_start_keyboard():
-    return ReplyKeyboardMarkup([
-        ["🚀 Начать оформление заявки"]
-    ], resize_keyboard=True, one_time_keyboard=True)
+# Названия шагов для метрик
+STATE_NAMES = {
+    PHONE: 'phone',
+    LOCATION: 'location',
+    CAR_DETAILS: 'car_details',
+    ACCIDENT_DETAILS: 'accident_details',
+    PHOTOS: 'photos'
+}
+
+# Ограничения Telegram и заявки
+MAX_PHOTOS = 5
+CAPTION_LIMIT = 1024
+
+# Незаполненное поле заявки: текст напоминания, клавиатура и шаг для возврата
+MISSING_FIELD_PROMPTS = {
+    'phone': ('missing_phone', 'contact', PHONE),
+    'location': ('missing_location', 'location', LOCATION),
+    'car_details': ('missing_car', 'car', CAR_DETAILS),
+    'accident_details': ('missing_accident', 'accident', ACCIDENT_DETAILS),
+}
+
+# Хранилище данных заявки (черновики переживают перезапуск бота)
+user_data_store = DraftStore(ttl=DRAFT_TTL, max_entries=DRAFT_MAX_ENTRIES)
+
+# ID заявки в логах обработчиков берется из черновика пользователя
+set_claim_resolver(lambda user_id: getattr(user_data_store.get(user_id), 'claim_id', None))
+
+# Недоставленное сообщение: в лог с уровнем CRITICAL и, если это не сам чат
+# администраторов, предупреждение туда простым текстом
+def report_failed_delivery(delivery):
+    logger.critical("🚨 Не доставлено: %s (чат %s)", delivery.label, delivery.chat_id)
+    if ADMIN_CHAT_ID and str(delivery.chat_id) != str(ADMIN_CHAT_ID):
+        outbox.submit(
+            ADMIN_CHAT_ID,
+            [OutboundCall('send_message', text=f"⚠️ Не удалось доставить: {delivery.label} (чат {delivery.chat_id})")],
+            label=f"предупреждение о недоставке ({delivery.label})"
+        )
+
+# Чат администраторов или комиссара стал супергруппой: дальше пишем по новому id
+# (в настройках id нужно поменять, иначе после перезапуска снова будет старый)
+def migrate_admin_chat(old_chat_id, new_chat_id):
+    global ADMIN_CHAT_ID
+    if ADMIN_CHAT_ID and str(ADMIN_CHAT_ID) == str(old_chat_id):
+        ADMIN_CHAT_ID = str(new_chat_id)
+    if operator_router is not None:
+        operator_router.migrate_chat(old_chat_id, new_chat_id)
+    logger.warning("⚠️ Чат %s теперь %s — обновите ADMIN_CHAT_ID или OPERATORS_CONFIG", old_chat_id, new_chat_id)
+
+# Фоновая отправка сообщений (заявки администраторам, напоминания пользователям).
+# Недоставленное хранится в хранилище черновиков и досылается после перезапуска;
+# у каждого воркера своя очередь.
+outbox = Outbox(
+    workers=OUTBOX_WORKERS,
+    rate_per_minute=OUTBOX_RATE_PER_MINUTE,
+    burst=OUTBOX_BURST,
+    max_attempts=OUTBOX_MAX_ATTEMPTS,
+    on_failed=report_failed_delivery,
+    on_migrated=migrate_admin_chat,
+    owner=f"worker-{WORKER_INDEX}" if BOT_ROLE == 'worker' else 'main'
+)
+
+# Маршрутизация заявок по зонам комиссаров
+operator_router = load_router(OPERATORS_CONFIG) if OPERATORS_CONFIG else None
+
+# Архив заявок и поисковые запросы, которые листают кнопками (токен → запрос)
+claim_archive = ClaimArchive(ARCHIVE_PATH)
+archive_queries = OrderedDict()
+ARCHIVE_QUERIES_LIMIT = 1000
+
+# Недавние заявки для поиска дублей (в режиме воркеров — только заявки своего раздела)
+incident_index = IncidentIndex(window=DEDUP_WINDOW, radius_m=DEDUP_RADIUS_M)
+
+# Признаки совпадения с уже отправленной заявкой
+DUPLICATE_REASONS = {'phone': "телефон", 'plate': "госномер", 'location': "место и время"}
+
+# Служебный HTTP-сервер режима polling (/health, /metrics)
+status_server = None
+
+# Фоновый запуск второстепенных компонентов (LAZY_STARTUP) и первое обновление, которого он ждет
+background_startup = None
+first_update_seen = asyncio.Event()
+
+# Один SSL-контекст на все клиенты Bot API: загрузка корневых сертификатов занимает
+# десятки мс на каждый клиент httpx, и все они попадают во время холодного старта
+api_ssl_context = None
+
+# Метрики, значения которых ведут сами компоненты
+REGISTRY.gauge('bot_drafts_open', "Незавершенные заявки в памяти", function=lambda: len(user_data_store))
+REGISTRY.gauge('bot_drafts_approx_bytes', "Примерный объем черновиков в памяти (на момент очистки)",
+               function=lambda: user_data_store.approx_bytes)
+REGISTRY.gauge('bot_outbox_depth', "Сообщения в очереди отправки", function=lambda: outbox.stats()['depth'])
+REGISTRY.gauge('bot_outbox_in_flight', "Сообщения, отправляемые прямо сейчас", function=lambda: outbox.in_flight)
+REGISTRY.counter('bot_outbox_delivered', "Доставленные сообщения", function=lambda: outbox.delivered)
+REGISTRY.counter('bot_outbox_failed', "Недоставленные сообщения", function=lambda: outbox.failed)
+REGISTRY.counter('bot_outbox_retries', "Повторы отправки", function=lambda: outbox.retries)
+REGISTRY.register(outbox.latency)
+
+# Убирает из черновика фото с тем же содержимым, что и уже прикрепленное.
+# Повтор находится после скачивания: пользователь к этому моменту уже получил
+# подтверждение с числом фото, но ничего не теряется — та же картинка в заявке есть.
+def drop_duplicate_photo(user_id, claim_id, file_id):
+    draft = user_data_store.get(user_id)
+    if draft is not None and draft.claim_id == claim_id and draft.remove_photo(file_id):
+        user_data_store.save(user_id)
+        logger.info("Повторное фото убрано из заявки %s", claim_id)
+
+# Одно подтверждение на альбом: итог по всем его фото
+def acknowledge_album(album):
+    draft = user_data_store.get(album.user_id)
+    if draft is None:
+        return
+    t = templates_for_language(draft.language)
+    photo_count = len(draft.photos)
+    if photo_count < MAX_PHOTOS:
+        text = t.text('album_received', added=album.added, count=photo_count, left=MAX_PHOTOS - photo_count)
+    else:
+        text = t.text('album_limit', added=album.added)
+    if album.skipped:
+        text += t.text('album_skipped', skipped=album.skipped)
+    outbox.submit(
+        album.chat_id,
+        [OutboundCall('send_message', text=text, reply_markup=t.keyboard('final'))],
+        label=f"альбом пользователя {album.user_id}"
+    )
+
+album_collector = AlbumCollector(window=ALBUM_DEBOUNCE, on_complete=acknowledge_album)
+
+# Фоновое сохранение фото заявок (скачивание, дубли, миниатюры)
+photo_pipeline = PhotoPipeline(
+    PHOTO_STORE_DIR,
+    workers=PHOTO_DOWNLOAD_WORKERS,
+    processes=PHOTO_THUMB_PROCESSES,
+    thumb_size=PHOTO_THUMB_SIZE,
+    phash_distance=PHOTO_SIMILARITY_BITS,
+    on_duplicate=drop_duplicate_photo
+) if PHOTO_STORE_DIR else None
+if photo_pipeline is not None:
+    REGISTRY.gauge('bot_photo_queue', "Фото в очереди на сохранение", function=lambda: photo_pipeline.stats()['queued'])
+    REGISTRY.counter('bot_photos_stored', "Сохраненные фото (новое содержимое)", function=lambda: photo_pipeline.stored)
+    REGISTRY.counter('bot_photo_duplicates', "Повторные фото в заявках", function=lambda: photo_pipeline.duplicates)
+    REGISTRY.counter('bot_photo_similar', "Похожие снимки в заявках", function=lambda: photo_pipeline.similar)
+    REGISTRY.counter('bot_photo_failures', "Фото, которые не удалось сохранить",
+                     function=lambda: photo_pipeline.failed + photo_pipeline.dropped)
+# Назначение комиссара водителю и комиссару; ожидание назначения — в метрику
+def notify_assignment(claim, commissioner):
+    DISPATCH_WAIT.labels(INJURY_LABELS[claim.injury]).observe(claim.wait(time.time()))
+    
+    eta = f"~{claim.eta_min} мин" if claim.eta_min is not None else "неизвестно (пришлите геопозицию)"
+    outbox.submit(
+        commissioner.user_id,
+        [OutboundCall(
+            'send_message',
+            text=(
+                f"📋 Вам назначена заявка {claim.claim_id}\n\n{claim.summary}\n"
+                f"📍 https://www.google.com/maps?q={claim.latitude},{claim.longitude}\n"
+                f"⏱ Время в пути: {eta}\n\nНа месте — /arrived, по завершении — /done"
+            )
+        )],
+        label=f"назначение комиссару {commissioner.user_id}"
+    )
+    
+    t = templates_for_language(claim.language)
+    if claim.eta_min is not None:
+        text = t.text('commissioner_assigned', name=commissioner.name, eta=claim.eta_min)
+    else:
+        text = t.text('commissioner_assigned_no_eta', name=commissioner.name)
+    outbox.submit(
+        claim.user_id,
+        [OutboundCall('send_message', text=text)],
+        label=f"комиссар для пользователя {claim.user_id}"
+    )
+
+# Нарушение SLA: сообщение в чат, куда ушла заявка
+def report_breach(claim, kind):
+    DISPATCH_BREACHES.labels(kind).inc()
+    if kind == 'contact':
+        text = (f"⏰ Заявка {claim.claim_id} ждет комиссара больше {DISPATCH_SLA_MINUTES:g} мин: "
+                f"свободных комиссаров нет")
+    else:
+        commissioner = claim_scheduler.commissioners.get(claim.commissioner_id)
+        text = (f"⏰ Комиссар {commissioner.name if commissioner else claim.commissioner_id} не прибыл "
+                f"по заявке {claim.claim_id}: ETA {claim.eta_min} мин, "
+                f"опоздание больше {DISPATCH_ARRIVAL_GRACE_MINUTES:g} мин")
+    if claim.chat_id:
+        outbox.submit(claim.chat_id, [OutboundCall('send_message', text=text)], label=f"SLA заявки {claim.claim_id}")
+
+# Очередь заявок и свободные комиссары (состояние в памяти, поэтому не в режиме воркеров)
+claim_scheduler = DispatchScheduler(
+    speed_kmh=DISPATCH_SPEED_KMH,
+    sla=DISPATCH_SLA_MINUTES * 60,
+    injury_boost=(0, DISPATCH_INJURY_BOOST_MINUTES * 60, DISPATCH_INJURY_BOOST_MINUTES * 120),
+    arrival_grace=DISPATCH_ARRIVAL_GRACE_MINUTES * 60,
+    on_assign=notify_assignment,
+    on_breach=report_breach
+) if COMMISSIONER_USER_IDS and not CLUSTER_MODE else None
+INJURY_LABELS = {INJURY_NONE: 'none', INJURY: 'injury', INJURY_SEVERE: 'severe'}
+INJURY_MARKS = {INJURY_NONE: "", INJURY: "🩸 Есть пострадавшие\n", INJURY_SEVERE: "🚑 Тяжелые последствия\n"}
+DISPATCH_WAIT = REGISTRY.histogram(
+    'bot_dispatch_wait_seconds', "Ожидание назначения комиссара", ('injury',),
+    buckets=(60, 300, 600, 900, 1800, 3600, 7200)
+)
+DISPATCH_BREACHES = REGISTRY.counter('bot_dispatch_sla_breaches', "Нарушения SLA диспетчерской", ('kind',))
+if claim_scheduler is not None:
+    REGISTRY.gauge('bot_dispatch_queue', "Заявки в очереди на назначение", function=lambda: claim_scheduler.queued)
+    REGISTRY.gauge('bot_commissioners_free', "Свободные комиссары на линии",
+                   function=lambda: claim_scheduler.stats()['commissioners_free'])
+
+DUPLICATES = REGISTRY.counter('bot_claims_linked', "Заявки, связанные с уже отправленными (по признаку)", ('reason',))
 
 # Команда /start
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
-    
-    welcome_text = (
-        f"👋 Здравствуйте, {user.first_name}!\n\n"
-        "Я бот для оформления заявки вызова аварийного комиссара.\n"
-        "Пожалуйста, заполните данные для вызова комиссара.\n\n"
-        "После отправки заявки с вами свяжутся в течение 15 минут."
-    )
+    t = get_templates(user)
     
     # Инициализируем данные пользователя
-    user_data_store[user.id] = {
-        'user_id': user.id,
-        'username': user.username,
-        'full_name': f"{user.first_name} {user.last_name or ''}".strip(),
-        'phone': None,
-        'location': None,
-        'car_details': None,
-        'accident_details': None,
-        'photos': [],
-        'created_at': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        'status': 'new'
-    }
-    
-    await update.message.reply_text(welcome_text, reply_markup=get_start_keyboard())
+    user_data_store[user.id] = ClaimDraft.from_user(user)
+    
+    await update.message.reply_text(
+        t.text('welcome', first_name=user.first_name),
+        reply_markup=t.keyboard('start')
+    )
     
     # Просим отправить номер телефона
     await update.message.reply_text(
-        "📱 **Шаг 1 из 5: Номер телефона**\n\n"
-        "Пожалуйста, нажмите кнопку ниже, чтобы отправить номер телефона для связи:",
-        reply_markup=get_contact_keyboard(),
+        t.text('step_1'),
+        reply_markup=t.keyboard('contact'),
         parse_mode='Markdown'
     )
     
     return PHONE
 
+# Ответ пользователю без черновика заявки
+async def ask_to_start(update: Update):
+    t = get_templates(update.effective_user)
+    await update.message.reply_text(t.text('start_first'), reply_markup=t.keyboard('start'))
+    return ConversationHandler.END
+
 # Обработка контакта (телефон)
 async def handle_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     if user.id not in user_data_store:
-        await update.message.reply_text(
-            "Пожалуйста, начните с /start",
-            reply_markup=get_start_keyboard()
-        )
-        return ConversationHandler.END
+        return await ask_to_start(update)
     
+    t = get_templates(user)
     contact = update.message.contact
-    user_data_store[user.id]['phone'] = contact.phone_number
+    user_data_store[user.id].phone = contact.phone_number
+    user_data_store.save(user.id)
     
     await update.message.reply_text(
-        f"✅ **Номер телефона получен:** `{contact.phone_number}`\n\n"
-        "📍 **Шаг 2 из 5: Местоположение ДТП**\n\n"
-        "Пожалуйста, отправьте геолокацию места ДТП:",
-        reply_markup=get_location_keyboard(),
+        t.text('phone_received', phone=contact.phone_number),
+        reply_markup=t.keyboard('location'),
         parse_mode='Markdown'
     )
     
@@ -136,135 +447,117 @@ async def handle_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     if user.id not in user_data_store:
-        await update.message.reply_text(
-            "Пожалуйста, начните с /start",
-            reply_markup=get_start_keyboard()
-        )
-        return ConversationHandler.END
+        return await ask_to_start(update)
     
+    t = get_templates(user)
     location = update.message.location
-    user_data_store[user.id]['location'] = {
-        'latitude': location.latitude,
-        'longitude': location.longitude
-    }
+    user_data_store[user.id].set_location(location.latitude, location.longitude)
+    user_data_store.save(user.id)
     
     await update.message.reply_text(
-        f"✅ **Местоположение получено!**\n\n"
-        "🚗 **Шаг 3 из 5: Данные автомобиля**\n\n"
-        "Пожалуйста, введите данные автомобиля:\n"
-        "• Марка и модель\n"
-        "• Госномер\n"
-        "• VIN (при наличии)\n\n"
-        "Пример: *Toyota Camry, А123ВС77, JTNBB46KX00345678*\n\n"
-        "Введите данные в одном сообщении:",
-        reply_markup=get_car_keyboard(),
+        t.text('location_received'),
+        reply_markup=t.keyboard('car'),
         parse_mode='Markdown'
     )
     
     return CAR_DETAILS
 
+# Подсказки при нажатии на кнопку вместо отправки контакта/геолокации
+async def remind_contact(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    t = get_templates(update.effective_user)
+    await update.message.reply_text(t.text('press_contact'), reply_markup=t.keyboard('contact'))
+
+async def remind_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    t = get_templates(update.effective_user)
+    await update.message.reply_text(t.text('press_location'), reply_markup=t.keyboard('location'))
+
 # Обработка данных автомобиля
 async def handle_car_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     if user.id not in user_data_store:
-        await update.message.reply_text(
-            "Пожалуйста, начните с /start",
-            reply_markup=get_start_keyboard()
-        )
-        return ConversationHandler.END
+        return await ask_to_start(update)
     
+    t = get_templates(user)
     text = update.message.text.strip()
     
-    # Если пользователь нажал кнопку "🚗 Уже заполнил данные"
-    if text == "🚗 Уже заполнил данные":
-        # Проверяем, были ли уже введены данные
-        if user_data_store[user.id].get('car_details'):
-            await update.message.reply_text(
-                "📝 **Шаг 4 из 5: Описание ДТП**\n\n"
-                "Пожалуйста, опишите обстоятельства ДТП:\n"
-                "• Дата и время ДТП\n"
-                "• Обстоятельства происшествия\n"
-                "• Есть ли пострадавшие\n"
-                "• Количество участников\n\n"
-                "Введите описание в одном сообщении:",
-                reply_markup=get_accident_keyboard(),
-                parse_mode='Markdown'
-            )
-            return ACCIDENT_DETAILS
-        else:
-            await update.message.reply_text(
-                "Вы еще не ввели данные автомобиля. Пожалуйста, введите данные:",
-                reply_markup=get_car_keyboard()
-            )
-            return CAR_DETAILS
-    
     # Сохраняем данные автомобиля
-    user_data_store[user.id]['car_details'] = text
+    user_data_store[user.id].car_details = text
+    user_data_store.save(user.id)
     
     await update.message.reply_text(
-        f"✅ **Данные автомобиля сохранены!**\n\n"
-        "📝 **Шаг 4 из 5: Описание ДТП**\n\n"
-        "Пожалуйста, опишите обстоятельства ДТП:\n"
-        "• Дата и время ДТП\n"
-        "• Обстоятельства происшествия\n"
-        "• Есть ли пострадавшие\n"
-        "• Количество участников\n\n"
-        "Введите описание в одном сообщении:",
-        reply_markup=get_accident_keyboard(),
+        t.text('car_saved'),
+        reply_markup=t.keyboard('accident'),
         parse_mode='Markdown'
     )
     
     return ACCIDENT_DETAILS
 
-# Обработка описания ДТП
-async def handle_accident_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
+# Кнопка "🚗 Уже заполнил данные"
+async def car_details_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     if user.id not in user_data_store:
+        return await ask_to_start(update)
+    
+    t = get_templates(user)
+    
+    # Проверяем, были ли уже введены данные
+    if user_data_store[user.id].car_details:
         await update.message.reply_text(
-            "Пожалуйста, начните с /start",
-            reply_markup=get_start_keyboard()
+            t.text('step_4'),
+            reply_markup=t.keyboard('accident'),
+            parse_mode='Markdown'
         )
-        return ConversationHandler.END
+        return ACCIDENT_DETAILS
     
-    text = update.message.text.strip()
+    await update.message.reply_text(t.text('car_missing'), reply_markup=t.keyboard('car'))
+    return CAR_DETAILS
+
+# Обработка описания ДТП
+async def handle_accident_details(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
     
-    # Если пользователь нажал кнопку "📝 Уже заполнил описание"
-    if text == "📝 Уже заполнил описание":
-        # Проверяем, было ли уже введено описание
-        if user_data_store[user.id].get('accident_details'):
-            await update.message.reply_text(
-                "📷 **Шаг 5 из 5: Фотографии**\n\n"
-                "Вы можете прикрепить фотографии ДТП (до 5 фото):\n"
-                "• Фото места происшествия\n"
-                "• Фото повреждений\n"
-                "• Фото документов\n\n"
-                "Отправляйте фотографии по одной или нажмите кнопку ниже:",
-                reply_markup=get_photos_keyboard()
-            )
-            return PHOTOS
-        else:
-            await update.message.reply_text(
-                "Вы еще не ввели описание ДТП. Пожалуйста, опишите обстоятельства:",
-                reply_markup=get_accident_keyboard()
-            )
-            return ACCIDENT_DETAILS
+    if user.id not in user_data_store:
+        return await ask_to_start(update)
+    
+    t = get_templates(user)
+    text = update.message.text.strip()
     
     # Сохраняем описание ДТП
-    user_data_store[user.id]['accident_details'] = text
+    user_data_store[user.id].accident_details = text
+    user_data_store.save(user.id)
     
-    await update.message.reply_text(
-        f"✅ **Описание ДТП сохранено!**\n\n"
-        "📷 **Шаг 5 из 5: Фотографии**\n\n"
-        "Вы можете прикрепить фотографии ДТП (до 5 фото):\n"
-        "• Фото места происшествия\n"
-        "• Фото повреждений\n"
-        "• Фото документов\n\n"
-        "Отправляйте фотографии по одной или нажмите кнопку ниже:",
-        reply_markup=get_photos_keyboard()
-    )
+    await update.message.reply_text(t.text('accident_saved'), reply_markup=t.keyboard('photos'))
+    
+    return PHOTOS
+
+# Кнопка "📝 Уже заполнил описание"
+async def accident_details_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    
+    if user.id not in user_data_store:
+        return await ask_to_start(update)
+    
+    t = get_templates(user)
+    
+    # Проверяем, было ли уже введено описание
+    if user_data_store[user.id].accident_details:
+        await update.message.reply_text(t.text('step_5'), reply_markup=t.keyboard('photos'))
+        return PHOTOS
+    
+    await update.message.reply_text(t.text('accident_missing'), reply_markup=t.keyboard('accident'))
+    return ACCIDENT_DETAILS
+
+# Кнопка "📷 Прикрепить фото"
+async def attach_photos(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    
+    if user.id not in user_data_store:
+        return await ask_to_start(update)
     
+    t = get_templates(user)
+    await update.message.reply_text(t.text('attach_photos'), reply_markup=t.keyboard('final'))
     return PHOTOS
 
 # Обработка фотографий
@@ -272,170 +565,191 @@ async def handle_photos(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     if user.id not in user_data_store:
-        await update.message.reply_text(
-            "Пожалуйста, начните с /start",
-            reply_markup=get_start_keyboard()
-        )
-        return ConversationHandler.END
+        return await ask_to_start(update)
     
-    text = update.message.text if update.message.text else ""
+    t = get_templates(user)
+    photo = update.message.photo[-1]
+    draft = user_data_store[user.id]
+    # Проверка лимита и добавление без await между ними: лимит не превысить
+    # даже при параллельной обработке; повторно присланный файл места не занимает
+    status = draft.add_photo(photo.file_id, photo.file_unique_id, limit=MAX_PHOTOS)
+    if status == PHOTO_ADDED:
+        user_data_store.save(user.id)
+        if photo_pipeline is not None:
+            photo_pipeline.submit(user.id, draft.claim_id, photo.file_id, photo.file_unique_id)
     
-    # Если пользователь хочет отправить заявку без фото
-    if text == "✅ Отправить заявку без фото":
-        return await send_application(update, context)
+    # Фото альбома подтверждаются одним сообщением после последнего фото группы
+    if update.message.media_group_id:
+        album_collector.add(user.id, update.effective_chat.id, update.message.media_group_id, status)
+        return PHOTOS
     
-    # Если пользователь хочет прикрепить фото
-    if text == "📷 Прикрепить фото":
-        await update.message.reply_text(
-            "Пожалуйста, отправьте фотографии. Можно отправить до 5 фото.\n"
-            "После отправки фото нажмите '✅ Отправить заявку'",
-            reply_markup=get_final_keyboard()
-        )
+    if status == PHOTO_DUPLICATE:
+        await update.message.reply_text(t.text('photo_duplicate'), reply_markup=t.keyboard('final'))
         return PHOTOS
     
-    # Если это фото
-    if update.message.photo:
-        photo = update.message.photo[-1]
-        user_data_store[user.id]['photos'].append(photo.file_id)
-        
-        photo_count = len(user_data_store[user.id]['photos'])
-        
-        if photo_count < 5:
-            await update.message.reply_text(
-                f"✅ Фото #{photo_count} получено.\n"
-                f"Можно отправить еще {5 - photo_count} фото.\n\n"
-                "Продолжайте отправлять фото или нажмите '✅ Отправить заявку'",
-                reply_markup=get_final_keyboard()
-            )
-        else:
-            await update.message.reply_text(
-                "✅ Максимальное количество фото (5) достигнуто.\n"
-                "Нажмите '✅ Отправить заявку' для завершения",
-                reply_markup=get_final_keyboard()
-            )
+    photo_count = len(draft.photos)
+    
+    if status == PHOTO_ADDED and photo_count < MAX_PHOTOS:
+        await update.message.reply_text(
+            t.text('photo_received', count=photo_count, left=MAX_PHOTOS - photo_count),
+            reply_markup=t.keyboard('final')
+        )
+    else:
+        await update.message.reply_text(t.text('photo_limit'), reply_markup=t.keyboard('final'))
     
     return PHOTOS
 
+# Чат комиссара, ответственного за место ДТП (или общий чат администраторов)
+def pick_admin_chat(latitude, longitude):
+    if operator_router is not None:
+        zone = operator_router.route(latitude, longitude)
+        if zone is not None:
+            return zone.chat_id, zone.name
+    return ADMIN_CHAT_ID, None
+
+# Текст пользователя внутри разметки Markdown заявки
+def md(value):
+    return escape_markdown(str(value))
+
+# Та же сводка без разметки: убираем * и ` и снимаем экранирование
+def plain_text(markdown_text):
+    return re.sub(r'\\([_*`\[])|[*`]', lambda match: match.group(1) or '', markdown_text)
+
+# Вызов с альбомом заявки (одно фото — send_photo)
+def photo_call(photos, caption, parse_mode=None, fallback=None):
+    if len(photos) == 1:
+        return OutboundCall('send_photo', fallback=fallback, photo=photos[0], caption=caption, parse_mode=parse_mode)
+    media = [InputMediaPhoto(photo_id) for photo_id in photos]
+    media[0] = InputMediaPhoto(photos[0], caption=caption, parse_mode=parse_mode)
+    return OutboundCall('send_media_group', fallback=fallback, media=media)
+
+# Сообщения заявки для администратора: сводка и фото одним альбомом.
+# Сводка идет подписью к альбому, если укладывается в лимит подписи,
+# иначе отдельным сообщением перед альбомом. Если Telegram не принял разметку,
+# та же сводка уходит простым текстом, поэтому заявка не теряется.
+def build_admin_calls(admin_message, photos, full_name):
+    photos = photos[:MAX_PHOTOS]
+    plain_message = plain_text(admin_message)
+    plain_summary = OutboundCall('send_message', text=plain_message)
+    summary = OutboundCall('send_message', fallback=plain_summary, text=admin_message, parse_mode='Markdown')
+    
+    if not photos:
+        return [summary]
+    
+    # Длина с разметкой не меньше длины после разбора, поэтому проверка с запасом
+    if len(admin_message) <= CAPTION_LIMIT:
+        # Подпись без разметки, а если не ушел и альбом — хотя бы сводка
+        fallback = photo_call(photos, plain_message, fallback=plain_summary)
+        return [photo_call(photos, admin_message, 'Markdown', fallback=fallback)]
+    return [summary, photo_call(photos, f"Фото от {full_name}")]
+
 # Отправка заявки
 async def send_application(update: Update, context: ContextTypes.DEFAULT_TYPE):
     user = update.effective_user
     
     if user.id not in user_data_store:
-        await update.message.reply_text(
-            "Пожалуйста, начните с /start",
-            reply_markup=get_start_keyboard()
-        )
-        return ConversationHandler.END
-    
-    data = user_data_store[user.id]
+        return await ask_to_start(update)
     
-    # Проверяем заполнены ли все обязательные поля
-    missing_fields = []
-    if not data.get('phone'): 
-        missing_fields.append("номер телефона")
-    if not data.get('location'): 
-        missing_fields.append("местоположение")
-    if not data.get('car_details'): 
-        missing_fields.append("данные автомобиля")
-    if not data.get('accident_details'): 
-        missing_fields.append("описание ДТП")
+    t = get_templates(user)
+    draft = user_data_store[user.id]
     
+    # Проверяем заполнены ли все обязательные поля (возвращаемся к первому незаполненному шагу)
+    missing_fields = draft.missing_fields()
     if missing_fields:
-        error_text = "⚠️ **Не все данные заполнены!**\n\n"
-        
-        if not data.get('phone'):
-            error_text += "📱 **Номер телефона:** не указан\n"
-            await update.message.reply_text(
-                error_text + "\nПожалуйста, отправьте номер телефона:",
-                reply_markup=get_contact_keyboard(),
-                parse_mode='Markdown'
-            )
-            return PHONE
-        elif not data.get('location'):
-            error_text += "📍 **Местоположение:** не указано\n"
-            await update.message.reply_text(
-                error_text + "\nПожалуйста, отправьте местоположение:",
-                reply_markup=get_location_keyboard(),
-                parse_mode='Markdown'
-            )
-            return LOCATION
-        elif not data.get('car_details'):
-            error_text += "🚗 **Данные автомобиля:** не указаны\n"
-            await update.message.reply_text(
-                error_text + "\nПожалуйста, введите данные автомобиля:",
-                reply_markup=get_car_keyboard(),
-                parse_mode='Markdown'
-            )
-            return CAR_DETAILS
-        elif not data.get('accident_details'):
-            error_text += "📝 **Описание ДТП:** не указано\n"
-            await update.message.reply_text(
-                error_text + "\nПожалуйста, опишите обстоятельства ДТП:",
-                reply_markup=get_accident_keyboard(),
-                parse_mode='Markdown'
-            )
-            return ACCIDENT_DETAILS
+        text_key, keyboard, state = MISSING_FIELD_PROMPTS[missing_fields[0]]
+        await update.message.reply_text(
+            t.text('missing_header') + t.text(text_key),
+            reply_markup=t.keyboard(keyboard),
+            parse_mode='Markdown'
+        )
+        return state
     
     try:
         # Формируем сообщение для администратора
-        map_url = f"https://www.google.com/maps?q={data['location']['latitude']},{data['location']['longitude']}"
+        map_url = f"https://www.google.com/maps?q={draft.latitude},{draft.longitude}"
         
         admin_message = (
             "🚨 *НОВАЯ ЗАЯВКА АВАРИЙНОГО КОМИССАРА*\n\n"
-            f"👤 *Клиент:* {data['full_name']}\n"
-            f"📱 *Телефон:* `{data['phone']}`\n"
+            f"👤 *Клиент:* {md(draft.full_name)}\n"
+            f"📱 *Телефон:* `{draft.phone}`\n"
             f"📍 *Местоположение:* {map_url}\n"
-            f"🚗 *Автомобиль:* {data['car_details']}\n"
-            f"📝 *Описание ДТП:*\n{data['accident_details']}\n"
-            f"📷 *Фотографий:* {len(data['photos'])}\n"
-            f"🕒 *Время заявки:* {data['created_at']}\n"
-            f"🆔 *ID пользователя:* {user.id}"
+            f"🚗 *Автомобиль:* {md(draft.car_details)}\n"
+            f"📝 *Описание ДТП:*\n{md(draft.accident_details)}\n"
+            f"📷 *Фотографий:* {len(draft.photos)}\n"
+            f"🕒 *Время заявки:* {draft.created_at}\n"
+            f"🆔 *ID пользователя:* {user.id}\n"
+            f"🔖 *Заявка:* `{draft.claim_id}`"
         )
         
-        if data['username']:
-            admin_message += f"\n👤 *Username:* @{data['username']}"
+        if draft.username:
+            admin_message += f"\n👤 *Username:* @{md(draft.username)}"
+        
+        # Похожие снимки остаются в заявке, администратор видит пометку
+        # (учитываются фото, которые уже успели сохраниться)
+        if photo_pipeline is not None:
+            similar = await photo_pipeline.similar_photos(draft.claim_id)
+            if similar:
+                admin_message += f"\n🔁 *Похожие фото:* {len(similar)} (возможно, повторные снимки)"
+        
+        # Дубль уже отправленной заявки идет тому же комиссару одним инцидентом,
+        # иначе выбираем комиссара по месту ДТП
+        incident, reasons = incident_index.match(draft)
+        if incident is not None:
+            admin_chat_id, zone_name = incident.chat_id, incident.zone
+            linked = ', '.join(f"`{claim_id}`" for claim_id in incident.claim_ids)
+            admin_message += (
+                f"\n\n🔗 *Возможно, то же ДТП* ({', '.join(DUPLICATE_REASONS[reason] for reason in reasons)}):"
+                f"\nинцидент `{incident.incident_id}`, заявки {linked}"
+            )
+            for reason in reasons:
+                DUPLICATES.labels(reason).inc()
+        else:
+            admin_chat_id, zone_name = pick_admin_chat(draft.latitude, draft.longitude)
+        incident = incident_index.add(draft, incident, chat_id=admin_chat_id, zone=zone_name)
+        if zone_name:
+            admin_message += f"\n🗺 *Зона:* {md(zone_name)}"
         
         # Отправляем администратору
-        if ADMIN_CHAT_ID:
-            await context.bot.send_message(
-                chat_id=ADMIN_CHAT_ID,
-                text=admin_message,
-                parse_mode='Markdown'
+        if admin_chat_id:
+            # Доставка в фоне: пользователь сразу получает подтверждение,
+            # а лимиты и сбои Telegram обрабатывает очередь отправки
+            outbox.submit(
+                admin_chat_id,
+                build_admin_calls(admin_message, draft.photos, draft.full_name),
+                label=f"заявка {draft.claim_id} пользователя {user.id}"
+            )
+        
+        # Сохраняем в архив для поиска администраторами
+        claim_archive.add(draft, zone=zone_name, incident_id=incident.incident_id)
+        
+        # В очередь на назначение комиссара (назначение и уведомления — в notify_assignment)
+        if claim_scheduler is not None:
+            claim_scheduler.add_claim(
+                draft.claim_id, user.id, draft.latitude, draft.longitude, draft.accident_details,
+                chat_id=admin_chat_id,
+                summary=(
+                    f"👤 {draft.full_name}, 📱 {draft.phone}\n🚗 {draft.car_details}\n"
+                    f"{INJURY_MARKS[injury_level(draft.accident_details)]}📝 {draft.accident_details}"
+                ),
+                language=draft.language
             )
-            
-            # Отправляем фото если есть
-            if data['photos']:
-                for i, photo_id in enumerate(data['photos'][:5], 1):
-                    try:
-                        caption = f"Фото {i} от {data['full_name']}" if i == 1 else None
-                        await context.bot.send_photo(
-                            chat_id=ADMIN_CHAT_ID,
-                            photo=photo_id,
-                            caption=caption
-                        )
-                        await asyncio.sleep(0.3)  # Небольшая задержка между фото
-                    except Exception as e:
-                        logger.error(f"Ошибка отправки фото {i}: {e}")
         
         # Подтверждение пользователю
         await update.message.reply_text(
-            "✅ *Заявка успешно отправлена!*\n\n"
-            f"📞 *С вами свяжутся в течение 15 минут по номеру:* `{data['phone']}`\n\n"
-            "Спасибо за обращение! 🚗\n\n"
-            "Для новой заявки нажмите /start",
-            reply_markup=get_start_keyboard(),
+            t.text('submitted', phone=draft.phone),
+            reply_markup=t.keyboard('start'),
             parse_mode='Markdown'
         )
         
+        FUNNEL.labels('submitted').inc()
+        
         # Очищаем данные
         del user_data_store[user.id]
+        album_collector.discard(user.id)
         
-    except Exception as e:
-        logger.error(f"Ошибка при отправке заявки: {e}")
-        await update.message.reply_text(
-            "⚠️ Произошла ошибка при отправке заявки. Пожалуйста, попробуйте еще раз с помощью /start",
-            reply_markup=get_start_keyboard()
-        )
+    except Exception:
+        logger.exception("Ошибка при отправке заявки пользователя %s", user.id)
+        await update.message.reply_text(t.text('submit_error'), reply_markup=t.keyboard('start'))
     
     return ConversationHandler.END
 
@@ -445,83 +759,423 @@ async def cancel(update: Update, context: ContextTypes.DEFAULT_TYPE):
     
     if user.id in user_data_store:
         del user_data_store[user.id]
+    album_collector.discard(user.id)
     
-    await update.message.reply_text(
-        "❌ Заявка отменена.\n\n"
-        "Для новой заявки нажмите /start",
-        reply_markup=get_start_keyboard()
-    )
+    t = get_templates(user)
+    await update.message.reply_text(t.text('cancelled'), reply_markup=t.keyboard('start'))
     
     return ConversationHandler.END
 
 # Обработка команды /help
 async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
-    help_text = (
-        "🤖 *Помощь по боту аварийного комиссара*\n\n"
-        "Доступные команды:\n"
-        "/start - Начать оформление заявки\n"
-        "/help - Показать это сообщение\n\n"
-        "После оформления заявки с вами свяжутся в течение 15 минут."
-    )
+    t = get_templates(update.effective_user)
     
     await update.message.reply_text(
-        help_text,
+        t.text('help'),
         parse_mode='Markdown',
-        reply_markup=get_start_keyboard()
+        reply_markup=t.keyboard('start')
     )
 
-# Основная функция
-def main():
-    # Проверяем наличие токена
-    if not TOKEN:
-        logger.error("❌ Токен бота не найден! Установите TELEGRAM_BOT_TOKEN")
+# Чаты, где доступны /find и /recent: общий чат администраторов и чаты комиссаров
+def admin_chat_ids():
+    chat_ids = set()
+    if ADMIN_CHAT_ID and ADMIN_CHAT_ID.lstrip('-').isdigit():
+        chat_ids.add(int(ADMIN_CHAT_ID))
+    if operator_router is not None:
+        chat_ids.update(zone.chat_id for zone in operator_router.zones)
+    return chat_ids
+
+# Заявка из архива в списке результатов
+def format_archived_claim(claim):
+    details = claim['accident_details'] or ''
+    if len(details) > 120:
+        details = details[:120] + '…'
+    lines = [
+        f"🔖 {claim['claim_id']} · {claim['created_at']}",
+        f"👤 {claim['full_name']}, {claim['phone']}",
+        f"🚗 {claim['car_details']}",
+        f"📝 {details}"
+    ]
+    if claim['zone']:
+        lines.append(f"🗺 {claim['zone']}")
+    if claim['incident_id'] and claim['incident_id'] != claim['claim_id']:
+        lines.append(f"🔗 инцидент {claim['incident_id']}")
+    return '\n'.join(lines)
+
+def remember_archive_query(query):
+    token = secrets.token_hex(4)
+    archive_queries[token] = query
+    while len(archive_queries) > ARCHIVE_QUERIES_LIMIT:
+        archive_queries.popitem(last=False)
+    return token
+
+# Страница результатов: текст и кнопки листания (callback_data "arch:<токен>:<смещение>")
+async def render_archive_page(token, offset):
+    kind, value = archive_queries[token]
+    try:
+        if kind == 'find':
+            title = f"🔎 Поиск: {value}"
+            # Лишняя строка показывает, есть ли следующая страница
+            claims = await claim_archive.find(value, limit=ARCHIVE_PAGE_SIZE + 1, offset=offset)
+            has_next = len(claims) > ARCHIVE_PAGE_SIZE
+        else:
+            title = f"🕒 Последние заявки: {value}"
+            claims = await claim_archive.recent(limit=min(ARCHIVE_PAGE_SIZE, value - offset), offset=offset)
+            has_next = offset + ARCHIVE_PAGE_SIZE < value and len(claims) == ARCHIVE_PAGE_SIZE
+    except ArchiveUnavailable:
+        logger.exception("Архив заявок недоступен")
+        return "⚠️ Архив заявок недоступен, подробности в логе", None
+    claims = claims[:ARCHIVE_PAGE_SIZE]
+    
+    if not claims:
+        return f"{title}\n\nНичего не найдено", None
+    
+    page = offset // ARCHIVE_PAGE_SIZE + 1
+    text = f"{title} (стр. {page})\n\n" + '\n\n'.join(map(format_archived_claim, claims))
+    buttons = []
+    if offset:
+        buttons.append(InlineKeyboardButton("◀️", callback_data=f"arch:{token}:{max(0, offset - ARCHIVE_PAGE_SIZE)}"))
+    if has_next:
+        buttons.append(InlineKeyboardButton("▶️", callback_data=f"arch:{token}:{offset + ARCHIVE_PAGE_SIZE}"))
+    return text, InlineKeyboardMarkup([buttons]) if buttons else None
+
+# Команда /find <номер|телефон|текст> (для администраторов)
+async def find_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = ' '.join(context.args).strip()
+    if not query:
+        await update.message.reply_text("Использование: /find <госномер | VIN | телефон | текст>")
         return
     
-    logger.info("🚀 Запуск бота аварийного комиссара...")
+    text, markup = await render_archive_page(remember_archive_query(('find', query)), 0)
+    await update.message.reply_text(text, reply_markup=markup)
+
+# Команда /recent [N] (для администраторов)
+async def recent_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    try:
+        limit = int(context.args[0]) if context.args else 10
+    except ValueError:
+        await update.message.reply_text("Использование: /recent [N]")
+        return
+    limit = max(1, min(limit, RECENT_LIMIT))
+    
+    text, markup = await render_archive_page(remember_archive_query(('recent', limit)), 0)
+    await update.message.reply_text(text, reply_markup=markup)
+
+# Листание результатов /find и /recent. Фильтры команд для кнопок не работают
+# (сообщение с кнопками отправил бот), поэтому доступ проверяется по чату и нажавшему.
+async def archive_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    query = update.callback_query
+    if update.effective_chat.id not in admin_chat_ids() and update.effective_user.id not in ADMIN_USER_IDS:
+        await query.answer()
+        return
+    _, token, offset = query.data.split(':')
+    
+    if token not in archive_queries:
+        await query.answer("Результаты устарели, повторите поиск", show_alert=True)
+        return
+    
+    await query.answer()
+    text, markup = await render_archive_page(token, int(offset))
+    await query.edit_message_text(text, reply_markup=markup)
+
+# Команда /zone (для администраторов): доступность зон комиссаров для новых заявок.
+# /zone — список зон; /zone on|off в чате зоны — эта зона; /zone <название> on|off — по названию.
+# Недоступная зона не получает заявок: они идут в ближайшую доступную.
+# Состояние в памяти процесса (в режиме воркеров — только у воркера, принявшего команду).
+async def zone_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    args = context.args
+    if args and args[-1].lower() in ('on', 'off'):
+        available = args[-1].lower() == 'on'
+        name = ' '.join(args[:-1])
+        if name:
+            zones = [zone for zone in operator_router.zones if zone.name.lower() == name.lower()]
+        else:
+            zones = [zone for zone in operator_router.zones if zone.chat_id == update.effective_chat.id]
+        if not zones:
+            await update.message.reply_text(f"Зона {name or 'этого чата'} не найдена")
+            return
+        for zone in zones:
+            operator_router.set_available(zone.chat_id, available)
+            logger.info("🗺 Зона %s %s", zone.name, "доступна" if available else "недоступна")
+    elif args:
+        await update.message.reply_text("Использование: /zone [название] [on|off]")
+        return
+    
+    lines = [
+        f"{'🟢' if zone.chat_id not in operator_router.unavailable else '⚪️'} {zone.name}"
+        for zone in operator_router.zones
+    ]
+    await update.message.reply_text("🗺 Зоны комиссаров:\n" + '\n'.join(lines))
+
+# Команды комиссара: /online, /offline, /arrived, /done.
+# Зона, заявки которой идут в личный чат комиссара, доступна, пока он на линии.
+async def commissioner_online(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    user = update.effective_user
+    if operator_router is not None:
+        operator_router.set_available(user.id, True)
+    assignments = claim_scheduler.set_online(user.id, user.full_name)
+    commissioner = claim_scheduler.commissioner(user.id)
+    text = "🟢 Вы на линии."
+    if commissioner.latitude is None:
+        text += " Отправьте геопозицию (лучше трансляцию), чтобы получать ближайшие заявки."
+    if not assignments and commissioner.free:
+        text += " Открытых заявок нет — пришлем, как только появится."
+    await update.message.reply_text(text)
+
+async def commissioner_offline(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    commissioner = claim_scheduler.commissioners.get(update.effective_user.id)
+    claim_id = commissioner.claim_id if commissioner else None
+    claim_scheduler.set_offline(update.effective_user.id)
+    if operator_router is not None:
+        operator_router.set_available(update.effective_user.id, False)
+    text = "⚪️ Вы сняты с линии."
+    if claim_id:
+        text += f" Заявка {claim_id} возвращена в очередь."
+    await update.message.reply_text(text)
+
+async def commissioner_arrived(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    claim = claim_scheduler.mark_arrived(update.effective_user.id)
+    if claim is None:
+        await update.message.reply_text("Нет активной заявки.")
+        return
+    await update.message.reply_text(f"📍 Прибытие по заявке {claim.claim_id} отмечено. По завершении — /done")
+
+async def commissioner_done(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    claim, assignments = claim_scheduler.complete(update.effective_user.id)
+    if claim is None:
+        await update.message.reply_text("Нет активной заявки.")
+        return
+    text = f"✅ Заявка {claim.claim_id} закрыта."
+    if not assignments:
+        text += " Открытых заявок нет."
+    await update.message.reply_text(text)
+
+# Геопозиция комиссара (и обновления трансляции) — для выбора ближайшего и ETA
+async def commissioner_location(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    location = update.effective_message.location
+    claim_scheduler.update_location(update.effective_user.id, location.latitude, location.longitude)
+
+# Команда /queue: открытые заявки по приоритету (для комиссаров и администраторов)
+async def queue_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    stats = claim_scheduler.stats()
+    now = time.time()
+    lines = [
+        f"📋 В очереди: {stats['queued']}, комиссаров на линии: {stats['commissioners_online']}, "
+        f"свободны: {stats['commissioners_free']}"
+    ]
+    for claim in claim_scheduler.queue(10):
+        mark = INJURY_MARKS[claim.injury].strip()
+        lines.append(f"• {claim.claim_id} — ждет {claim.wait(now) / 60:.0f} мин {mark}".rstrip())
+    await update.message.reply_text('\n'.join(lines))
+
+# Таймер SLA диспетчерской из JobQueue
+async def run_dispatch_timer(context: ContextTypes.DEFAULT_TYPE):
+    context.job.data()
+
+# Периодическая очистка брошенных черновиков
+async def sweep_drafts(context: ContextTypes.DEFAULT_TYPE):
+    removed = user_data_store.sweep()
+    if removed:
+        logger.info("🧹 Удалено брошенных черновиков: %s", len(removed))
+    
+    # Шаг, на котором пользователь бросил заявку
+    for _, draft in removed:
+        missing_fields = draft.missing_fields()
+        DROPOFF.labels(missing_fields[0] if missing_fields else 'photos').inc()
+    
+    if DRAFT_EXPIRY_NOTIFY:
+        for user_id, draft in removed:
+            t = templates_for_language(draft.language)
+            outbox.submit(
+                user_id,
+                [OutboundCall('send_message', text=t.text('draft_expired'), reply_markup=t.keyboard('start'))],
+                label=f"напоминание пользователю {user_id}"
+            )
+
+# Состояние для /health
+def status_stats():
+    stats = {'outbox': outbox.stats(), 'drafts': user_data_store.stats()}
+    if photo_pipeline is not None:
+        stats['photos'] = photo_pipeline.stats()
+    if claim_scheduler is not None:
+        stats['dispatch'] = claim_scheduler.stats()
+    stats['startup'] = startup.stats()
+    return stats
+
+# Первое обновление после запуска: итог холодного старта в лог
+async def note_first_update(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    if 'first_update' not in startup.phases:
+        startup.mark('first_update')
+        first_update_seen.set()
+        logger.info("🚀 Холодный старт, с от запуска: %s", startup.stats())
+
+# Второстепенное при запуске: архив заявок и хранилище фото
+# (заявки и фото, пришедшие раньше, ждут в их очередях).
+# wait_first_update — не занимать цикл событий, пока не обработано первое обновление
+async def start_background_services(application: Application, wait_first_update=False):
+    if wait_first_update:
+        try:
+            await asyncio.wait_for(first_update_seen.wait(), BACKGROUND_STARTUP_DELAY)
+        except asyncio.TimeoutError:
+            pass
+    try:
+        await claim_archive.open()
+        if photo_pipeline is not None:
+            await photo_pipeline.start(application.bot, ssl_context=get_api_ssl_context())
+    except Exception:
+        logger.exception("Ошибка запуска архива заявок или хранилища фото")
+    startup.mark('background')
+
+# Загрузка незавершенных заявок после перезапуска
+async def post_init(application: Application):
+    global status_server, background_startup
+    
+    storage = application.persistence.storage
+    await storage.open()
+    drafts = {}
+    for user_id, record in (await storage.load_drafts()).items():
+        # Воркер отвечает только за пользователей своего раздела
+        if BOT_ROLE == 'worker' and partition_for(user_id, WORKERS) != WORKER_INDEX:
+            continue
+        try:
+            drafts[user_id] = ClaimDraft.from_dict(record)
+        except ValueError as e:
+            logger.warning("Пропущен поврежденный черновик пользователя %s: %s", user_id, e)
+    user_data_store.attach(storage, drafts)
+    logger.info("📂 Восстановлено незавершенных заявок: %s", len(drafts))
+    
+    await outbox.start(application.bot, storage=storage)
+    
+    # Очередь диспетчерской и комиссары на линии переживают перезапуск
+    if claim_scheduler is not None:
+        dispatch = await storage.load_dispatch()
+        if dispatch:
+            assignments = claim_scheduler.restore(dispatch)
+            logger.info("📋 Диспетчерская восстановлена: %s, назначено после перезапуска: %s",
+                        claim_scheduler.stats(), len(assignments))
+        claim_scheduler.on_change = lambda: storage.save_dispatch(claim_scheduler)
+    if LAZY_STARTUP:
+        background_startup = asyncio.create_task(start_background_services(application, wait_first_update=True))
+    else:
+        await start_background_services(application)
+    
+    # В режиме вебхука /health и /metrics обслуживает сервер вебхука
+    if not WEBHOOK_URL and PORT:
+        from webhook import start_status_server
+        
+        status_server = start_status_server(
+            application,
+            listen=WEBHOOK_LISTEN,
+            port=PORT,
+            stats=status_stats,
+            metrics=REGISTRY.render
+        )
+        logger.info("📊 /health и /metrics на порту %s", PORT)
+    
+    startup.mark('ready')
+
+# Досылка накопленных сообщений перед остановкой
+async def post_stop(application: Application):
+    if status_server is not None:
+        status_server.stop()
+    if background_startup is not None:
+        await background_startup
+    await outbox.stop(timeout=DRAIN_TIMEOUT)
+    logger.info("📤 Очередь отправки: %s", outbox.stats())
+    if photo_pipeline is not None:
+        await photo_pipeline.stop(timeout=DRAIN_TIMEOUT)
+    await claim_archive.close()
+
+def get_api_ssl_context():
+    global api_ssl_context
+    if api_ssl_context is None:
+        api_ssl_context = httpx.create_ssl_context()
+    return api_ssl_context
+
+# Транспорт Bot API с отдельным пулом соединений и его метриками (pool — имя пула в метриках)
+def api_request(pool, pool_size):
+    inner = HTTPXRequest(
+        connection_pool_size=pool_size,
+        http_version=BOT_API_HTTP_VERSION,
+        connect_timeout=BOT_API_CONNECT_TIMEOUT,
+        read_timeout=BOT_API_READ_TIMEOUT,
+        write_timeout=BOT_API_WRITE_TIMEOUT,
+        media_write_timeout=BOT_API_MEDIA_WRITE_TIMEOUT,
+        pool_timeout=BOT_API_POOL_TIMEOUT,
+        httpx_kwargs={
+            'limits': httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+                keepalive_expiry=BOT_API_KEEPALIVE
+            ),
+            'verify': get_api_ssl_context()
+        }
+    )
+    return InstrumentedRequest(inner, pool=pool, max_in_flight=pool_size, pool_timeout=BOT_API_POOL_TIMEOUT,
+                               rate_limit_retries=BOT_API_RATE_LIMIT_RETRIES, retry_after_max=BOT_API_RETRY_AFTER_MAX)
+
+# Сборка приложения со всеми обработчиками
+def build_application(request=None, max_concurrent_updates=MAX_CONCURRENT_UPDATES):
+    storage = create_storage(STORAGE_BACKEND, STORAGE_PATH)
     
     # Создаем приложение
-    application = Application.builder().token(TOKEN).build()
+    builder = (
+        Application.builder()
+        .token(TOKEN)
+        .persistence(StoragePersistence(storage, update_interval=PERSISTENCE_INTERVAL))
+        .post_init(post_init)
+        .post_stop(post_stop)
+        .concurrent_updates(PerUserUpdateProcessor(max_concurrent_updates))
+    )
+    # Транспорт с замером времени вызовов Bot API
+    # (свой транспорт — например, поддельный Bot API в бенчмарках)
+    if request is not None:
+        request = InstrumentedRequest(request, rate_limit_retries=BOT_API_RATE_LIMIT_RETRIES,
+                                      retry_after_max=BOT_API_RETRY_AFTER_MAX)
+    builder = builder.request(request or api_request('api', BOT_API_POOL_SIZE))
+    builder = builder.get_updates_request(api_request('updates', 1))
+    if BOT_API_URL:
+        builder = builder.base_url(f"{BOT_API_URL.rstrip('/')}/bot").base_file_url(f"{BOT_API_URL.rstrip('/')}/file/bot")
+    application = builder.build()
     
-    # Настраиваем ConversationHandler с правильными фильтрами
+    # Очистка черновиков по таймеру (JobQueue требует python-telegram-bot[job-queue])
+    if application.job_queue is not None:
+        application.job_queue.run_repeating(sweep_drafts, interval=DRAFT_SWEEP_INTERVAL, first=DRAFT_SWEEP_INTERVAL)
+    else:
+        logger.warning("JobQueue недоступна: брошенные черновики не будут удаляться по таймеру")
+    
+    # Таймеры SLA диспетчерской
+    if claim_scheduler is not None:
+        if application.job_queue is not None:
+            claim_scheduler.schedule = lambda delay, callback: application.job_queue.run_once(
+                run_dispatch_timer, delay, data=callback
+            )
+        else:
+            logger.warning("JobQueue недоступна: нарушения SLA диспетчерской не отслеживаются")
+    
+    # Настраиваем ConversationHandler: на каждом шаге один диспетчер,
+    # кнопки (на любом языке) → действие, остальное — по типу сообщения
     conv_handler = ConversationHandler(
         entry_points=[
             CommandHandler('start', start),
-            MessageHandler(filters.TEXT & filters.Regex('^🚀 Начать оформление заявки$'), start)
+            StateDispatcher(buttons={'start': start})
         ],
         states={
-            PHONE: [
-                MessageHandler(filters.CONTACT, handle_contact),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, 
-                              lambda u, c: u.message.reply_text(
-                                  "Пожалуйста, нажмите кнопку '📱 Отправить номер' для отправки контакта",
-                                  reply_markup=get_contact_keyboard()
-                              ))
-            ],
-            LOCATION: [
-                MessageHandler(filters.LOCATION, handle_location),
-                MessageHandler(filters.TEXT & ~filters.COMMAND, 
-                              lambda u, c: u.message.reply_text(
-                                  "Пожалуйста, нажмите кнопку '📍 Отправить местоположение'",
-                                  reply_markup=get_location_keyboard()
-                              ))
-            ],
-            CAR_DETAILS: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND & ~filters.Regex('^🚗 Уже заполнил данные$'), 
-                              handle_car_details),
-                MessageHandler(filters.TEXT & filters.Regex('^🚗 Уже заполнил данные$'), 
-                              handle_car_details)
-            ],
+            PHONE: [StateDispatcher(contact=handle_contact, text=remind_contact)],
+            LOCATION: [StateDispatcher(location=handle_location, text=remind_location)],
+            CAR_DETAILS: [StateDispatcher(buttons={'car_done': car_details_done}, text=handle_car_details)],
             ACCIDENT_DETAILS: [
-                MessageHandler(filters.TEXT & ~filters.COMMAND & ~filters.Regex('^📝 Уже заполнил описание$'), 
-                              handle_accident_details),
-                MessageHandler(filters.TEXT & filters.Regex('^📝 Уже заполнил описание$'), 
-                              handle_accident_details)
+                StateDispatcher(buttons={'accident_done': accident_details_done}, text=handle_accident_details)
             ],
             PHOTOS: [
-                MessageHandler(filters.PHOTO, handle_photos),
-                MessageHandler(filters.TEXT & filters.Regex('^✅ Отправить заявку$'), send_application),
-                MessageHandler(filters.TEXT & filters.Regex('^✅ Отправить заявку без фото$'), send_application),
-                MessageHandler(filters.TEXT & filters.Regex('^📷 Прикрепить фото$'), handle_photos)
+                StateDispatcher(
+                    buttons={
+                        'submit': send_application,
+                        'submit_without_photos': send_application,
+                        'attach_photos': attach_photos
+                    },
+                    photo=handle_photos
+                )
             ]
         },
         fallbacks=[
@@ -529,21 +1183,130 @@ def main():
             CommandHandler('start', start),
             CommandHandler('help', help_command)
         ],
-        allow_reentry=True
+        allow_reentry=True,
+        name='claim',
+        persistent=True
     )
     
+    # Время обработчиков по шагам и воронка заявки
+    instrument_conversation(conv_handler, STATE_NAMES)
+    
+    # Время до первого обновления (группа -1 — до всех остальных обработчиков)
+    application.add_handler(TypeHandler(Update, note_first_update), group=-1)
+    
     # Добавляем обработчики команд
     application.add_handler(conv_handler)
     application.add_handler(CommandHandler('help', help_command))
     application.add_handler(CommandHandler('cancel', cancel))
     
+    # Поиск по архиву заявок: только в чатах администраторов и комиссаров
+    admin_only = filters.Chat(chat_id=admin_chat_ids()) | filters.User(user_id=ADMIN_USER_IDS)
+    application.add_handler(CommandHandler('find', find_command, filters=admin_only))
+    application.add_handler(CommandHandler('recent', recent_command, filters=admin_only))
+    application.add_handler(CallbackQueryHandler(archive_page, pattern=r'^arch:'))
+    if operator_router is not None:
+        application.add_handler(CommandHandler('zone', zone_command, filters=admin_only))
+    
+    # Диспетчерская: команды комиссаров и их геопозиция (отдельная группа — место ДТП
+    # в собственной заявке комиссара по-прежнему обрабатывает диалог)
+    if claim_scheduler is not None:
+        commissioners_only = filters.User(user_id=COMMISSIONER_USER_IDS)
+        application.add_handler(CommandHandler('online', commissioner_online, filters=commissioners_only))
+        application.add_handler(CommandHandler('offline', commissioner_offline, filters=commissioners_only))
+        application.add_handler(CommandHandler('arrived', commissioner_arrived, filters=commissioners_only))
+        application.add_handler(CommandHandler('done', commissioner_done, filters=commissioners_only))
+        application.add_handler(CommandHandler('queue', queue_command, filters=commissioners_only | admin_only))
+        application.add_handler(
+            MessageHandler(filters.LOCATION & commissioners_only, commissioner_location),
+            group=1
+        )
+    
+    return application
+
+# Основная функция
+def main():
+    # Проверяем наличие токена
+    if not TOKEN:
+        logger.error("❌ Токен бота не найден! Установите TELEGRAM_BOT_TOKEN")
+        return
+    
+    logger.info("🚀 Запуск бота аварийного комиссара...")
+    startup.mark('imports')
+    
+    if CLUSTER_MODE:
+        run_cluster()
+        return
+    
+    application = build_application()
+    startup.mark('built')
+    
+    if WEBHOOK_URL:
+        # Telegram сам присылает обновления на наш HTTP-сервер
+        from webhook import run_webhook
+        
+        logger.info("🤖 Бот запущен в режиме webhook...")
+        run_webhook(
+            application,
+            webhook_url=f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH.strip('/')}",
+            listen=WEBHOOK_LISTEN,
+            port=PORT,
+            url_path=WEBHOOK_PATH,
+            secret_token=WEBHOOK_SECRET,
+            drain_timeout=DRAIN_TIMEOUT,
+            stats=status_stats,
+            metrics=REGISTRY.render,
+            listen_early=LAZY_STARTUP,
+            drop_pending_updates=DROP_PENDING_UPDATES
+        )
+        return
+    
     # Запускаем поллинг
     logger.info("🤖 Бот запущен в режиме polling...")
     application.run_polling(
-        drop_pending_updates=True,
+        drop_pending_updates=DROP_PENDING_UPDATES,
         allowed_updates=Update.ALL_TYPES,
         close_loop=False
     )
 
+# Запуск в режиме нескольких процессов (см. cluster.py)
+def run_cluster():
+    from cluster import run_ingress, run_worker
+    
+    if COMMISSIONER_USER_IDS:
+        logger.warning("Автоназначение комиссаров работает только в режиме одного процесса и отключено")
+    logger.warning("В режиме воркеров дубли заявок ищутся только среди заявок того же воркера: "
+                   "заявки разных водителей об одном ДТП могут не объединиться в инцидент")
+    
+    if BOT_ROLE == 'worker':
+        logger.info("👷 Воркер %s из %s", WORKER_INDEX, WORKERS)
+        run_worker(build_application(), BROKER_URL, WORKER_INDEX,
+                   max_in_flight=MAX_CONCURRENT_UPDATES, drain_timeout=DRAIN_TIMEOUT)
+        return
+    
+    if STORAGE_BACKEND != 'sqlite':
+        logger.warning("Хранилище %s не общее для процессов: черновики воркеров не переживут перезапуск",
+                       STORAGE_BACKEND)
+    
+    webhook = None
+    if WEBHOOK_URL:
+        webhook = {
+            'webhook_url': f"{WEBHOOK_URL.rstrip('/')}/{WEBHOOK_PATH.strip('/')}",
+            'url_path': WEBHOOK_PATH,
+            'secret_token': WEBHOOK_SECRET,
+            'drop_pending_updates': DROP_PENDING_UPDATES
+        }
+    logger.info("🔀 Прием обновлений (%s), разделов: %s", 'webhook' if webhook else 'polling', WORKERS)
+    run_ingress(
+        TOKEN, BROKER_URL, WORKERS,
+        base_url=BOT_API_URL,
+        request=api_request('api', 2),
+        get_updates_request=api_request('updates', 1),
+        workers=WORKERS if BOT_ROLE == 'all' else 0,
+        webhook=webhook,
+        listen=WEBHOOK_LISTEN,
+        port=PORT,
+        drain_timeout=DRAIN_TIMEOUT
+    )
+
 if __name__ == '__main__':
     main()
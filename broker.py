@@ -0,0 +1,313 @@
+import asyncio
+import logging
+import os
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+
+# Раздел очереди для ключа упорядочивания (пользователь или чат):
+# все обновления одного пользователя обрабатывает один воркер
+def partition_for(key, partitions):
+    return (key or 0) % partitions
+
+
+# Очередь обновлений между приемом (ingress) и воркерами, разбитая на разделы,
+# и аренды (lease) с истечением — для выбора ведущего приемника и владельцев разделов.
+# Доставка «хотя бы один раз»: сообщение удаляется только после ack(),
+# а неподтвержденные после падения воркера возвращаются через recover().
+class BaseBroker:
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def publish(self, partition, payload):
+        raise NotImplementedError
+
+    # Публикация без ожидания записи: порядок сообщений задается порядком вызовов,
+    # возвращается awaitable, который завершается, когда сообщение записано.
+    # По умолчанию публикации выполняются по очереди в фоне.
+    def publish_nowait(self, partition, payload):
+        previous = getattr(self, '_last_publish', None)
+
+        async def publish():
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            await self.publish(partition, payload)
+
+        self._last_publish = asyncio.ensure_future(publish())
+        return self._last_publish
+
+    # Пачка [(id, payload), ...]; пустой список, если за timeout секунд ничего не пришло
+    async def consume(self, partition, limit=100, timeout=1.0):
+        raise NotImplementedError
+
+    async def ack(self, partition, ids):
+        raise NotImplementedError
+
+    # Вернуть в очередь сообщения, взятые прошлым владельцем раздела и не подтвержденные
+    async def recover(self, partition):
+        pass
+
+    # Захват или продление аренды; True, если аренда у owner
+    async def acquire_lease(self, name, owner, ttl):
+        raise NotImplementedError
+
+    async def release_lease(self, name, owner):
+        raise NotImplementedError
+
+    # Число сообщений в каждом разделе
+    async def depth(self):
+        raise NotImplementedError
+
+
+# Брокер на SQLite (WAL): несколько процессов на одной машине и тесты без Redis.
+# Как и в SQLiteStorage, весь доступ к соединению идет через один поток;
+# публикации, пришедшие одновременно, записываются одной транзакцией.
+class SQLiteBroker(BaseBroker):
+    def __init__(self, path, poll_interval=0.05):
+        self.path = path
+        self.poll_interval = poll_interval
+        self._conn = None
+        self._executor = None
+        self._writer_task = None
+        self._wakeup = None
+        self._outgoing = []
+        self._batch = None
+        # Последнее выданное сообщение раздела: выданные, но не подтвержденные не выдаются повторно
+        self._cursors = {}
+
+    async def open(self):
+        if self._conn is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-broker')
+        self._conn = await self._run(self._connect)
+        self._wakeup = asyncio.Event()
+        self._writer_task = asyncio.create_task(self._writer(), name='sqlite-broker-writer')
+
+    async def close(self):
+        if self._conn is None:
+            return
+        self._writer_task.cancel()
+        await asyncio.gather(self._writer_task, return_exceptions=True)
+        if self._outgoing:
+            await self._flush()
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+        self._conn = None
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS messages (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                partition INTEGER NOT NULL,
+                payload TEXT NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS messages_partition ON messages (partition, id);
+            CREATE TABLE IF NOT EXISTS leases (
+                name TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            );
+        """)
+        return conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # Публикация завершается, когда сообщение записано на диск
+    async def publish(self, partition, payload):
+        await asyncio.shield(self.publish_nowait(partition, payload))
+
+    # Сообщение сразу встает в текущую пачку; future пачки завершается после ее записи
+    def publish_nowait(self, partition, payload):
+        if self._batch is None:
+            self._batch = asyncio.get_running_loop().create_future()
+            self._wakeup.set()
+        self._outgoing.append((partition, payload))
+        return self._batch
+
+    async def _writer(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            await self._flush()
+
+    async def _flush(self):
+        rows, self._outgoing = self._outgoing, []
+        batch, self._batch = self._batch, None
+        try:
+            await self._run(self._insert, rows)
+        except Exception as e:
+            logger.exception("Ошибка записи в брокер, сообщений не опубликовано: %s", len(rows))
+            if batch is not None:
+                batch.set_exception(e)
+            return
+        if batch is not None:
+            batch.set_result(None)
+
+    def _insert(self, rows):
+        with self._conn:
+            self._conn.execute("BEGIN IMMEDIATE")
+            self._conn.executemany("INSERT INTO messages (partition, payload) VALUES (?, ?)", rows)
+
+    async def consume(self, partition, limit=100, timeout=1.0):
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while True:
+            rows = await self._run(
+                self._fetch,
+                "SELECT id, payload FROM messages WHERE partition = ? AND id > ? ORDER BY id LIMIT ?",
+                (partition, self._cursors.get(partition, 0), limit)
+            )
+            if rows:
+                self._cursors[partition] = rows[-1][0]
+                return rows
+            if loop.time() >= deadline:
+                return []
+            await asyncio.sleep(self.poll_interval)
+
+    async def ack(self, partition, ids):
+        await self._run(self._execute_many, "DELETE FROM messages WHERE id = ?", [(id_,) for id_ in ids])
+
+    # Неподтвержденные сообщения лежат в таблице: достаточно читать раздел с начала
+    async def recover(self, partition):
+        self._cursors.pop(partition, None)
+
+    async def acquire_lease(self, name, owner, ttl):
+        now = time.time()
+        rows = await self._run(self._fetch, """
+            INSERT INTO leases (name, owner, expires_at) VALUES (?, ?, ?)
+            ON CONFLICT (name) DO UPDATE SET owner = excluded.owner, expires_at = excluded.expires_at
+            WHERE leases.owner = excluded.owner OR leases.expires_at < ?
+            RETURNING owner
+        """, (name, owner, now + ttl, now))
+        return bool(rows) and rows[0][0] == owner
+
+    async def release_lease(self, name, owner):
+        await self._run(self._execute_many, "DELETE FROM leases WHERE name = ? AND owner = ?", [(name, owner)])
+
+    async def depth(self):
+        rows = await self._run(self._fetch, "SELECT partition, COUNT(*) FROM messages GROUP BY partition", ())
+        return dict(rows)
+
+    def _fetch(self, query, params):
+        with self._conn:
+            return self._conn.execute(query, params).fetchall()
+
+    def _execute_many(self, query, rows):
+        with self._conn:
+            self._conn.executemany(query, rows)
+
+
+# Продление аренды только ее владельцем
+_RENEW_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+_RELEASE_LEASE = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+
+# Брокер на Redis (или совместимом сервере) для процессов на разных машинах.
+# Раздел — список: публикация LPUSH, выдача BLMOVE в список «в обработке»,
+# подтверждение — LREM из него. Требует пакет redis (pip install redis).
+class RedisBroker(BaseBroker):
+    def __init__(self, url, prefix='bot'):
+        self.url = url
+        self.prefix = prefix
+        self._redis = None
+
+    async def open(self):
+        try:
+            import redis.asyncio as redis
+        except ImportError:
+            raise RuntimeError("Для брокера Redis установите пакет redis: pip install redis")
+        self._redis = redis.from_url(self.url, decode_responses=True)
+        await self._redis.ping()
+
+    async def close(self):
+        if self._redis is not None:
+            await self._redis.aclose()
+            self._redis = None
+
+    def _queue(self, partition):
+        return f"{self.prefix}:updates:{partition}"
+
+    def _processing(self, partition):
+        return f"{self.prefix}:updates:{partition}:processing"
+
+    async def publish(self, partition, payload):
+        await self._redis.lpush(self._queue(partition), payload)
+
+    async def consume(self, partition, limit=100, timeout=1.0):
+        source, processing = self._queue(partition), self._processing(partition)
+        first = await self._redis.blmove(source, processing, timeout, 'RIGHT', 'LEFT')
+        if first is None:
+            return []
+        items = [first]
+        while len(items) < limit:
+            item = await self._redis.lmove(source, processing, 'RIGHT', 'LEFT')
+            if item is None:
+                break
+            items.append(item)
+        # Идентификатор сообщения в списке «в обработке» — само сообщение
+        return [(item, item) for item in items]
+
+    async def ack(self, partition, ids):
+        processing = self._processing(partition)
+        async with self._redis.pipeline(transaction=False) as pipe:
+            for item in ids:
+                pipe.lrem(processing, -1, item)
+            await pipe.execute()
+
+    async def recover(self, partition):
+        source, processing = self._queue(partition), self._processing(partition)
+        # Новые из «в обработке» уходят в хвост очереди первыми: самое старое окажется на выдаче
+        while await self._redis.lmove(processing, source, 'LEFT', 'RIGHT') is not None:
+            pass
+
+    async def acquire_lease(self, name, owner, ttl):
+        key = f"{self.prefix}:lease:{name}"
+        ttl_ms = int(ttl * 1000)
+        if await self._redis.set(key, owner, nx=True, px=ttl_ms):
+            return True
+        return bool(await self._redis.eval(_RENEW_LEASE, 1, key, owner, ttl_ms))
+
+    async def release_lease(self, name, owner):
+        await self._redis.eval(_RELEASE_LEASE, 1, f"{self.prefix}:lease:{name}", owner)
+
+    async def depth(self):
+        depth = {}
+        async for key in self._redis.scan_iter(match=f"{self.prefix}:updates:*"):
+            if not key.endswith(':processing'):
+                depth[int(key.rsplit(':', 1)[1])] = await self._redis.llen(key)
+        return depth
+
+
+# sqlite:///data/broker.sqlite3 или redis://host:6379/0
+def create_broker(url):
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBroker(url)
+    if url.startswith('sqlite:///'):
+        return SQLiteBroker(url[len('sqlite:///'):])
+    raise ValueError(f"Неизвестный брокер: {url}")
@@ -0,0 +1,310 @@
+import asyncio
+import contextlib
+import json
+import logging
+import os
+import signal
+import socket
+import subprocess
+import sys
+import uuid
+
+from telegram import Update
+from telegram.ext import Application, TypeHandler
+
+from broker import create_broker, partition_for
+from concurrency import PerUserUpdateProcessor
+
+logger = logging.getLogger(__name__)
+
+# Режим нескольких воркеров.
+# Прием (ingress) — вебхук или единственный выбранный поллер — не обрабатывает
+# обновления, а раскладывает их по разделам брокера по user.id. Каждый раздел
+# читает ровно один воркер (аренда раздела), поэтому шаги одного водителя
+# идут по порядку в одном процессе, а разные водители — на всех ядрах.
+
+LEASE_TTL = 15
+INGRESS_LEASE = 'ingress'
+# Сколько обновлений прием публикует, не дожидаясь записи в брокер
+PUBLISH_BATCH = 100
+
+
+def make_owner_id():
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+def install_stop_signals(stop_event):
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+
+# Ждет аренду, пока не остановят; True — аренда получена
+async def wait_for_lease(broker, name, owner, stop_event):
+    while not stop_event.is_set():
+        if await broker.acquire_lease(name, owner, LEASE_TTL):
+            return True
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(stop_event.wait(), LEASE_TTL / 3)
+    return False
+
+
+# Продлевает аренду до остановки; False — аренда потеряна (ее перехватил другой процесс)
+async def keep_lease(broker, name, owner, stop_event):
+    while True:
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(stop_event.wait(), LEASE_TTL / 3)
+        if stop_event.is_set():
+            return True
+        try:
+            if not await broker.acquire_lease(name, owner, LEASE_TTL):
+                logger.error("Аренда %s потеряна", name)
+                return False
+        except Exception:
+            logger.exception("Не удалось продлить аренду %s", name)
+
+
+# Прием
+
+# Приложение приема: единственный обработчик публикует обновление в раздел брокера.
+# Обновления обрабатываются по одному, поэтому порядок внутри раздела сохраняется.
+# Записи в брокер прием ждет не на каждое обновление, а когда очередь обновлений
+# опустела или набралось PUBLISH_BATCH: накопившиеся обновления (пачка getUpdates,
+# всплеск вебхуков) записываются одной транзакцией.
+def build_ingress_application(token, broker, partitions, request=None, get_updates_request=None, base_url=None):
+    builder = Application.builder().token(token)
+    if request is not None:
+        builder = builder.request(request)
+    if get_updates_request is not None:
+        builder = builder.get_updates_request(get_updates_request)
+    if base_url:
+        builder = builder.base_url(f"{base_url.rstrip('/')}/bot")
+    application = builder.build()
+
+    unconfirmed = []
+
+    async def publish(update, context):
+        partition = partition_for(PerUserUpdateProcessor.ordering_key(update), partitions)
+        unconfirmed.append(broker.publish_nowait(partition, update.to_json()))
+        if application.update_queue.empty() or len(unconfirmed) >= PUBLISH_BATCH:
+            batch = unconfirmed[:]
+            unconfirmed.clear()
+            await asyncio.gather(*batch)
+
+    application.add_handler(TypeHandler(Update, publish))
+    return application
+
+
+# Поллинг только у держателя аренды ingress; остальные реплики ждут в резерве
+async def poll_as_leader(application, broker, owner, stop_event):
+    await application.initialize()
+    try:
+        while await wait_for_lease(broker, INGRESS_LEASE, owner, stop_event):
+            logger.info("👑 Аренда приема получена, запускаем getUpdates")
+            await application.updater.start_polling(allowed_updates=Update.ALL_TYPES, drop_pending_updates=False)
+            await application.start()
+            kept = await keep_lease(broker, INGRESS_LEASE, owner, stop_event)
+            await application.updater.stop()
+            await application.stop()
+            if kept:
+                break
+    finally:
+        await broker.release_lease(INGRESS_LEASE, owner)
+        await application.shutdown()
+
+
+# Воркеры
+
+# Дочерние процессы воркеров (отдельный интерпретатор: python -c "import bot; bot.main()").
+# Конфигурация бота читается при импорте, поэтому роль и раздел передаются через окружение.
+# Упавший воркер перезапускается.
+class WorkerPool:
+    def __init__(self, partitions):
+        self.partitions = partitions
+        self.processes = {}
+        self.restarts = 0
+
+    def start(self, index):
+        base_port = int(os.getenv('WORKER_STATUS_PORT_BASE', '0'))
+        env = dict(
+            os.environ,
+            BOT_ROLE='worker',
+            WORKER_INDEX=str(index),
+            WORKERS=str(self.partitions),
+            PORT=str(base_port + index if base_port else 0)
+        )
+        self.processes[index] = subprocess.Popen(
+            [sys.executable, '-c', 'import bot; bot.main()'],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            env=env
+        )
+
+    def start_all(self):
+        for index in range(self.partitions):
+            self.start(index)
+        logger.info("👷 Запущено воркеров: %s", self.partitions)
+
+    def check(self):
+        for index, process in list(self.processes.items()):
+            if process.poll() is not None:
+                logger.error("Воркер %s завершился с кодом %s, перезапуск", index, process.returncode)
+                self.restarts += 1
+                self.start(index)
+
+    def alive(self):
+        return sum(process.poll() is None for process in self.processes.values())
+
+    async def stop(self, timeout):
+        for process in self.processes.values():
+            if process.poll() is None:
+                process.terminate()
+        loop = asyncio.get_running_loop()
+        for index, process in self.processes.items():
+            try:
+                await loop.run_in_executor(None, process.wait, timeout)
+            except subprocess.TimeoutExpired:
+                logger.warning("Воркер %s не остановился за %s с", index, timeout)
+                process.kill()
+
+
+async def supervise(pool, stop_event):
+    while not stop_event.is_set():
+        pool.check()
+        with contextlib.suppress(asyncio.TimeoutError):
+            await asyncio.wait_for(stop_event.wait(), 1)
+
+
+# Воркер: читает свой раздел и обрабатывает обновления тем же приложением,
+# что и в однопроцессном режиме. Пачка подтверждается после обработки всех ее обновлений.
+async def serve_worker(application, broker, partition, max_in_flight=256, drain_timeout=25):
+    stop_event = asyncio.Event()
+    install_stop_signals(stop_event)
+    owner = make_owner_id()
+
+    await broker.open()
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+
+    processor = application.update_processor
+    # Пачки в обработке и общее число их обновлений
+    in_flight = set()
+    pending = [0]
+    name = f"partition:{partition}"
+
+    async def finish(ids, tasks):
+        await asyncio.gather(*tasks, return_exceptions=True)
+        pending[0] -= len(tasks)
+        await broker.ack(partition, ids)
+
+    try:
+        if await wait_for_lease(broker, name, owner, stop_event):
+            logger.info("📥 Воркер читает раздел %s", partition)
+            await broker.recover(partition)
+            lease_task = asyncio.create_task(keep_lease(broker, name, owner, stop_event))
+            lease_task.add_done_callback(lambda _: stop_event.set())
+
+            while not stop_event.is_set():
+                if pending[0] >= max_in_flight:
+                    await asyncio.wait(in_flight, return_when=asyncio.FIRST_COMPLETED)
+                    continue
+                batch = await broker.consume(partition, limit=max_in_flight - pending[0], timeout=1.0)
+                if not batch:
+                    continue
+                pending[0] += len(batch)
+                tasks = []
+                for _, payload in batch:
+                    update = Update.de_json(json.loads(payload), application.bot)
+                    tasks.append(asyncio.create_task(
+                        processor.process_update(update, application.process_update(update))
+                    ))
+                done = asyncio.create_task(finish([message_id for message_id, _ in batch], tasks))
+                in_flight.add(done)
+                done.add_done_callback(in_flight.discard)
+
+            # Дорабатываем взятые пачки; неподтвержденные получит следующий владелец раздела
+            if in_flight:
+                await asyncio.wait(in_flight, timeout=drain_timeout)
+            lease_task.cancel()
+            await broker.release_lease(name, owner)
+    finally:
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await broker.close()
+
+
+def run_worker(application, broker_url, partition, max_in_flight=256, drain_timeout=25):
+    asyncio.run(serve_worker(application, create_broker(broker_url), partition, max_in_flight, drain_timeout))
+
+
+# Прием с дочерними воркерами (workers > 0) или отдельно от них (workers = 0).
+# webhook — параметры serve_webhook; без них прием идет поллингом по аренде.
+async def serve_ingress(token, broker_url, partitions, workers=0, webhook=None,
+                        listen='0.0.0.0', port=0, drain_timeout=25, request=None, get_updates_request=None,
+                        base_url=None):
+    broker = create_broker(broker_url)
+    await broker.open()
+    application = build_ingress_application(token, broker, partitions, request=request,
+                                            get_updates_request=get_updates_request, base_url=base_url)
+
+    pool = WorkerPool(partitions) if workers else None
+    if pool is not None:
+        pool.start_all()
+
+    depth = {}
+
+    def stats():
+        body = {'partitions': partitions, 'broker_depth': depth}
+        if pool is not None:
+            body.update(workers_alive=pool.alive(), worker_restarts=pool.restarts)
+        return body
+
+    async def refresh_depth():
+        while True:
+            with contextlib.suppress(Exception):
+                depth.clear()
+                depth.update(await broker.depth())
+            await asyncio.sleep(5)
+
+    stop_event = asyncio.Event()
+    background = [asyncio.create_task(refresh_depth())]
+    if pool is not None:
+        background.append(asyncio.create_task(supervise(pool, stop_event)))
+
+    status_server = None
+    try:
+        if webhook is not None:
+            from webhook import serve_webhook
+
+            await serve_webhook(application, listen=listen, port=port, drain_timeout=drain_timeout,
+                                stats=stats, **webhook)
+        else:
+            install_stop_signals(stop_event)
+            if port:
+                from webhook import start_status_server
+
+                status_server = start_status_server(application, listen=listen, port=port, stats=stats)
+            await poll_as_leader(application, broker, make_owner_id(), stop_event)
+    finally:
+        stop_event.set()
+        if status_server is not None:
+            status_server.stop()
+        for task in background:
+            task.cancel()
+        await asyncio.gather(*background, return_exceptions=True)
+        if pool is not None:
+            await pool.stop(drain_timeout)
+        await broker.close()
+
+
+def run_ingress(token, broker_url, partitions, **kwargs):
+    asyncio.run(serve_ingress(token, broker_url, partitions, **kwargs))
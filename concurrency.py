@@ -0,0 +1,65 @@
+import asyncio
+
+from telegram.ext import BaseUpdateProcessor
+
+
+# Параллельная обработка обновлений с сохранением порядка для каждого пользователя:
+# шаги разных водителей выполняются одновременно, а шаги одного водителя
+# (телефон → место → авто → описание → фото) строго по очереди.
+class PerUserUpdateProcessor(BaseUpdateProcessor):
+    # Лимит базового класса берется раньше do_process_update, то есть раньше замка
+    # пользователя, поэтому ему передается заведомо недостижимое значение,
+    # а max_concurrent_updates держит собственный семафор процессора
+    UNLIMITED = 2 ** 31 - 1
+
+    def __init__(self, max_concurrent_updates):
+        if max_concurrent_updates < 1:
+            raise ValueError("max_concurrent_updates должно быть положительным")
+        super().__init__(self.UNLIMITED)
+        self.limit = max_concurrent_updates
+        self._slots = asyncio.BoundedSemaphore(max_concurrent_updates)
+        # ключ → [замок, число ожидающих обновлений]
+        self._locks = {}
+
+    @staticmethod
+    def ordering_key(update):
+        user = getattr(update, 'effective_user', None)
+        if user is not None:
+            return user.id
+        chat = getattr(update, 'effective_chat', None)
+        if chat is not None:
+            return chat.id
+        return None
+
+    # Замок пользователя берется раньше общего лимита (max_concurrent_updates):
+    # пока обновление ждет предыдущие шаги того же пользователя, оно не занимает
+    # место в лимите, и поток обновлений одного пользователя не задерживает остальных
+    async def do_process_update(self, update, coroutine):
+        key = self.ordering_key(update)
+        if key is None:
+            async with self._slots:
+                await coroutine
+            return
+
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                async with self._slots:
+                    await coroutine
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    @property
+    def active_keys(self):
+        return len(self._locks)
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
@@ -0,0 +1,155 @@
+import math
+import time
+from collections import deque
+
+from models import normalize_phone
+from routing import haversine_km
+
+METERS_PER_DEGREE = 111_320
+
+
+# Поиск вероятных дублей заявок: несколько участников и свидетелей одного ДТП
+# присылают заявки почти одновременно и с одного места.
+# Недавние заявки лежат в трех индексах — ячейка геохеша, телефон и госномер.
+# Проверка новой заявки смотрит только свою ячейку с соседними и два ключа
+# в словарях, поэтому не зависит от общего числа заявок.
+
+# Заявки, признанные одним ДТП; в чат комиссара идут как один инцидент
+class Incident:
+    __slots__ = ('incident_id', 'chat_id', 'zone', 'claim_ids')
+
+    def __init__(self, incident_id, chat_id, zone):
+        self.incident_id = incident_id
+        self.chat_id = chat_id
+        self.zone = zone
+        self.claim_ids = []
+
+
+class _Entry:
+    __slots__ = ('claim_id', 'incident', 'submitted_at', 'latitude', 'longitude', 'cell', 'phone_key', 'plates')
+
+    def __init__(self, claim_id, incident, submitted_at, latitude, longitude, cell, phone_key, plates):
+        self.claim_id = claim_id
+        self.incident = incident
+        self.submitted_at = submitted_at
+        self.latitude = latitude
+        self.longitude = longitude
+        self.cell = cell
+        self.phone_key = phone_key
+        self.plates = plates
+
+
+class IncidentIndex:
+    # window — сколько секунд заявка может быть дублем новых,
+    # radius_m — насколько далеко друг от друга могут быть точки одного ДТП
+    def __init__(self, window=1800, radius_m=300):
+        self.window = window
+        self.radius_m = radius_m
+        # Сетка геохеша: число бит широты, при котором ячейка не меньше радиуса
+        # (как у строкового геохеша, долгота получает столько же бит)
+        self.bits = max(1, int(math.log2(180 * METERS_PER_DEGREE / radius_m)))
+        self.cell_deg = (180 / 2 ** self.bits, 360 / 2 ** self.bits)
+
+        # Каждая очередь упорядочена по времени: устаревшие записи снимаются слева
+        self._entries = deque()
+        self._cells = {}
+        self._phones = {}
+        self._plates = {}
+
+    def __len__(self):
+        return len(self._entries)
+
+    def _cell(self, latitude, longitude):
+        return (int((latitude + 90) / self.cell_deg[0]), int((longitude + 180) / self.cell_deg[1]) % 2 ** self.bits)
+
+    # Ячейка точки и соседние, которые может задеть круг радиуса radius_m.
+    # Долгота замкнута в кольцо из 2 ** bits ячеек: у полюсов круг покрывает
+    # не больше одного кольца, а точки по разные стороны от ±180° остаются соседями.
+    # Если ячеек-кандидатов больше, чем занятых, перебираем занятые.
+    def _nearby_cells(self, latitude, longitude):
+        lat_cell, lon_cell = self._cell(latitude, longitude)
+        ring = 2 ** self.bits
+        # Полуширина круга по долготе; если круг накрывает полюс — все кольцо
+        radius = math.sin(math.radians(self.radius_m / METERS_PER_DEGREE))
+        cos_lat = math.cos(math.radians(latitude))
+        if cos_lat > radius:
+            lon_span = min(math.ceil(math.degrees(math.asin(radius / cos_lat)) / self.cell_deg[1]), ring // 2)
+        else:
+            lon_span = ring // 2
+        rows = (lat_cell - 1, lat_cell, lat_cell + 1)
+        if 3 * (2 * lon_span + 1) > len(self._cells):
+            return [
+                cell for cell in self._cells
+                if cell[0] in rows and min((cell[1] - lon_cell) % ring, (lon_cell - cell[1]) % ring) <= lon_span
+            ]
+        if 2 * lon_span + 1 >= ring:
+            lon_cells = range(ring)
+        else:
+            lon_cells = [(lon_cell + dlon) % ring for dlon in range(-lon_span, lon_span + 1)]
+        return [(row, cell) for row in rows for cell in lon_cells]
+
+    def _expire(self, now):
+        deadline = now - self.window
+        while self._entries and self._entries[0].submitted_at < deadline:
+            entry = self._entries.popleft()
+            if entry.cell is not None:
+                self._pop_oldest(self._cells, entry.cell)
+            if entry.phone_key:
+                self._pop_oldest(self._phones, entry.phone_key)
+            for plate in entry.plates:
+                self._pop_oldest(self._plates, plate)
+
+    @staticmethod
+    def _pop_oldest(index, key):
+        bucket = index[key]
+        bucket.popleft()
+        if not bucket:
+            del index[key]
+
+    # Инцидент, к которому вероятно относится черновик, и причины совпадения
+    # ('phone', 'plate', 'location'); (None, []) — похожих заявок нет
+    def match(self, draft, now=None):
+        now = time.time() if now is None else now
+        self._expire(now)
+
+        reasons = {}
+        phone_key = normalize_phone(draft.phone)
+        for entry in self._phones.get(phone_key, ()) if phone_key else ():
+            reasons.setdefault(entry.incident, set()).add('phone')
+        for plate in draft.plates():
+            for entry in self._plates.get(plate, ()):
+                reasons.setdefault(entry.incident, set()).add('plate')
+        if draft.latitude is not None:
+            radius_km = self.radius_m / 1000
+            for cell in self._nearby_cells(draft.latitude, draft.longitude):
+                for entry in self._cells.get(cell, ()):
+                    if haversine_km(draft.latitude, draft.longitude, entry.latitude, entry.longitude) <= radius_km:
+                        reasons.setdefault(entry.incident, set()).add('location')
+
+        if not reasons:
+            return None, []
+        # Если совпало с несколькими инцидентами, берем самый надежный признак
+        order = ('phone', 'plate', 'location')
+        incident = min(reasons, key=lambda item: min(order.index(reason) for reason in reasons[item]))
+        return incident, [reason for reason in order if reason in reasons[incident]]
+
+    # Запоминает отправленную заявку; incident — результат match() или None для нового ДТП
+    def add(self, draft, incident=None, chat_id=None, zone=None, now=None):
+        now = time.time() if now is None else now
+        if incident is None:
+            incident = Incident(draft.claim_id, chat_id, zone)
+        incident.claim_ids.append(draft.claim_id)
+
+        phone_key = normalize_phone(draft.phone)
+        plates = tuple(set(draft.plates()))
+        cell = self._cell(draft.latitude, draft.longitude) if draft.latitude is not None else None
+        entry = _Entry(draft.claim_id, incident, now, draft.latitude, draft.longitude, cell, phone_key, plates)
+
+        self._entries.append(entry)
+        if cell is not None:
+            self._cells.setdefault(cell, deque()).append(entry)
+        if phone_key:
+            self._phones.setdefault(phone_key, deque()).append(entry)
+        for plate in plates:
+            self._plates.setdefault(plate, deque()).append(entry)
+        return incident
@@ -0,0 +1,74 @@
+from telegram import MessageEntity, Update
+from telegram.ext import BaseHandler
+
+from templates import button_variants
+
+
+def is_command(message):
+    entities = message.entities
+    return bool(entities) and entities[0].type == MessageEntity.BOT_COMMAND and entities[0].offset == 0
+
+
+# Один обработчик на шаг диалога вместо цепочки MessageHandler с регулярными выражениями.
+# Подписи кнопок всех языков заранее собраны в словарь «текст → действие»,
+# поэтому нажатие кнопки распознается одним поиском в словаре.
+# Остальные сообщения — по типу: текст (не команда), фото, контакт, геолокация.
+# Если действия нет, обновление не совпадает, и ConversationHandler проверяет fallbacks.
+class StateDispatcher(BaseHandler):
+    __slots__ = ('buttons', 'text', 'photo', 'contact', 'location')
+
+    def __init__(self, buttons=None, text=None, photo=None, contact=None, location=None):
+        super().__init__(self._dispatch)
+        # buttons: ключ кнопки из реестра шаблонов → действие
+        self.buttons = {
+            label: action
+            for key, action in (buttons or {}).items()
+            for label in button_variants(key)
+        }
+        self.text = text
+        self.photo = photo
+        self.contact = contact
+        self.location = location
+
+    # Результат проверки — само действие
+    def check_update(self, update):
+        if not isinstance(update, Update):
+            return None
+        message = update.effective_message
+        if message is None:
+            return None
+
+        if message.text is not None:
+            action = self.buttons.get(message.text)
+            if action is not None:
+                return action
+            return None if is_command(message) else self.text
+        if message.photo:
+            return self.photo
+        if message.contact is not None:
+            return self.contact
+        if message.location is not None:
+            return self.location
+        return None
+
+    async def handle_update(self, update, application, check_result, context):
+        return await check_result(update, context)
+
+    async def _dispatch(self, update, context):
+        action = self.check_update(update)
+        return await action(update, context) if action is not None else None
+
+    # Обертка каждого действия (метрики по шагам диалога)
+    def wrap_callbacks(self, wrap):
+        wrapped = {}
+
+        def get(action):
+            if action not in wrapped:
+                wrapped[action] = wrap(action)
+            return wrapped[action]
+
+        self.buttons = {label: get(action) for label, action in self.buttons.items()}
+        for kind in ('text', 'photo', 'contact', 'location'):
+            action = getattr(self, kind)
+            if action is not None:
+                setattr(self, kind, get(action))
@@ -0,0 +1,152 @@
+import atexit
+import contextvars
+import copy
+import json
+import logging
+import queue
+import random
+import sys
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
+
+# Логи пишутся не из цикла событий: обработчики только кладут запись в очередь,
+# а форматирование и вывод в stdout делает отдельный поток QueueListener.
+
+# Контекст текущего обновления: у каждого обновления своя задача asyncio,
+# поэтому значения не смешиваются между пользователями
+log_context = contextvars.ContextVar('log_context', default=None)
+
+# Поиск ID заявки по ID пользователя (задает бот: черновики хранит он)
+_claim_resolver = None
+
+_listener = None
+
+# Стандартные атрибуты LogRecord: все остальное — поля из extra
+_RECORD_ATTRS = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def bind_log_context(user_id=None, state=None, claim_id=None):
+    log_context.set({'user_id': user_id, 'state': state, 'claim_id': claim_id})
+
+
+def set_claim_resolver(resolver):
+    global _claim_resolver
+    _claim_resolver = resolver
+
+
+# Добавляет к записи контекст обновления. Работает в потоке, который пишет лог:
+# в потоке слушателя contextvars уже недоступны
+class ContextFilter(logging.Filter):
+    def filter(self, record):
+        ctx = log_context.get()
+        if ctx is None:
+            record.user_id = record.state = record.claim_id = None
+            return True
+        record.user_id = ctx['user_id']
+        record.state = ctx['state']
+        record.claim_id = ctx['claim_id']
+        if record.claim_id is None and record.user_id is not None and _claim_resolver is not None:
+            record.claim_id = _claim_resolver(record.user_id)
+        return True
+
+
+# Пропускает только долю DEBUG-записей: трассировка каждого обновления под нагрузкой
+# забивает очередь и stdout
+class DebugSampler(logging.Filter):
+    def __init__(self, rate):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        return record.levelno > logging.DEBUG or random.random() < self.rate
+
+
+# Как QueueHandler.prepare(): аргументы подставляются и traceback форматируется
+# в вызывающем потоке, пока объекты в args и исключение не изменились
+# (и не удерживаются очередью). В отличие от стандартного prepare(), traceback
+# остается в exc_text, а не в тексте сообщения — JSON выводит его отдельным полем.
+class DeferredQueueHandler(QueueHandler):
+    _exception_formatter = logging.Formatter()
+
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.message = record.getMessage()
+        record.msg = record.message
+        record.args = None
+        if record.exc_info:
+            if not record.exc_text:
+                record.exc_text = self._exception_formatter.formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'msg': record.getMessage(),
+            'user_id': getattr(record, 'user_id', None),
+            'claim_id': getattr(record, 'claim_id', None),
+            'state': getattr(record, 'state', None)
+        }
+        for key, value in vars(record).items():
+            if key not in _RECORD_ATTRS and key not in entry:
+                entry[key] = value
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        elif record.exc_text:
+            entry['exc'] = record.exc_text
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, ensure_ascii=False, default=str)
+
+
+# Текстовый формат для локальной отладки (LOG_FORMAT=text)
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
+    def format(self, record):
+        line = super().format(record)
+        context = ' '.join(
+            f"{key}={getattr(record, key)}"
+            for key in ('user_id', 'claim_id', 'state')
+            if getattr(record, key, None) is not None
+        )
+        return f"{line} [{context}]" if context else line
+
+
+# Корневой логгер пишет в очередь; поток слушателя форматирует и выводит записи.
+# Повторный вызов ничего не делает.
+def setup_logging(level='INFO', fmt='json', debug_sample_rate=0.1, stream=None):
+    global _listener
+    if _listener is not None:
+        return _listener
+
+    output = logging.StreamHandler(stream or sys.stdout)
+    output.setFormatter(JsonFormatter() if fmt == 'json' else TextFormatter())
+
+    handler = DeferredQueueHandler(queue.SimpleQueue())
+    handler.addFilter(DebugSampler(debug_sample_rate))
+    handler.addFilter(ContextFilter())
+
+    root = logging.getLogger()
+    for existing in root.handlers[:]:
+        root.removeHandler(existing)
+    root.addHandler(handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(handler.queue, output, respect_handler_level=True)
+    _listener.start()
+    # Досылаем накопленные записи при выходе
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
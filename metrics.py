@@ -0,0 +1,395 @@
+import asyncio
+import bisect
+import contextvars
+import functools
+import json
+import logging
+import time
+
+from telegram.error import TimedOut
+from telegram.request import BaseRequest
+
+from logconfig import bind_log_context
+
+logger = logging.getLogger(__name__)
+
+# Метрики в текстовом формате Prometheus. Метка → дочерний объект кэшируется,
+# поэтому наблюдение в горячем пути — поиск в словаре и bisect без блокировок
+# (все обновления идут из одного цикла событий).
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+def _format_value(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children[values] = self._new_child()
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {_format_value(value)}")
+        return '\n'.join(lines)
+
+
+class _Value:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0
+
+    def inc(self, amount=1):
+        self.value += amount
+
+    def set(self, value):
+        self.value = value
+
+
+# Значение counter либо накапливается через inc(), либо читается функцией
+# в момент сбора (для счетчиков, которые уже ведет другой объект)
+class Counter(Metric):
+    kind = 'counter'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        if self.function is not None:
+            yield self.name + '_total', '', self.function()
+            return
+        for values, child in self._children.items():
+            yield self.name + '_total', _format_labels(self.labelnames, values), child.value
+
+
+# Значение gauge либо выставляется явно, либо читается функцией в момент сбора
+class Gauge(Metric):
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def samples(self):
+        if self.function is not None:
+            yield self.name, '', self.function()
+            return
+        for values, child in self._children.items():
+            yield self.name, _format_labels(self.labelnames, values), child.value
+
+
+class _HistogramValue:
+    __slots__ = ('bounds', 'counts', 'count', 'sum')
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.count += 1
+        self.sum += value
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramValue(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    # Краткая сводка для /health
+    def snapshot(self):
+        child = self.labels()
+        return {
+            'count': child.count,
+            'avg': child.sum / child.count if child.count else 0.0,
+            'buckets': dict(zip([*map(str, self.buckets), '+Inf'], child.counts))
+        }
+
+    def samples(self):
+        for values, child in self._children.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, float('inf')), child.counts):
+                cumulative += count
+                labels = _format_labels(self.labelnames, values, [('le', _format_value(bound))])
+                yield self.name + '_bucket', labels, cumulative
+            labels = _format_labels(self.labelnames, values)
+            yield self.name + '_count', labels, child.count
+            yield self.name + '_sum', labels, child.sum
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=(), function=None):
+        return self.register(Counter(name, documentation, labelnames, function))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        return '\n'.join(metric.render() for metric in self._metrics.values()) + '\n'
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    'bot_handler_seconds', "Время работы обработчика по шагу диалога", ('state', 'handler')
+)
+HANDLER_ERRORS = REGISTRY.counter(
+    'bot_handler_errors', "Исключения в обработчиках", ('state', 'handler')
+)
+FUNNEL = REGISTRY.counter(
+    'bot_funnel', "Переходы на шаги заявки (воронка)", ('step',)
+)
+DROPOFF = REGISTRY.counter(
+    'bot_dropoff', "Брошенные черновики по шагу, на котором остановился пользователь", ('step',)
+)
+API_LATENCY = REGISTRY.histogram(
+    'bot_api_request_seconds', "Время запроса к Bot API", ('method',)
+)
+API_ERRORS = REGISTRY.counter(
+    'bot_api_request_errors', "Ошибки запросов к Bot API (сеть и HTTP-статус не 200)", ('method',)
+)
+API_POOL_WAIT = REGISTRY.histogram(
+    'bot_api_pool_wait_seconds', "Ожидание свободного соединения с Bot API", ('pool',),
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+)
+API_IN_FLIGHT = REGISTRY.gauge(
+    'bot_api_in_flight', "Запросы к Bot API, выполняемые прямо сейчас", ('pool',)
+)
+API_POOL_TIMEOUTS = REGISTRY.counter(
+    'bot_api_pool_timeouts', "Запросы, не дождавшиеся свободного соединения", ('pool',)
+)
+API_RATE_LIMIT_RETRIES = REGISTRY.counter(
+    'bot_api_rate_limit_retries', "Повторы вызовов Bot API после ответа 429", ('method',)
+)
+STARTUP_SECONDS = REGISTRY.gauge(
+    'bot_startup_seconds', "Время от запуска процесса до этапа старта", ('phase',)
+)
+
+
+# Обертка обработчика: время выполнения по шагу, воронка по возвращенному шагу
+# и контекст логов (пользователь, шаг) для всего, что пишет обработчик
+def instrument(callback, state_name, state_names):
+    handler_name = getattr(callback, '__name__', 'handler')
+    latency = HANDLER_LATENCY.labels(state_name, handler_name)
+    errors = HANDLER_ERRORS.labels(state_name, handler_name)
+
+    @functools.wraps(callback)
+    async def wrapper(update, context):
+        user = update.effective_user
+        bind_log_context(user_id=user.id if user else None, state=state_name)
+        started = time.perf_counter()
+        try:
+            result = await callback(update, context)
+        except Exception:
+            errors.inc()
+            raise
+        finally:
+            elapsed = time.perf_counter() - started
+            latency.observe(elapsed)
+        step = state_names.get(result)
+        logger.debug("%s: %s -> %s за %.1f мс", handler_name, state_name, step, elapsed * 1000)
+        if step is not None and step != state_name:
+            FUNNEL.labels(step).inc()
+        return result
+
+    return wrapper
+
+
+# Оборачивает все обработчики ConversationHandler (входы, шаги и fallbacks)
+def instrument_conversation(conv_handler, state_names):
+    by_state = {state_names[state]: handlers for state, handlers in conv_handler.states.items()}
+    by_state['entry'] = conv_handler.entry_points
+    by_state['fallback'] = conv_handler.fallbacks
+    for state_name, handlers in by_state.items():
+        for handler in handlers:
+            if hasattr(handler, 'wrap_callbacks'):
+                # StateDispatcher: свое действие на каждую кнопку и тип сообщения
+                handler.wrap_callbacks(lambda callback, name=state_name: instrument(callback, name, state_names))
+            else:
+                handler.callback = instrument(handler.callback, state_name, state_names)
+
+
+# Повторять ли вызов после 429 в транспорте. Очередь отправки выключает это
+# для своих задач: она сама откладывает доставку, не занимая воркер ожиданием.
+RETRY_RATE_LIMITED = contextvars.ContextVar('retry_rate_limited', default=True)
+
+
+# Сколько секунд просит подождать ответ 429 (parameters.retry_after)
+def _retry_after(payload):
+    try:
+        return float(json.loads(payload)['parameters']['retry_after'])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+# Транспорт Bot API с замером времени каждого вызова по имени метода.
+# max_in_flight — размер пула соединений: запрос сначала ждет свободное место здесь,
+# поэтому очередь к пулу видна в метриках (bot_api_pool_wait_seconds), а сам запрос
+# в httpx сразу получает соединение. Время вызова считается без ожидания пула.
+# Ответ 429 с retry_after не больше retry_after_max повторяется до rate_limit_retries раз
+# (прямые ответы пользователю из обработчиков не теряются); место в пуле на время
+# ожидания освобождается.
+class InstrumentedRequest(BaseRequest):
+    def __init__(self, inner, pool='api', max_in_flight=None, pool_timeout=None,
+                 rate_limit_retries=0, retry_after_max=0):
+        self.inner = inner
+        self.pool = pool
+        self.pool_timeout = pool_timeout
+        self.rate_limit_retries = rate_limit_retries
+        self.retry_after_max = retry_after_max
+        self._slots = asyncio.Semaphore(max_in_flight) if max_in_flight else None
+        self._pool_wait = API_POOL_WAIT.labels(pool)
+        self._pool_timeouts = API_POOL_TIMEOUTS.labels(pool)
+        self._in_flight = API_IN_FLIGHT.labels(pool)
+
+    @property
+    def read_timeout(self):
+        return self.inner.read_timeout
+
+    async def initialize(self):
+        await self.inner.initialize()
+
+    async def shutdown(self):
+        await self.inner.shutdown()
+
+    async def do_request(self, url, method, request_data=None, read_timeout=BaseRequest.DEFAULT_NONE,
+                         write_timeout=BaseRequest.DEFAULT_NONE, connect_timeout=BaseRequest.DEFAULT_NONE,
+                         pool_timeout=BaseRequest.DEFAULT_NONE):
+        api_method = url.rsplit('/', 1)[-1]
+        attempt = 0
+        while True:
+            code, payload = await self._do_request(api_method, url, method, request_data, read_timeout,
+                                                   write_timeout, connect_timeout, pool_timeout)
+            if code != 429 or attempt >= self.rate_limit_retries or not RETRY_RATE_LIMITED.get():
+                return code, payload
+            retry_after = _retry_after(payload)
+            if retry_after is None or retry_after > self.retry_after_max:
+                return code, payload
+            attempt += 1
+            API_RATE_LIMIT_RETRIES.labels(api_method).inc()
+            logger.warning("Лимит Telegram для %s, повтор %s через %s с", api_method, attempt, retry_after)
+            await asyncio.sleep(retry_after)
+
+    async def _do_request(self, api_method, url, method, request_data, read_timeout,
+                          write_timeout, connect_timeout, pool_timeout):
+        if self._slots is not None:
+            await self._acquire(self.pool_timeout if pool_timeout is BaseRequest.DEFAULT_NONE else pool_timeout)
+        self._in_flight.inc()
+        started = time.perf_counter()
+        try:
+            code, payload = await self.inner.do_request(
+                url, method, request_data,
+                read_timeout=read_timeout,
+                write_timeout=write_timeout,
+                connect_timeout=connect_timeout,
+                pool_timeout=pool_timeout
+            )
+        except Exception:
+            API_ERRORS.labels(api_method).inc()
+            raise
+        finally:
+            API_LATENCY.labels(api_method).observe(time.perf_counter() - started)
+            self._in_flight.inc(-1)
+            if self._slots is not None:
+                self._slots.release()
+        if code != 200:
+            API_ERRORS.labels(api_method).inc()
+        return code, payload
+
+    async def _acquire(self, timeout):
+        started = time.perf_counter()
+        try:
+            if self._slots.locked():
+                await asyncio.wait_for(self._slots.acquire(), timeout)
+            else:
+                await self._slots.acquire()
+        except asyncio.TimeoutError:
+            self._pool_timeouts.inc()
+            raise TimedOut(f"Pool timeout: все соединения пула {self.pool} заняты дольше {timeout} с") from None
+        finally:
+            self._pool_wait.observe(time.perf_counter() - started)
+
+
+# Этапы холодного старта: секунды от начала импорта bot.py до каждого этапа
+# (импорт, сборка приложения, готовность, первое обновление) — в лог и в метрику
+class StartupTimer:
+    def __init__(self, started):
+        self.started = started
+        self.phases = {}
+
+    def mark(self, phase):
+        if phase not in self.phases:
+            elapsed = self.phases[phase] = time.perf_counter() - self.started
+            STARTUP_SECONDS.labels(phase).set(round(elapsed, 4))
+            logger.info("⏱ Запуск: %s через %.3f с", phase, elapsed)
+        return self.phases[phase]
+
+    def stats(self):
+        return {phase: round(elapsed, 3) for phase, elapsed in self.phases.items()}
@@ -0,0 +1,204 @@
+import json
+import re
+import uuid
+from datetime import datetime
+
+# Госномер РФ (А123ВС77, с пробелами или латиницей) и VIN
+_PLATE_LETTERS = 'АВЕКМНОРСТУХABEKMHOPCTYX'
+PLATE_RE = re.compile(
+    rf"(?<![\w])([{_PLATE_LETTERS}])\s*(\d{{3}})\s*([{_PLATE_LETTERS}]{{2}})\s*(\d{{2,3}})(?![\w])",
+    re.IGNORECASE
+)
+VIN_RE = re.compile(r"(?<![\w])[A-HJ-NPR-Z0-9]{17}(?![\w])", re.IGNORECASE)
+
+# Латинские буквы, совпадающие по написанию с буквами номера
+_LATIN_TO_CYRILLIC = str.maketrans('ABEKMHOPCTYX', 'АВЕКМНОРСТУХ')
+
+
+# Номер телефона для поиска: последние 10 цифр (+7 и 8 в начале не важны)
+def normalize_phone(phone):
+    digits = re.sub(r"\D", '', phone or '')
+    return digits[-10:] if len(digits) >= 7 else None
+
+
+# Номера и VIN из свободного текста в едином написании
+def extract_plates(text):
+    if not text:
+        return []
+    plates = [
+        ''.join(match.groups()).upper().translate(_LATIN_TO_CYRILLIC)
+        for match in PLATE_RE.finditer(text)
+    ]
+    plates.extend(match.group(0).upper() for match in VIN_RE.finditer(text))
+    return plates
+
+
+# Результат ClaimDraft.add_photo
+PHOTO_ADDED, PHOTO_DUPLICATE, PHOTO_LIMIT = 'added', 'duplicate', 'limit'
+
+
+# Черновик заявки. __slots__ вместо словаря: меньше памяти на каждого водителя
+# и обращение к полям без поиска по строковому ключу.
+class ClaimDraft:
+    __slots__ = (
+        'claim_id', 'user_id', 'username', 'language', 'full_name', 'phone',
+        'latitude', 'longitude', 'car_details', 'accident_details',
+        'photos', 'photo_unique_ids', 'created_at', 'status'
+    )
+
+    def __init__(self, user_id, username=None, language=None, full_name='', phone=None,
+                 latitude=None, longitude=None, car_details=None, accident_details=None,
+                 photos=None, created_at=None, status='new', claim_id=None, photo_unique_ids=None):
+        # Короткий ID заявки для логов и сообщений администратору
+        self.claim_id = claim_id or uuid.uuid4().hex[:12]
+        self.user_id = user_id
+        self.username = username
+        self.language = language
+        self.full_name = full_name
+        self.phone = phone
+        self.latitude = latitude
+        self.longitude = longitude
+        self.car_details = car_details
+        self.accident_details = accident_details
+        self.photos = photos if photos is not None else []
+        # file_unique_id каждого фото (по порядку photos): одинаков у одного и того же файла
+        # в любом чате и у любого бота, в отличие от file_id
+        if photo_unique_ids is None or len(photo_unique_ids) != len(self.photos):
+            photo_unique_ids = list(self.photos)
+        self.photo_unique_ids = photo_unique_ids
+        self.created_at = created_at or datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        self.status = status
+
+    @classmethod
+    def from_user(cls, user):
+        return cls(
+            user_id=user.id,
+            username=user.username,
+            language=user.language_code,
+            full_name=f"{user.first_name} {user.last_name or ''}".strip()
+        )
+
+    @property
+    def location(self):
+        if self.latitude is None:
+            return None
+        return {'latitude': self.latitude, 'longitude': self.longitude}
+
+    def set_location(self, latitude, longitude):
+        self.latitude = latitude
+        self.longitude = longitude
+
+    # Добавление фото с проверкой повтора и лимита (проверка и запись без await между ними):
+    # PHOTO_ADDED, PHOTO_DUPLICATE (уже прикреплено) или PHOTO_LIMIT (места нет)
+    def add_photo(self, file_id, file_unique_id=None, limit=None):
+        if file_unique_id is not None and file_unique_id in self.photo_unique_ids:
+            return PHOTO_DUPLICATE
+        if limit is not None and len(self.photos) >= limit:
+            return PHOTO_LIMIT
+        self.photos.append(file_id)
+        self.photo_unique_ids.append(file_unique_id or file_id)
+        return PHOTO_ADDED
+
+    def remove_photo(self, file_id):
+        if file_id not in self.photos:
+            return False
+        index = self.photos.index(file_id)
+        del self.photos[index]
+        del self.photo_unique_ids[index]
+        return True
+
+    def plates(self):
+        return extract_plates(self.car_details)
+
+    # Незаполненные обязательные поля в порядке шагов
+    def missing_fields(self):
+        missing = []
+        if not self.phone:
+            missing.append('phone')
+        if self.latitude is None:
+            missing.append('location')
+        if not self.car_details:
+            missing.append('car_details')
+        if not self.accident_details:
+            missing.append('accident_details')
+        return missing
+
+    # Сериализация: формат словаря совпадает со схемой хранилища
+    # (и с черновиками, сохраненными до появления ClaimDraft)
+    def to_dict(self):
+        return {
+            'claim_id': self.claim_id,
+            'user_id': self.user_id,
+            'username': self.username,
+            'language': self.language,
+            'full_name': self.full_name,
+            'phone': self.phone,
+            'location': self.location,
+            'car_details': self.car_details,
+            'accident_details': self.accident_details,
+            'photos': list(self.photos),
+            'photo_unique_ids': list(self.photo_unique_ids),
+            'created_at': self.created_at,
+            'status': self.status
+        }
+
+    def to_json(self):
+        return json.dumps(self.to_dict(), ensure_ascii=False)
+
+    @classmethod
+    def from_dict(cls, data):
+        if not isinstance(data, dict):
+            raise ValueError("Черновик должен быть объектом JSON")
+
+        user_id = data.get('user_id')
+        if not isinstance(user_id, int):
+            raise ValueError(f"Некорректный user_id: {user_id!r}")
+
+        location = data.get('location')
+        latitude = longitude = None
+        if location is not None:
+            try:
+                latitude, longitude = float(location['latitude']), float(location['longitude'])
+            except (KeyError, TypeError, ValueError):
+                raise ValueError(f"Некорректное местоположение: {location!r}")
+            if not (-90 <= latitude <= 90 and -180 <= longitude <= 180):
+                raise ValueError(f"Координаты вне диапазона: {latitude}, {longitude}")
+
+        photos = data.get('photos') or []
+        if not isinstance(photos, list) or not all(isinstance(photo, str) for photo in photos):
+            raise ValueError("Некорректный список фото")
+        photo_unique_ids = data.get('photo_unique_ids')
+        if photo_unique_ids is not None and (
+            not isinstance(photo_unique_ids, list) or not all(isinstance(uid, str) for uid in photo_unique_ids)
+        ):
+            raise ValueError("Некорректный список file_unique_id фото")
+
+        for field in ('claim_id', 'username', 'language', 'phone', 'car_details', 'accident_details', 'status'):
+            if data.get(field) is not None and not isinstance(data[field], str):
+                raise ValueError(f"Поле {field} должно быть строкой")
+
+        return cls(
+            user_id=user_id,
+            username=data.get('username'),
+            language=data.get('language'),
+            full_name=data.get('full_name') or '',
+            phone=data.get('phone'),
+            latitude=latitude,
+            longitude=longitude,
+            car_details=data.get('car_details'),
+            accident_details=data.get('accident_details'),
+            photos=photos,
+            # У черновиков, сохраненных до появления photo_unique_ids, ключом служит file_id
+            photo_unique_ids=photo_unique_ids,
+            created_at=data.get('created_at'),
+            status=data.get('status') or 'new',
+            # У черновиков, сохраненных до появления claim_id, ID создается заново
+            claim_id=data.get('claim_id')
+        )
+
+    @classmethod
+    def from_json(cls, text):
+        return cls.from_dict(json.loads(text))
+
+    def __repr__(self):
+        return f"ClaimDraft(claim_id={self.claim_id}, user_id={self.user_id}, missing={self.missing_fields()})"
@@ -0,0 +1,350 @@
+import asyncio
+import logging
+import random
+import time
+import uuid
+
+import telegram
+from telegram.error import BadRequest, ChatMigrated, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from metrics import RETRY_RATE_LIMITED, Histogram
+
+logger = logging.getLogger(__name__)
+
+# Объекты Telegram, которые встречаются в аргументах вызовов и восстанавливаются из хранилища
+SERIALIZABLE_TYPES = (
+    'ReplyKeyboardMarkup', 'ReplyKeyboardRemove', 'InlineKeyboardMarkup', 'ForceReply', 'InputMediaPhoto'
+)
+
+
+# Аргумент вызова → JSON-совместимое значение (объекты Telegram — через to_dict)
+def _encode(value):
+    if isinstance(value, telegram.TelegramObject):
+        return {'__telegram__': type(value).__name__, 'data': value.to_dict()}
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    return value
+
+
+def _decode(value):
+    if isinstance(value, list):
+        return [_decode(item) for item in value]
+    if isinstance(value, dict) and '__telegram__' in value:
+        if value['__telegram__'] not in SERIALIZABLE_TYPES:
+            raise ValueError(f"Неизвестный тип объекта Telegram: {value['__telegram__']}")
+        data = dict(value['data'])
+        if value['__telegram__'] == 'InputMediaPhoto':
+            data.pop('type', None)
+            return telegram.InputMediaPhoto(**data)
+        return getattr(telegram, value['__telegram__']).de_json(data, None)
+    return value
+
+
+# Ограничение частоты отправки в один чат (маркерная корзина)
+class TokenBucket:
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+
+    # Сколько ждать до следующей отправки; 0 — маркер взят, можно отправлять
+    def take(self):
+        now = time.monotonic()
+        if now < self.paused_until:
+            return self.paused_until - now
+
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+    # Telegram попросил подождать (RetryAfter)
+    def pause(self, seconds):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+        self.tokens = 0
+
+
+# Вызов Bot API в составе доставки: имя метода бота, аргументы
+# и запасной вызов на случай окончательной ошибки (например, альбом без подписи)
+class OutboundCall:
+    __slots__ = ('method', 'kwargs', 'fallback')
+
+    def __init__(self, method, fallback=None, **kwargs):
+        self.method = method
+        self.kwargs = kwargs
+        self.fallback = fallback
+
+    def to_dict(self):
+        return {
+            'method': self.method,
+            'kwargs': {name: _encode(value) for name, value in self.kwargs.items()},
+            'fallback': self.fallback.to_dict() if self.fallback is not None else None
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        fallback = cls.from_dict(data['fallback']) if data.get('fallback') else None
+        return cls(data['method'], fallback=fallback,
+                   **{name: _decode(value) for name, value in data['kwargs'].items()})
+
+
+# Доставка: последовательность вызовов в один чат (например, сводка и альбом заявки).
+# В хранилище сохраняются чат, метка и еще не отправленные вызовы.
+class Delivery:
+    __slots__ = ('delivery_id', 'chat_id', 'calls', 'label', 'position', 'attempts', 'enqueued_at', 'skipped')
+
+    def __init__(self, chat_id, calls, label, delivery_id=None):
+        self.delivery_id = delivery_id or uuid.uuid4().hex
+        self.chat_id = chat_id
+        self.calls = list(calls)
+        self.label = label
+        self.position = 0
+        self.attempts = 0
+        self.enqueued_at = time.monotonic()
+        # Вызовы, пропущенные после окончательной ошибки без запасного варианта
+        self.skipped = 0
+
+    def to_dict(self):
+        return {
+            'chat_id': self.chat_id,
+            'label': self.label,
+            'calls': [call.to_dict() for call in self.calls[self.position:]],
+            'skipped': self.skipped
+        }
+
+    @classmethod
+    def from_dict(cls, delivery_id, data):
+        delivery = cls(data['chat_id'], [OutboundCall.from_dict(call) for call in data['calls']],
+                       data['label'], delivery_id=delivery_id)
+        delivery.skipped = data.get('skipped', 0)
+        return delivery
+
+
+# Фоновая очередь исходящих сообщений: пул воркеров, повтор при сетевых ошибках
+# с экспоненциальной задержкой (не больше max_attempts попыток подряд), учет RetryAfter
+# и лимитов на чат. Пока доставка ждет повтора, воркер свободен и обслуживает другие чаты.
+# Остальные ошибки Telegram повтором не лечатся: вызов заменяется запасным или пропускается.
+# Группа, ставшая супергруппой (ChatMigrated), получает доставку по новому id,
+# о смене id сообщается в on_migrated(old_chat_id, new_chat_id).
+# Доставка, в которой хотя бы один вызов не удался, считается недоставленной
+# и передается в on_failed(delivery).
+# С хранилищем (start(bot, storage)) доставка сохраняется до подтверждения отправки:
+# не доставленное к остановке отправляется после перезапуска процессом с тем же owner.
+# Вызов, отправленный прямо перед сбоем процесса, после перезапуска может повториться.
+class Outbox:
+    def __init__(self, workers=4, rate_per_minute=20, burst=20, base_backoff=1.0, max_backoff=300.0,
+                 max_attempts=10, on_failed=None, on_migrated=None, owner='main'):
+        self.workers = workers
+        self.rate = rate_per_minute / 60
+        self.burst = burst
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.max_attempts = max_attempts
+        self.on_failed = on_failed
+        self.on_migrated = on_migrated
+        self.owner = owner
+
+        self.bot = None
+        self.storage = None
+        self._queue = None
+        self._tasks = []
+        self._buckets = {}
+        self._pending = 0
+        self._idle = None
+
+        self.in_flight = 0
+        self.delivered = 0
+        self.failed = 0
+        self.retries = 0
+        self.latency = Histogram(
+            'bot_outbox_delivery_seconds',
+            "Время от постановки в очередь отправки до доставки",
+            buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 300)
+        )
+
+    async def start(self, bot, storage=None):
+        self.bot = bot
+        self.storage = storage
+        self._queue = asyncio.Queue()
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+        if storage is not None:
+            restored = 0
+            for delivery_id, data in (await storage.load_deliveries(self.owner)).items():
+                try:
+                    delivery = Delivery.from_dict(delivery_id, data)
+                except (KeyError, TypeError, ValueError) as e:
+                    logger.error("Пропущена поврежденная доставка %s: %s", delivery_id, e)
+                    storage.delete_delivery(self.owner, delivery_id)
+                    continue
+                self._enqueue(delivery)
+                restored += 1
+            if restored:
+                logger.info("📤 Восстановлено недоставленных сообщений: %s", restored)
+
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f"outbox-worker-{i}")
+            for i in range(self.workers)
+        ]
+
+    # Дожидаемся отправки накопленного и останавливаем воркеры
+    async def stop(self, timeout=25):
+        if not self._tasks:
+            return
+        try:
+            await asyncio.wait_for(self._idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            if self.storage is not None:
+                logger.warning("Очередь отправки остановлена, отправка после перезапуска: %s", self._pending)
+            else:
+                logger.error("Очередь отправки остановлена, не доставлено: %s", self._pending)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def submit(self, chat_id, calls, label=''):
+        delivery = Delivery(chat_id, calls, label)
+        self._save(delivery)
+        self._enqueue(delivery)
+
+    def _enqueue(self, delivery):
+        self._pending += 1
+        self._idle.clear()
+        self._queue.put_nowait(delivery)
+
+    def _save(self, delivery):
+        if self.storage is not None:
+            self.storage.save_delivery(self.owner, delivery.delivery_id, delivery)
+
+    def stats(self):
+        return {
+            'depth': self._pending - self.in_flight,
+            'in_flight': self.in_flight,
+            'delivered': self.delivered,
+            'failed': self.failed,
+            'retries': self.retries,
+            'latency': self.latency.snapshot()
+        }
+
+    def _bucket(self, chat_id):
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            bucket = self._buckets[chat_id] = TokenBucket(self.rate, self.burst)
+        return bucket
+
+    def _retry_later(self, delivery, delay):
+        asyncio.get_running_loop().call_later(delay, self._queue.put_nowait, delivery)
+
+    def _finish(self, delivery, ok):
+        if ok:
+            self.delivered += 1
+            self.latency.observe(time.monotonic() - delivery.enqueued_at)
+        else:
+            self.failed += 1
+        self._pending -= 1
+        if not self._pending:
+            self._idle.set()
+        if self.storage is not None:
+            self.storage.delete_delivery(self.owner, delivery.delivery_id)
+        if not ok and self.on_failed is not None:
+            try:
+                self.on_failed(delivery)
+            except Exception:
+                logger.exception("Ошибка обработчика недоставленного сообщения (%s)", delivery.label)
+
+    # Повтор не поможет: пробуем запасной вариант или пропускаем вызов
+    def _give_up(self, delivery, call, error):
+        if call.fallback is not None:
+            logger.error("Ошибка %s (%s), отправляем запасной вариант: %s", call.method, delivery.label, error)
+            delivery.calls[delivery.position] = call.fallback
+        else:
+            logger.error("Ошибка %s (%s), вызов пропущен: %s", call.method, delivery.label, error)
+            delivery.skipped += 1
+            delivery.position += 1
+        delivery.attempts = 0
+        self._save(delivery)
+
+    def _migrate(self, old_chat_id, new_chat_id):
+        bucket = self._buckets.pop(old_chat_id, None)
+        if bucket is not None:
+            self._buckets.setdefault(new_chat_id, bucket)
+        if self.on_migrated is not None:
+            try:
+                self.on_migrated(old_chat_id, new_chat_id)
+            except Exception:
+                logger.exception("Ошибка обработчика смены id чата %s", old_chat_id)
+
+    async def _worker(self):
+        # RetryAfter обрабатывает очередь, а не транспорт
+        RETRY_RATE_LIMITED.set(False)
+        while True:
+            delivery = await self._queue.get()
+            self.in_flight += 1
+            try:
+                await self._process(delivery)
+            except Exception:
+                logger.exception("Сбой обработки доставки %s", delivery.label)
+                self._finish(delivery, ok=False)
+            finally:
+                self.in_flight -= 1
+
+    async def _process(self, delivery):
+        bucket = self._bucket(delivery.chat_id)
+        while delivery.position < len(delivery.calls):
+            wait = bucket.take()
+            if wait:
+                self._retry_later(delivery, wait)
+                return
+
+            call = delivery.calls[delivery.position]
+            try:
+                await getattr(self.bot, call.method)(chat_id=delivery.chat_id, **call.kwargs)
+            except RetryAfter as e:
+                retry_after = e.retry_after.total_seconds() if hasattr(e.retry_after, 'total_seconds') else e.retry_after
+                logger.warning("Лимит Telegram для чата %s, повтор через %s с", delivery.chat_id, retry_after)
+                bucket.pause(retry_after)
+                self.retries += 1
+                self._retry_later(delivery, retry_after)
+                return
+            except ChatMigrated as e:
+                if e.new_chat_id == delivery.chat_id:
+                    self._give_up(delivery, call, e)
+                    continue
+                logger.warning("Чат %s стал супергруппой %s (%s)", delivery.chat_id, e.new_chat_id, delivery.label)
+                self._migrate(delivery.chat_id, e.new_chat_id)
+                delivery.chat_id = e.new_chat_id
+                self._save(delivery)
+                continue
+            except (BadRequest, Forbidden) as e:
+                self._give_up(delivery, call, e)
+                continue
+            except NetworkError as e:
+                delivery.attempts += 1
+                if delivery.attempts >= self.max_attempts:
+                    logger.error("Ошибка %s (%s), попыток: %s, доставка прекращена: %s",
+                                 call.method, delivery.label, delivery.attempts, e)
+                    delivery.skipped += len(delivery.calls) - delivery.position
+                    break
+                delay = min(self.max_backoff, self.base_backoff * 2 ** (delivery.attempts - 1))
+                delay *= random.uniform(0.5, 1.0)
+                logger.warning("Сетевая ошибка %s (%s), попытка %s, повтор через %.1f с: %s",
+                               call.method, delivery.label, delivery.attempts, delay, e)
+                self.retries += 1
+                self._retry_later(delivery, delay)
+                return
+            except TelegramError as e:
+                self._give_up(delivery, call, e)
+                continue
+
+            delivery.position += 1
+            delivery.attempts = 0
+            if delivery.position < len(delivery.calls):
+                self._save(delivery)
+
+        self._finish(delivery, ok=not delivery.skipped)
@@ -0,0 +1,399 @@
+import asyncio
+import hashlib
+import importlib.util
+import logging
+import multiprocessing
+import os
+import sqlite3
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import httpx
+
+# Pillow нужен только процессам миниатюр: сам модуль импортируется там,
+# чтобы не удлинять холодный старт бота
+PILLOW_AVAILABLE = importlib.util.find_spec('PIL') is not None
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS photos (
+        sha256 TEXT PRIMARY KEY,
+        size INTEGER NOT NULL,
+        phash TEXT,
+        width INTEGER,
+        height INTEGER,
+        path TEXT NOT NULL,
+        thumb_path TEXT,
+        created_at REAL NOT NULL
+    );
+    -- file_unique_id → содержимое: повторно присланный файл не скачивается
+    CREATE TABLE IF NOT EXISTS photo_sources (
+        file_unique_id TEXT PRIMARY KEY,
+        sha256 TEXT NOT NULL
+    );
+    -- Фото заявки; similar_to — уже прикрепленный похожий снимок (по перцептивному хешу)
+    CREATE TABLE IF NOT EXISTS claim_photos (
+        claim_id TEXT NOT NULL,
+        sha256 TEXT NOT NULL,
+        file_id TEXT NOT NULL,
+        user_id INTEGER,
+        similar_to TEXT,
+        added_at REAL NOT NULL,
+        PRIMARY KEY (claim_id, sha256)
+    );
+"""
+
+CHUNK_SIZE = 64 * 1024
+
+
+# Перцептивный хеш (dHash, 64 бита): у пересжатого или уменьшенного снимка того же кадра
+# хеши отличаются на несколько бит
+def dhash(image):
+    from PIL import Image
+
+    small = image.convert('L').resize((9, 8), Image.LANCZOS)
+    pixels = list(small.getdata())
+    bits = 0
+    for row in range(8):
+        for col in range(8):
+            bits = (bits << 1) | (pixels[row * 9 + col] > pixels[row * 9 + col + 1])
+    return f"{bits:016x}"
+
+
+def hamming(a, b):
+    return bin(int(a, 16) ^ int(b, 16)).count('1')
+
+
+# Выполняется в пуле процессов: декодирование JPEG и уменьшение занимают процессор
+def process_image(path, thumb_path, size):
+    from PIL import Image
+
+    with Image.open(path) as image:
+        width, height = image.size
+        # JPEG декодируется сразу в уменьшенном масштабе
+        image.draft('RGB', (size, size))
+        phash = dhash(image)
+        image = image.convert('RGB')
+        image.thumbnail((size, size))
+        os.makedirs(os.path.dirname(thumb_path), exist_ok=True)
+        partial = f"{thumb_path}.{uuid.uuid4().hex}.part"
+        image.save(partial, 'JPEG', quality=80)
+        os.replace(partial, thumb_path)
+    return phash, width, height
+
+
+class _Job:
+    __slots__ = ('user_id', 'claim_id', 'file_id', 'file_unique_id')
+
+    def __init__(self, user_id, claim_id, file_id, file_unique_id):
+        self.user_id = user_id
+        self.claim_id = claim_id
+        self.file_id = file_id
+        self.file_unique_id = file_unique_id
+
+
+# Фоновая обработка фото заявок: скачивание ограниченным числом воркеров потоком на диск
+# (файл не держится в памяти целиком), SHA-256 по ходу скачивания, перцептивный хеш
+# и миниатюра в пуле процессов, хранение по адресу содержимого (<sha256[:2]>/<sha256>.jpg)
+# и связь с заявкой в SQLite. Повтор внутри заявки (то же содержимое, SHA-256)
+# передается в on_duplicate(user_id, claim_id, file_id), чтобы убрать его из черновика.
+# Похожий снимок (перцептивный хеш отличается не больше чем на phash_distance бит)
+# остается в заявке: это может быть другой кадр того же повреждения, поэтому он только
+# помечается, и администратор видит пометку (similar_photos).
+# Одинаковое содержимое, которое скачивают одновременно (одно фото в разных заявках),
+# сохраняется один раз: остальные воркеры ждут первого (_in_flight).
+# Без Pillow (pip install Pillow) дубли ищутся только по SHA-256, миниатюр нет.
+class PhotoPipeline:
+    def __init__(self, root, workers=4, processes=2, thumb_size=320, max_bytes=20 * 1024 * 1024,
+                 phash_distance=6, queue_size=1000, on_duplicate=None):
+        self.root = root
+        self.workers = workers
+        self.processes = processes
+        self.thumb_size = thumb_size
+        self.max_bytes = max_bytes
+        self.phash_distance = phash_distance
+        self.on_duplicate = on_duplicate
+
+        self._queue = asyncio.Queue(maxsize=queue_size)
+        self._bot = None
+        self._conn = None
+        self._executor = None
+        self._process_pool = None
+        self._client = None
+        self._tasks = []
+        self._stopped = False
+        # sha256 → future сохранения, которое сейчас идет
+        self._in_flight = {}
+
+        self.stored = 0
+        self.reused = 0
+        self.duplicates = 0
+        self.similar = 0
+        self.failed = 0
+        self.dropped = 0
+        self.bytes_downloaded = 0
+
+    # ssl_context — общий с клиентами Bot API (создание своего занимает десятки мс)
+    async def start(self, bot, ssl_context=None):
+        if self._conn is not None:
+            return
+        self._bot = bot
+        os.makedirs(os.path.join(self.root, 'tmp'), exist_ok=True)
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='photo-index')
+        self._conn = await self._run(self._connect)
+        if PILLOW_AVAILABLE and self.processes:
+            # spawn: процесс бота уже многопоточный, fork в таком процессе небезопасен
+            self._process_pool = ProcessPoolExecutor(
+                max_workers=self.processes,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        elif not PILLOW_AVAILABLE:
+            logger.warning("Pillow не установлен: миниатюры и поиск похожих фото отключены (pip install Pillow)")
+        self._client = httpx.AsyncClient(
+            verify=ssl_context or True,
+            timeout=httpx.Timeout(30.0, connect=10.0),
+            limits=httpx.Limits(max_connections=self.workers, max_keepalive_connections=self.workers)
+        )
+        self._tasks = [
+            asyncio.create_task(self._worker(), name=f'photo-worker-{index}')
+            for index in range(self.workers)
+        ]
+        logger.info("🖼 Хранилище фото: %s, воркеров: %s", self.root, self.workers)
+
+    # Дорабатывает очередь не дольше timeout секунд
+    async def stop(self, timeout=25):
+        self._stopped = True
+        if self._conn is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Фото не обработаны при остановке: %s", self._queue.qsize())
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        await self._client.aclose()
+        if self._process_pool is not None:
+            self._process_pool.shutdown(wait=True)
+            self._process_pool = None
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+        self._conn = None
+
+    # Постановка фото в очередь; False, если очередь переполнена или хранилище остановлено
+    # (фото остается только в file_id). До start() фото ждут в очереди
+    def submit(self, user_id, claim_id, file_id, file_unique_id):
+        if self._stopped:
+            return False
+        try:
+            self._queue.put_nowait(_Job(user_id, claim_id, file_id, file_unique_id))
+        except asyncio.QueueFull:
+            self.dropped += 1
+            logger.warning("Очередь фото переполнена, фото заявки %s не сохранено", claim_id)
+            return False
+        return True
+
+    def stats(self):
+        return {
+            'queued': self._queue.qsize(),
+            'stored': self.stored,
+            'reused': self.reused,
+            'duplicates': self.duplicates,
+            'similar': self.similar,
+            'failed': self.failed,
+            'dropped': self.dropped,
+            'bytes_downloaded': self.bytes_downloaded,
+        }
+
+    # Фото заявки по порядку добавления
+    async def claim_photos(self, claim_id):
+        return await self._run(self._fetch, """
+            SELECT p.sha256, p.path, p.thumb_path, p.width, p.height, p.size
+            FROM claim_photos c JOIN photos p ON p.sha256 = c.sha256
+            WHERE c.claim_id = ?
+            ORDER BY c.added_at
+        """, (claim_id,))
+
+    # Уже обработанные фото заявки, похожие на прикрепленные раньше: [(sha256, similar_to)].
+    # Фото, которые еще в очереди, сюда не попадают; до start() — пустой список
+    async def similar_photos(self, claim_id):
+        if self._conn is None:
+            return []
+        return await self._run(self._fetch, """
+            SELECT sha256, similar_to FROM claim_photos
+            WHERE claim_id = ? AND similar_to IS NOT NULL
+            ORDER BY added_at
+        """, (claim_id,))
+
+    def _connect(self):
+        conn = sqlite3.connect(os.path.join(self.root, 'index.sqlite3'), check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(SCHEMA)
+        # Раньше похожие снимки убирались из заявки и отмечались в duplicate_of
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(claim_photos)")}
+        if 'duplicate_of' in columns:
+            conn.execute("ALTER TABLE claim_photos RENAME COLUMN duplicate_of TO similar_to")
+        return conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    def _fetch(self, query, params):
+        return self._conn.execute(query, params).fetchall()
+
+    def _path(self, sha256, kind='files'):
+        return os.path.join(self.root, kind, sha256[:2], f"{sha256}.jpg")
+
+    async def _worker(self):
+        while True:
+            job = await self._queue.get()
+            try:
+                await self._process(job)
+            except Exception:
+                self.failed += 1
+                logger.exception("Ошибка обработки фото заявки %s", job.claim_id)
+            finally:
+                self._queue.task_done()
+
+    async def _process(self, job):
+        rows = await self._run(
+            self._fetch, "SELECT sha256 FROM photo_sources WHERE file_unique_id = ?", (job.file_unique_id,)
+        )
+        if rows:
+            sha256 = rows[0][0]
+            self.reused += 1
+        else:
+            sha256 = await self._store(job)
+        linked, similar_to = await self._run(self._link, job, sha256)
+        if not linked:
+            self.duplicates += 1
+            logger.info("Фото %s уже есть в заявке %s", sha256[:12], job.claim_id)
+            if self.on_duplicate is not None:
+                self.on_duplicate(job.user_id, job.claim_id, job.file_id)
+        elif similar_to is not None:
+            self.similar += 1
+            logger.info("Фото %s заявки %s похоже на %s", sha256[:12], job.claim_id, similar_to[:12])
+
+    # Скачивание, запись по адресу содержимого, миниатюра и хеш
+    async def _store(self, job):
+        telegram_file = await self._bot.get_file(job.file_id)
+        partial = os.path.join(self.root, 'tmp', f"{uuid.uuid4().hex}.part")
+        try:
+            sha256, size = await self._download(telegram_file.file_path, partial)
+            path = self._path(sha256)
+            # То же содержимое уже сохраняет другой воркер: ждем его и проверяем результат
+            while (pending := self._in_flight.get(sha256)) is not None:
+                await asyncio.shield(pending)
+            saved = self._in_flight[sha256] = asyncio.get_running_loop().create_future()
+            try:
+                await self._save(sha256, size, partial, path)
+            finally:
+                del self._in_flight[sha256]
+                saved.set_result(None)
+            await self._run(
+                self._execute,
+                "INSERT OR REPLACE INTO photo_sources (file_unique_id, sha256) VALUES (?, ?)",
+                (job.file_unique_id, sha256)
+            )
+            return sha256
+        finally:
+            if os.path.exists(partial):
+                os.remove(partial)
+
+    # Файл по адресу содержимого, миниатюра и запись в photos (если содержимое новое)
+    async def _save(self, sha256, size, partial, path):
+        known = await self._run(self._fetch, "SELECT 1 FROM photos WHERE sha256 = ?", (sha256,))
+        if known:
+            self.reused += 1
+        else:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.replace(partial, path)
+            phash = width = height = None
+            thumb_path = None
+            if self._process_pool is not None:
+                thumb_path = self._path(sha256, 'thumbs')
+                loop = asyncio.get_running_loop()
+                try:
+                    phash, width, height = await loop.run_in_executor(
+                        self._process_pool, process_image, path, thumb_path, self.thumb_size
+                    )
+                except Exception:
+                    logger.warning("Не удалось построить миниатюру %s", sha256[:12], exc_info=True)
+                    thumb_path = None
+            inserted = await self._run(
+                self._execute,
+                "INSERT OR IGNORE INTO photos (sha256, size, phash, width, height, path, thumb_path, created_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                (sha256, size, phash, width, height, os.path.relpath(path, self.root),
+                 thumb_path and os.path.relpath(thumb_path, self.root), time.time())
+            )
+            if inserted:
+                self.stored += 1
+            else:
+                self.reused += 1
+
+    # Скачивание потоком с подсчетом SHA-256. Путь к файлу на диске — локальный режим
+    # telegram-bot-api (--local), иначе URL файла. Куски небольшие, запись идет в page cache.
+    async def _download(self, file_path, partial):
+        digest = hashlib.sha256()
+        size = 0
+        with open(partial, 'wb') as out:
+            if os.path.isabs(file_path) and os.path.exists(file_path):
+                with open(file_path, 'rb') as source:
+                    while chunk := source.read(CHUNK_SIZE):
+                        size = self._write_chunk(out, digest, chunk, size)
+            else:
+                async with self._client.stream('GET', file_path) as response:
+                    response.raise_for_status()
+                    async for chunk in response.aiter_bytes(CHUNK_SIZE):
+                        size = self._write_chunk(out, digest, chunk, size)
+        self.bytes_downloaded += size
+        return digest.hexdigest(), size
+
+    def _write_chunk(self, out, digest, chunk, size):
+        size += len(chunk)
+        if size > self.max_bytes:
+            raise ValueError(f"Фото больше {self.max_bytes} байт")
+        digest.update(chunk)
+        out.write(chunk)
+        return size
+
+    # Число измененных строк
+    def _execute(self, query, params):
+        with self._conn:
+            return self._conn.execute(query, params).rowcount
+
+    # Привязка к заявке в потоке базы: проверка и запись не перемежаются с другими фото
+    # той же заявки. Возвращает (привязано ли фото, sha256 похожего снимка или None);
+    # не привязывается только то же содержимое, что уже есть в заявке.
+    def _link(self, job, sha256):
+        rows = self._conn.execute("""
+            SELECT c.sha256, p.phash FROM claim_photos c JOIN photos p ON p.sha256 = c.sha256
+            WHERE c.claim_id = ?
+            ORDER BY c.added_at
+        """, (job.claim_id,)).fetchall()
+        if any(other_sha256 == sha256 for other_sha256, _ in rows):
+            return False, None
+
+        phash_row = self._conn.execute("SELECT phash FROM photos WHERE sha256 = ?", (sha256,)).fetchone()
+        phash = phash_row[0] if phash_row else None
+        similar_to = None
+        if phash:
+            for other_sha256, other_phash in rows:
+                if other_phash and hamming(phash, other_phash) <= self.phash_distance:
+                    similar_to = other_sha256
+                    break
+
+        with self._conn:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO claim_photos (claim_id, sha256, file_id, user_id, similar_to, added_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (job.claim_id, sha256, job.file_id, job.user_id, similar_to, time.time())
+            )
+        return True, similar_to
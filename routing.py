@@ -0,0 +1,188 @@
+import json
+import logging
+import math
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    dphi = phi2 - phi1
+    dlmb = math.radians(lon2 - lon1)
+    a = math.sin(dphi / 2) ** 2 + math.cos(phi1) * math.cos(phi2) * math.sin(dlmb / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(a))
+
+
+# Точка на единичной сфере: евклидово расстояние между такими точками
+# монотонно по расстоянию на поверхности Земли
+def to_xyz(lat, lon):
+    phi, lmb = math.radians(lat), math.radians(lon)
+    return (math.cos(phi) * math.cos(lmb), math.cos(phi) * math.sin(lmb), math.sin(phi))
+
+
+def point_in_polygon(lat, lon, polygon):
+    inside = False
+    j = len(polygon) - 1
+    for i in range(len(polygon)):
+        lat_i, lon_i = polygon[i]
+        lat_j, lon_j = polygon[j]
+        if (lon_i > lon) != (lon_j > lon):
+            cross = (lat_j - lat_i) * (lon - lon_i) / (lon_j - lon_i) + lat_i
+            if lat < cross:
+                inside = not inside
+        j = i
+    return inside
+
+
+# Зона ответственности комиссара: круг (центр + радиус) или многоугольник
+class Zone:
+    __slots__ = ('name', 'chat_id', 'center', 'radius_km', 'polygon', 'bbox')
+
+    def __init__(self, name, chat_id, center=None, radius_km=None, polygon=None):
+        self.name = name
+        self.chat_id = chat_id
+        self.polygon = [tuple(point) for point in polygon] if polygon else None
+        self.radius_km = radius_km
+
+        if self.polygon:
+            lats = [point[0] for point in self.polygon]
+            lons = [point[1] for point in self.polygon]
+            self.center = tuple(center) if center else (sum(lats) / len(lats), sum(lons) / len(lons))
+            self.bbox = (min(lats), min(lons), max(lats), max(lons))
+        elif center and radius_km:
+            self.center = tuple(center)
+            dlat = radius_km / 111.32
+            dlon = radius_km / (111.32 * max(math.cos(math.radians(center[0])), 1e-6))
+            self.bbox = (center[0] - dlat, center[1] - dlon, center[0] + dlat, center[1] + dlon)
+        else:
+            raise ValueError(f"Зона {name}: нужен polygon или center + radius_km")
+
+    def contains(self, lat, lon):
+        min_lat, min_lon, max_lat, max_lon = self.bbox
+        if not (min_lat <= lat <= max_lat and min_lon <= lon <= max_lon):
+            return False
+        if self.polygon:
+            return point_in_polygon(lat, lon, self.polygon)
+        return haversine_km(lat, lon, *self.center) <= self.radius_km
+
+
+# k-d дерево по центрам зон для поиска ближайшего комиссара за O(log n)
+class KDTree:
+    def __init__(self, points):
+        # points: список (xyz, индекс зоны)
+        self.root = self._build(list(points), 0)
+
+    def _build(self, points, depth):
+        if not points:
+            return None
+        axis = depth % 3
+        points.sort(key=lambda item: item[0][axis])
+        middle = len(points) // 2
+        return (
+            points[middle],
+            axis,
+            self._build(points[:middle], depth + 1),
+            self._build(points[middle + 1:], depth + 1)
+        )
+
+    # Ближайшая точка, удовлетворяющая условию accept(индекс)
+    def nearest(self, target, accept):
+        best = [None, float('inf')]
+        self._search(self.root, target, accept, best)
+        return best[0]
+
+    def _search(self, node, target, accept, best):
+        if node is None:
+            return
+        (point, index), axis, left, right = node
+        distance = sum((a - b) ** 2 for a, b in zip(point, target))
+        if distance < best[1] and accept(index):
+            best[0], best[1] = index, distance
+
+        diff = target[axis] - point[axis]
+        near, far = (left, right) if diff < 0 else (right, left)
+        self._search(near, target, accept, best)
+        if diff * diff < best[1]:
+            self._search(far, target, accept, best)
+
+
+# Маршрутизация заявок по комиссарам.
+# Сетка ячеек хранит зоны, чьи границы пересекают ячейку: поиск зон, содержащих точку,
+# проверяет только кандидатов своей ячейки. Если точка не попала ни в одну зону
+# доступного комиссара, берется ближайший доступный по k-d дереву.
+class OperatorRouter:
+    def __init__(self, zones, cell_deg=0.05):
+        self.zones = list(zones)
+        self.cell_deg = cell_deg
+        self.unavailable = set()
+        self._grid = {}
+
+        for index, zone in enumerate(self.zones):
+            min_lat, min_lon, max_lat, max_lon = zone.bbox
+            for cell_lat in range(self._cell(min_lat), self._cell(max_lat) + 1):
+                for cell_lon in range(self._cell(min_lon), self._cell(max_lon) + 1):
+                    self._grid.setdefault((cell_lat, cell_lon), []).append(index)
+
+        self._tree = KDTree((to_xyz(*zone.center), index) for index, zone in enumerate(self.zones))
+
+    def __len__(self):
+        return len(self.zones)
+
+    def _cell(self, degrees):
+        return math.floor(degrees / self.cell_deg)
+
+    def _available(self, index):
+        return self.zones[index].chat_id not in self.unavailable
+
+    def set_available(self, chat_id, available=True):
+        if available:
+            self.unavailable.discard(chat_id)
+        else:
+            self.unavailable.add(chat_id)
+
+    # Группа комиссара стала супергруппой: зоны и отметка недоступности переходят на новый id
+    def migrate_chat(self, old_chat_id, new_chat_id):
+        for zone in self.zones:
+            if zone.chat_id == old_chat_id:
+                zone.chat_id = new_chat_id
+        if old_chat_id in self.unavailable:
+            self.unavailable.discard(old_chat_id)
+            self.unavailable.add(new_chat_id)
+
+    # Зона комиссара для точки ДТП или None, если доступных комиссаров нет
+    def route(self, lat, lon):
+        best, best_distance = None, float('inf')
+        for index in self._grid.get((self._cell(lat), self._cell(lon)), ()):
+            zone = self.zones[index]
+            if self._available(index) and zone.contains(lat, lon):
+                distance = haversine_km(lat, lon, *zone.center)
+                if distance < best_distance:
+                    best, best_distance = zone, distance
+        if best is not None:
+            return best
+
+        index = self._tree.nearest(to_xyz(lat, lon), self._available)
+        return self.zones[index] if index is not None else None
+
+
+# Загрузка зон из JSON:
+# {"operators": [{"name": "Север", "chat_id": -100123, "center": [55.85, 37.6], "radius_km": 8},
+#                {"name": "Юг", "chat_id": -100456, "polygon": [[55.6, 37.5], [55.6, 37.7], [55.7, 37.6]]}]}
+def load_router(path):
+    with open(path, encoding='utf-8') as f:
+        config = json.load(f)
+
+    zones = [
+        Zone(
+            name=item.get('name') or str(item['chat_id']),
+            chat_id=item['chat_id'],
+            center=item.get('center'),
+            radius_km=item.get('radius_km'),
+            polygon=item.get('polygon')
+        )
+        for item in config.get('operators', [])
+    ]
+    logger.info("🗺 Загружено зон комиссаров: %s", len(zones))
+    return OperatorRouter(zones, cell_deg=config.get('cell_deg', 0.05))
@@ -0,0 +1,365 @@
+import heapq
+import itertools
+import logging
+import math
+import re
+import time
+
+from routing import haversine_km
+
+logger = logging.getLogger(__name__)
+
+# Тяжесть ДТП по описанию: без пострадавших, есть пострадавшие, тяжелые последствия
+INJURY_NONE, INJURY, INJURY_SEVERE = 0, 1, 2
+
+# «Пострадавших нет», «без пострадавших», «никто не пострадал» — отрицания вырезаются до поиска
+_NO_INJURY_RE = re.compile(
+    r"(?:без|нет|никто\s+не|не\s+было)\s+(?:\w+\s+)?(?:пострадав\w*|ранен\w*|травм\w*|пострадал\w*)"
+    r"|(?:пострадав\w*|ранен\w*|травм\w*)\s+(?:нет|не\s+было|отсутству\w*)"
+    r"|\bno\s+(?:one\s+)?(?:injur\w*|hurt|casualt\w*)|\bnobody\s+(?:was\s+)?(?:hurt|injured)"
+    r"|\b(?:without|zero)\s+injur\w*",
+    re.IGNORECASE
+)
+_SEVERE_RE = re.compile(
+    r"погиб\w*|тяжел\w*|тяжёл\w*|реанимац\w*|без\s+сознания|госпитализ\w*|кровотеч\w*|"
+    r"\bdead\b|\bkilled\b|unconscious|critical\w*|severe\w*|bleeding",
+    re.IGNORECASE
+)
+_INJURY_RE = re.compile(
+    r"пострада\w*|ранен\w*|травм\w*|скор(?:ая|ую|ой)|перелом\w*|ушиб\w*|больниц\w*|"
+    r"injur\w*|\bhurt\b|ambulance|hospital|wounded",
+    re.IGNORECASE
+)
+
+
+def injury_level(text):
+    if not text:
+        return INJURY_NONE
+    text = _NO_INJURY_RE.sub(' ', text)
+    if _SEVERE_RE.search(text):
+        return INJURY_SEVERE
+    if _INJURY_RE.search(text):
+        return INJURY
+    return INJURY_NONE
+
+
+class Commissioner:
+    __slots__ = ('user_id', 'name', 'latitude', 'longitude', 'online', 'claim_id', 'updated_at', 'completed')
+
+    def __init__(self, user_id, name=None):
+        self.user_id = user_id
+        self.name = name or str(user_id)
+        self.latitude = None
+        self.longitude = None
+        self.online = False
+        self.claim_id = None
+        self.updated_at = None
+        self.completed = 0
+
+    @property
+    def free(self):
+        return self.online and self.claim_id is None
+
+
+# Заявка в диспетчерской: queued → assigned → (arrived) → done
+class DispatchClaim:
+    __slots__ = (
+        'claim_id', 'user_id', 'latitude', 'longitude', 'injury', 'created_at', 'key', 'state',
+        'commissioner_id', 'assigned_at', 'eta_min', 'arrived_at', 'done_at', 'chat_id', 'summary', 'language',
+        'queued_at', 'contact_breached', 'arrival_breached'
+    )
+
+    def __init__(self, claim_id, user_id, latitude, longitude, injury, created_at, key,
+                 chat_id=None, summary=None, language=None):
+        self.claim_id = claim_id
+        self.user_id = user_id
+        self.latitude = latitude
+        self.longitude = longitude
+        self.injury = injury
+        self.created_at = created_at
+        self.key = key
+        self.state = 'queued'
+        self.commissioner_id = None
+        self.assigned_at = None
+        self.eta_min = None
+        self.arrived_at = None
+        self.done_at = None
+        self.chat_id = chat_id
+        self.summary = summary
+        self.language = language
+        self.queued_at = created_at
+        # Нарушение SLA уже передано (за текущее ожидание или текущее назначение)
+        self.contact_breached = False
+        self.arrival_breached = False
+
+    def wait(self, now):
+        return (self.assigned_at or now) - self.created_at
+
+
+# Диспетчер комиссаров: очередь открытых заявок по приоритету, доступность и последнее
+# известное место комиссаров, автоназначение ближайшего свободного с оценкой времени прибытия.
+#
+# Приоритет = ожидание + надбавка за пострадавших. Надбавка не меняется со временем,
+# поэтому порядок двух заявок тоже не меняется, и ключ кучи постоянный:
+# created_at - надбавка (заявка с пострадавшими стоит так, будто пришла на 15–30 минут раньше).
+# Из кучи заявки удаляются лениво: взятая или отмененная пропускается при извлечении.
+#
+# Таймеры SLA ставит schedule(delay, callback) (в боте — JobQueue, в симуляции — свои часы):
+# заявка без комиссара через sla секунд и комиссар, не прибывший к ETA + arrival_grace,
+# передаются в on_breach(claim, kind). Назначения — в on_assign(claim, commissioner).
+# Заявка, вернувшаяся в очередь, снова получает таймер sla.
+#
+# Состояние (заявки и комиссары) сохраняется через to_dict() и восстанавливается
+# restore() после перезапуска; on_change() вызывается после каждого изменения.
+class DispatchScheduler:
+    def __init__(self, speed_kmh=30.0, sla=15 * 60, injury_boost=(0, 15 * 60, 30 * 60), arrival_grace=10 * 60,
+                 schedule=None, on_assign=None, on_breach=None, on_change=None, clock=time.time):
+        self.speed_kmh = speed_kmh
+        self.sla = sla
+        self.injury_boost = injury_boost
+        self.arrival_grace = arrival_grace
+        self.schedule = schedule
+        self.on_assign = on_assign
+        self.on_breach = on_breach
+        self.on_change = on_change
+        self.clock = clock
+
+        self.claims = {}
+        self.commissioners = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self.queued = 0
+        self.assigned_total = 0
+        self.breaches = {'contact': 0, 'arrival': 0}
+
+    # Заявки
+
+    # chat_id, summary и language не нужны диспетчеру — их читают обработчики on_assign/on_breach
+    def add_claim(self, claim_id, user_id, latitude, longitude, details,
+                  chat_id=None, summary=None, language=None, now=None):
+        now = self.clock() if now is None else now
+        injury = injury_level(details)
+        claim = DispatchClaim(
+            claim_id, user_id, latitude, longitude, injury, now,
+            key=now - self.injury_boost[injury], chat_id=chat_id, summary=summary, language=language
+        )
+        self.claims[claim_id] = claim
+        self._push(claim, now)
+        return self._changed(self._assign(now))
+
+    # В очередь (новая заявка или возвращенная ушедшим комиссаром) с таймером SLA
+    def _push(self, claim, now):
+        claim.state = 'queued'
+        claim.commissioner_id = None
+        claim.assigned_at = None
+        claim.queued_at = now
+        claim.contact_breached = False
+        self._enqueue(claim)
+        self._arm_contact(claim, self.sla)
+
+    def _enqueue(self, claim):
+        heapq.heappush(self._heap, (claim.key, next(self._seq), claim))
+        self.queued += 1
+
+    def _changed(self, result=None):
+        if self.on_change is not None:
+            self.on_change()
+        return result
+
+    # Открытые заявки в порядке приоритета
+    def queue(self, limit=10):
+        items = heapq.nsmallest(limit + self._stale(), self._heap)
+        return [claim for _, _, claim in items if claim.state == 'queued'][:limit]
+
+    def _stale(self):
+        return len(self._heap) - self.queued
+
+    # Комиссары
+
+    def commissioner(self, user_id, name=None):
+        commissioner = self.commissioners.get(user_id)
+        if commissioner is None:
+            commissioner = self.commissioners[user_id] = Commissioner(user_id, name)
+        elif name:
+            commissioner.name = name
+        return commissioner
+
+    def set_online(self, user_id, name=None, now=None):
+        now = self.clock() if now is None else now
+        commissioner = self.commissioner(user_id, name)
+        commissioner.online = True
+        commissioner.updated_at = now
+        return self._changed(self._assign(now))
+
+    # Незавершенная заявка ушедшего комиссара возвращается в очередь со своим приоритетом
+    def set_offline(self, user_id, now=None):
+        now = self.clock() if now is None else now
+        commissioner = self.commissioners.get(user_id)
+        if commissioner is None:
+            return []
+        commissioner.online = False
+        requeued = None
+        if commissioner.claim_id is not None:
+            requeued = self.claims.get(commissioner.claim_id)
+            commissioner.claim_id = None
+            if requeued is not None and requeued.state in ('assigned', 'arrived'):
+                self._push(requeued, now)
+        return self._changed(self._assign(now) if requeued is not None else [])
+
+    def update_location(self, user_id, latitude, longitude, now=None):
+        commissioner = self.commissioner(user_id)
+        commissioner.latitude = latitude
+        commissioner.longitude = longitude
+        commissioner.updated_at = self.clock() if now is None else now
+
+    def mark_arrived(self, user_id, now=None):
+        commissioner = self.commissioners.get(user_id)
+        claim = self.claims.get(commissioner.claim_id) if commissioner else None
+        if claim is None:
+            return None
+        claim.state = 'arrived'
+        claim.arrived_at = self.clock() if now is None else now
+        return self._changed(claim)
+
+    # Заявка выполнена: комиссар свободен и находится на месте ДТП
+    def complete(self, user_id, now=None):
+        now = self.clock() if now is None else now
+        commissioner = self.commissioners.get(user_id)
+        claim = self.claims.pop(commissioner.claim_id, None) if commissioner else None
+        if claim is None:
+            return None, []
+        claim.state = 'done'
+        claim.done_at = now
+        commissioner.claim_id = None
+        commissioner.completed += 1
+        commissioner.latitude, commissioner.longitude = claim.latitude, claim.longitude
+        commissioner.updated_at = now
+        return self._changed((claim, self._assign(now)))
+
+    # Назначение
+
+    def eta_minutes(self, commissioner, claim):
+        if commissioner.latitude is None or claim.latitude is None:
+            return None
+        distance = haversine_km(commissioner.latitude, commissioner.longitude, claim.latitude, claim.longitude)
+        return max(1, math.ceil(distance / self.speed_kmh * 60))
+
+    # Ближайший свободный комиссар (без известного места — только если других нет).
+    # Комиссаров десятки, поэтому линейный проход дешевле поддержки k-d дерева
+    # по постоянно меняющимся точкам.
+    def _nearest_free(self, claim):
+        best, best_distance = None, math.inf
+        for commissioner in self.commissioners.values():
+            if not commissioner.free:
+                continue
+            if commissioner.latitude is None or claim.latitude is None:
+                distance = math.inf
+            else:
+                distance = haversine_km(commissioner.latitude, commissioner.longitude,
+                                        claim.latitude, claim.longitude)
+            if best is None or distance < best_distance:
+                best, best_distance = commissioner, distance
+        return best
+
+    def _assign(self, now):
+        assignments = []
+        while self._heap:
+            claim = self._heap[0][2]
+            if claim.state != 'queued':
+                heapq.heappop(self._heap)
+                continue
+            commissioner = self._nearest_free(claim)
+            if commissioner is None:
+                break
+            heapq.heappop(self._heap)
+            self.queued -= 1
+            claim.state = 'assigned'
+            claim.commissioner_id = commissioner.user_id
+            claim.assigned_at = now
+            claim.eta_min = self.eta_minutes(commissioner, claim)
+            claim.arrival_breached = False
+            commissioner.claim_id = claim.claim_id
+            self.assigned_total += 1
+            assignments.append((claim, commissioner))
+            self._arm_arrival(claim, claim.eta_min * 60 + self.arrival_grace if claim.eta_min is not None else None)
+            if self.on_assign is not None:
+                self.on_assign(claim, commissioner)
+        return assignments
+
+    # Таймеры SLA. Таймер ожидания привязан к моменту постановки в очередь:
+    # после возврата заявки в очередь срабатывает только новый таймер.
+
+    def _arm_contact(self, claim, delay):
+        if self.schedule is not None:
+            self.schedule(delay, lambda claim_id=claim.claim_id, queued_at=claim.queued_at:
+                          self._check_contact(claim_id, queued_at))
+
+    def _arm_arrival(self, claim, delay):
+        if self.schedule is not None and delay is not None:
+            self.schedule(delay, lambda claim_id=claim.claim_id, commissioner_id=claim.commissioner_id:
+                          self._check_arrival(claim_id, commissioner_id))
+
+    def _check_contact(self, claim_id, queued_at):
+        claim = self.claims.get(claim_id)
+        if claim is not None and claim.state == 'queued' and claim.queued_at == queued_at:
+            claim.contact_breached = True
+            self._breach(claim, 'contact')
+
+    def _check_arrival(self, claim_id, commissioner_id):
+        claim = self.claims.get(claim_id)
+        if claim is not None and claim.state == 'assigned' and claim.commissioner_id == commissioner_id:
+            claim.arrival_breached = True
+            self._breach(claim, 'arrival')
+
+    def _breach(self, claim, kind):
+        self.breaches[kind] += 1
+        self._changed()
+        logger.warning("Нарушен SLA (%s) по заявке %s", kind, claim.claim_id)
+        if self.on_breach is not None:
+            self.on_breach(claim, kind)
+
+    # Сохранение и восстановление после перезапуска
+
+    def to_dict(self):
+        return {
+            'claims': [{name: getattr(claim, name) for name in DispatchClaim.__slots__}
+                       for claim in self.claims.values()],
+            'commissioners': [{name: getattr(commissioner, name) for name in Commissioner.__slots__}
+                              for commissioner in self.commissioners.values()],
+            'assigned_total': self.assigned_total,
+            'breaches': dict(self.breaches)
+        }
+
+    # Восстанавливает заявки, комиссаров и оставшееся время таймеров SLA;
+    # возвращает назначения, ставшие возможными
+    def restore(self, data, now=None):
+        now = self.clock() if now is None else now
+        for item in data.get('commissioners', ()):
+            commissioner = self.commissioner(item['user_id'])
+            for name in Commissioner.__slots__:
+                setattr(commissioner, name, item.get(name, getattr(commissioner, name)))
+        for item in data.get('claims', ()):
+            claim = DispatchClaim(item['claim_id'], item['user_id'], item['latitude'], item['longitude'],
+                                  item['injury'], item['created_at'], item['key'])
+            for name in DispatchClaim.__slots__:
+                if name in item:
+                    setattr(claim, name, item[name])
+            self.claims[claim.claim_id] = claim
+            if claim.state == 'queued':
+                self._enqueue(claim)
+                if not claim.contact_breached:
+                    self._arm_contact(claim, max(0.0, claim.queued_at + self.sla - now))
+            elif claim.state == 'assigned' and claim.eta_min is not None and not claim.arrival_breached:
+                self._arm_arrival(claim, max(0.0, claim.assigned_at + claim.eta_min * 60 + self.arrival_grace - now))
+        self.assigned_total = data.get('assigned_total', self.assigned_total)
+        self.breaches.update(data.get('breaches', {}))
+        return self._changed(self._assign(now))
+
+    def stats(self):
+        return {
+            'queued': self.queued,
+            'commissioners_online': sum(c.online for c in self.commissioners.values()),
+            'commissioners_free': sum(c.free for c in self.commissioners.values()),
+            'assigned_total': self.assigned_total,
+            'breaches': dict(self.breaches),
+        }
@@ -0,0 +1,483 @@
+import asyncio
+import json
+import logging
+import os
+import sqlite3
+import sys
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+
+# Интерфейс хранилища черновиков заявок и состояний диалогов.
+# Запись неблокирующая: save_*/delete_* только ставят изменение в очередь,
+# а реализация сама решает, когда и как сбросить его на диск.
+# Черновик и доставка очереди отправки передаются объектом с методом to_dict(),
+# загружаются словарем. Доставки принадлежат процессу-владельцу (owner).
+# Состояние диспетчерской хранится одним снимком (последний перекрывает предыдущие).
+class BaseStorage:
+    async def open(self):
+        pass
+
+    async def close(self):
+        pass
+
+    async def load_drafts(self):
+        raise NotImplementedError
+
+    def save_draft(self, user_id, data):
+        raise NotImplementedError
+
+    def delete_draft(self, user_id):
+        raise NotImplementedError
+
+    async def load_conversations(self, name):
+        raise NotImplementedError
+
+    def save_conversation(self, name, key, state):
+        raise NotImplementedError
+
+    async def load_deliveries(self, owner):
+        raise NotImplementedError
+
+    def save_delivery(self, owner, delivery_id, delivery):
+        raise NotImplementedError
+
+    def delete_delivery(self, owner, delivery_id):
+        raise NotImplementedError
+
+    async def load_dispatch(self):
+        raise NotImplementedError
+
+    def save_dispatch(self, scheduler):
+        raise NotImplementedError
+
+
+# Хранилище в памяти (для тестов и локального запуска).
+# Данные проходят через JSON, чтобы вести себя так же, как постоянное хранилище.
+class MemoryStorage(BaseStorage):
+    def __init__(self):
+        self.drafts = {}
+        self.conversations = {}
+        self.deliveries = {}
+        self.dispatch = None
+
+    async def load_drafts(self):
+        return {user_id: json.loads(data) for user_id, data in self.drafts.items()}
+
+    def save_draft(self, user_id, data):
+        self.drafts[user_id] = json.dumps(data.to_dict(), ensure_ascii=False)
+
+    def delete_draft(self, user_id):
+        self.drafts.pop(user_id, None)
+
+    async def load_conversations(self, name):
+        return dict(self.conversations.get(name, {}))
+
+    def save_conversation(self, name, key, state):
+        conversations = self.conversations.setdefault(name, {})
+        if state is None:
+            conversations.pop(key, None)
+        else:
+            conversations[key] = state
+
+    async def load_deliveries(self, owner):
+        return {delivery_id: json.loads(data) for delivery_id, data in self.deliveries.get(owner, {}).items()}
+
+    def save_delivery(self, owner, delivery_id, delivery):
+        self.deliveries.setdefault(owner, {})[delivery_id] = json.dumps(delivery.to_dict(), ensure_ascii=False)
+
+    def delete_delivery(self, owner, delivery_id):
+        self.deliveries.get(owner, {}).pop(delivery_id, None)
+
+    async def load_dispatch(self):
+        return json.loads(self.dispatch) if self.dispatch else None
+
+    def save_dispatch(self, scheduler):
+        self.dispatch = json.dumps(scheduler.to_dict(), ensure_ascii=False)
+
+
+# SQLite в режиме WAL. Изменения копятся в памяти (последнее изменение ключа
+# перекрывает предыдущие) и записываются пачками одной транзакцией фоновой задачей.
+# Весь доступ к соединению идет через один поток, поэтому цикл событий не блокируется.
+class SQLiteStorage(BaseStorage):
+    def __init__(self, path, flush_interval=0.05):
+        self.path = path
+        self.flush_interval = flush_interval
+        self._conn = None
+        self._executor = None
+        self._writer_task = None
+        self._wakeup = None
+        self._closing = False
+        self._pending = {}
+
+    async def open(self):
+        if self._conn is not None:
+            return
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='sqlite-storage')
+        self._conn = await self._run(self._connect)
+        self._wakeup = asyncio.Event()
+        self._closing = False
+        self._writer_task = asyncio.create_task(self._writer(), name='sqlite-storage-writer')
+        logger.info("💾 Хранилище SQLite открыто: %s", self.path)
+
+    async def close(self):
+        if self._conn is None:
+            return
+        self._closing = True
+        self._wakeup.set()
+        await self._writer_task
+        await self._run(self._conn.close)
+        self._executor.shutdown(wait=True)
+        self._conn = None
+        logger.info("💾 Хранилище SQLite закрыто")
+
+    def _connect(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript("""
+            CREATE TABLE IF NOT EXISTS drafts (
+                user_id INTEGER PRIMARY KEY,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS conversations (
+                name TEXT NOT NULL,
+                key TEXT NOT NULL,
+                state TEXT NOT NULL,
+                PRIMARY KEY (name, key)
+            );
+            CREATE TABLE IF NOT EXISTS deliveries (
+                id TEXT PRIMARY KEY,
+                owner TEXT NOT NULL,
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS deliveries_owner ON deliveries (owner);
+            CREATE TABLE IF NOT EXISTS dispatch (
+                id INTEGER PRIMARY KEY CHECK (id = 1),
+                data TEXT NOT NULL,
+                updated_at REAL NOT NULL
+            );
+        """)
+        return conn
+
+    async def _run(self, func, *args):
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    # Чтение
+
+    async def load_drafts(self):
+        rows = await self._run(self._fetch, "SELECT user_id, data FROM drafts", ())
+        return {user_id: json.loads(data) for user_id, data in rows}
+
+    async def load_conversations(self, name):
+        rows = await self._run(self._fetch, "SELECT key, state FROM conversations WHERE name = ?", (name,))
+        return {tuple(json.loads(key)): json.loads(state) for key, state in rows}
+
+    async def load_deliveries(self, owner):
+        rows = await self._run(self._fetch, "SELECT id, data FROM deliveries WHERE owner = ? ORDER BY updated_at",
+                               (owner,))
+        return {delivery_id: json.loads(data) for delivery_id, data in rows}
+
+    async def load_dispatch(self):
+        rows = await self._run(self._fetch, "SELECT data FROM dispatch WHERE id = 1", ())
+        return json.loads(rows[0][0]) if rows else None
+
+    def _fetch(self, query, params):
+        return self._conn.execute(query, params).fetchall()
+
+    # Запись
+
+    def save_draft(self, user_id, data):
+        self._enqueue(('draft', user_id), data)
+
+    def delete_draft(self, user_id):
+        self._enqueue(('draft', user_id), None)
+
+    def save_conversation(self, name, key, state):
+        self._enqueue(('conversation', name, json.dumps(list(key))), state)
+
+    def save_delivery(self, owner, delivery_id, delivery):
+        self._enqueue(('delivery', owner, delivery_id), delivery)
+
+    def delete_delivery(self, owner, delivery_id):
+        self._enqueue(('delivery', owner, delivery_id), None)
+
+    def save_dispatch(self, scheduler):
+        self._enqueue(('dispatch',), scheduler)
+
+    def _enqueue(self, key, value):
+        self._pending[key] = value
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def _writer(self):
+        while True:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            if self.flush_interval and not self._closing:
+                # Даем накопиться пачке изменений
+                await asyncio.sleep(self.flush_interval)
+            await self._flush_pending()
+            if self._closing and not self._pending:
+                return
+
+    async def _flush_pending(self):
+        if not self._pending:
+            return
+        batch, self._pending = self._pending, {}
+
+        # Сериализуем в цикле событий, чтобы поток записи не видел изменяемые объекты
+        now = time.time()
+        draft_rows, draft_deletes, conversation_rows, conversation_deletes = [], [], [], []
+        delivery_rows, delivery_deletes, dispatch_rows = [], [], []
+        for key, value in batch.items():
+            if key[0] == 'draft':
+                if value is None:
+                    draft_deletes.append((key[1],))
+                else:
+                    draft_rows.append((key[1], json.dumps(value.to_dict(), ensure_ascii=False), now))
+            elif key[0] == 'delivery':
+                if value is None:
+                    delivery_deletes.append((key[2],))
+                else:
+                    delivery_rows.append((key[2], key[1], json.dumps(value.to_dict(), ensure_ascii=False), now))
+            elif key[0] == 'dispatch':
+                dispatch_rows.append((json.dumps(value.to_dict(), ensure_ascii=False), now))
+            else:
+                if value is None:
+                    conversation_deletes.append((key[1], key[2]))
+                else:
+                    conversation_rows.append((key[1], key[2], json.dumps(value)))
+
+        try:
+            await self._run(self._write_batch, draft_rows, draft_deletes,
+                            conversation_rows, conversation_deletes, delivery_rows, delivery_deletes, dispatch_rows)
+        except Exception:
+            if self._closing:
+                logger.exception("Ошибка записи в SQLite при остановке, изменений потеряно: %s", len(batch))
+                return
+            logger.exception("Ошибка записи в SQLite, изменения будут повторены")
+            # Возвращаем изменения, если их не перекрыли более свежие
+            for key, value in batch.items():
+                self._pending.setdefault(key, value)
+            await asyncio.sleep(1)
+            self._wakeup.set()
+
+    def _write_batch(self, draft_rows, draft_deletes, conversation_rows, conversation_deletes,
+                     delivery_rows=(), delivery_deletes=(), dispatch_rows=()):
+        with self._conn:
+            if draft_rows:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO drafts (user_id, data, updated_at) VALUES (?, ?, ?)",
+                    draft_rows
+                )
+            if draft_deletes:
+                self._conn.executemany("DELETE FROM drafts WHERE user_id = ?", draft_deletes)
+            if conversation_rows:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO conversations (name, key, state) VALUES (?, ?, ?)",
+                    conversation_rows
+                )
+            if conversation_deletes:
+                self._conn.executemany(
+                    "DELETE FROM conversations WHERE name = ? AND key = ?",
+                    conversation_deletes
+                )
+            if delivery_rows:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO deliveries (id, owner, data, updated_at) VALUES (?, ?, ?, ?)",
+                    delivery_rows
+                )
+            if delivery_deletes:
+                self._conn.executemany("DELETE FROM deliveries WHERE id = ?", delivery_deletes)
+            if dispatch_rows:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO dispatch (id, data, updated_at) VALUES (1, ?, ?)",
+                    dispatch_rows
+                )
+
+
+# Приблизительный объем объекта в памяти вместе с вложенными объектами
+def approx_size(obj):
+    size = sys.getsizeof(obj)
+    if isinstance(obj, dict):
+        size += sum(approx_size(key) + approx_size(value) for key, value in obj.items())
+    elif isinstance(obj, (list, tuple)):
+        size += sum(approx_size(item) for item in obj)
+    elif hasattr(obj, '__slots__'):
+        size += sum(approx_size(getattr(obj, name, None)) for name in obj.__slots__)
+    return size
+
+
+# Черновики заявок: словарь в памяти (быстрое чтение в обработчиках)
+# со сквозной записью в хранилище. Размер ограничен: черновик без активности
+# дольше ttl удаляется при очистке (sweep), а при переполнении вытесняется
+# самый давно использованный. Порядок словаря — порядок последней активности.
+class DraftStore:
+    def __init__(self, storage=None, ttl=None, max_entries=None):
+        self.storage = storage
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._drafts = OrderedDict()
+        self._touched = {}
+        self._evicted = []
+        self.expired_total = 0
+        self.evicted_total = 0
+        self.approx_bytes = 0
+
+    def attach(self, storage, drafts=None):
+        self.storage = storage
+        if drafts:
+            # Время активности до перезапуска не хранится: отсчет TTL начинается заново
+            now = time.monotonic()
+            for user_id, data in drafts.items():
+                self._drafts[user_id] = data
+                self._touched[user_id] = now
+            self._evict_overflow()
+
+    def __contains__(self, user_id):
+        return user_id in self._drafts
+
+    def __getitem__(self, user_id):
+        data = self._drafts[user_id]
+        self._touch(user_id)
+        return data
+
+    def __setitem__(self, user_id, data):
+        self._drafts[user_id] = data
+        self._touch(user_id)
+        self.save(user_id)
+        self._evict_overflow()
+
+    def __delitem__(self, user_id):
+        del self._drafts[user_id]
+        del self._touched[user_id]
+        if self.storage is not None:
+            self.storage.delete_draft(user_id)
+
+    def __len__(self):
+        return len(self._drafts)
+
+    def get(self, user_id, default=None):
+        return self._drafts.get(user_id, default)
+
+    # Вызывается после изменения черновика на месте
+    def save(self, user_id):
+        self._touch(user_id)
+        if self.storage is not None:
+            self.storage.save_draft(user_id, self._drafts[user_id])
+
+    def _touch(self, user_id):
+        self._touched[user_id] = time.monotonic()
+        self._drafts.move_to_end(user_id)
+
+    def _evict_overflow(self):
+        while self.max_entries and len(self._drafts) > self.max_entries:
+            user_id = next(iter(self._drafts))
+            self._evicted.append((user_id, self._drafts[user_id]))
+            del self[user_id]
+            self.evicted_total += 1
+
+    # Удаляет просроченные черновики; возвращает их вместе с вытесненными
+    # с прошлой очистки: [(user_id, черновик), ...]
+    def sweep(self, now=None):
+        removed, self._evicted = self._evicted, []
+        if self.ttl:
+            deadline = (now if now is not None else time.monotonic()) - self.ttl
+            while self._drafts:
+                user_id = next(iter(self._drafts))
+                if self._touched[user_id] > deadline:
+                    break
+                removed.append((user_id, self._drafts[user_id]))
+                del self[user_id]
+                self.expired_total += 1
+        self.approx_bytes = approx_size(self._drafts)
+        return removed
+
+    def stats(self):
+        return {
+            'entries': len(self._drafts),
+            'approx_bytes': self.approx_bytes,
+            'expired_total': self.expired_total,
+            'evicted_total': self.evicted_total
+        }
+
+
+# Сохранение состояний ConversationHandler в том же хранилище
+class StoragePersistence(BasePersistence):
+    def __init__(self, storage, update_interval=5):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=False, callback_data=False),
+            update_interval=update_interval
+        )
+        self.storage = storage
+
+    async def get_conversations(self, name):
+        await self.storage.open()
+        return await self.storage.load_conversations(name)
+
+    async def update_conversation(self, name, key, new_state):
+        self.storage.save_conversation(name, key, new_state)
+
+    async def flush(self):
+        await self.storage.close()
+
+    # Пользовательские, чатовые и прочие данные не сохраняем
+    async def get_user_data(self):
+        return {}
+
+    async def get_chat_data(self):
+        return {}
+
+    async def get_bot_data(self):
+        return {}
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_user_data(self, user_id, data):
+        pass
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def update_callback_data(self, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def drop_user_data(self, user_id):
+        pass
+
+    async def refresh_user_data(self, user_id, user_data):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+
+def create_storage(backend, path):
+    if backend == 'memory':
+        return MemoryStorage()
+    if backend == 'sqlite':
+        return SQLiteStorage(path)
+    raise ValueError(f"Неизвестный тип хранилища: {backend}")
@@ -0,0 +1,336 @@
+import re
+
+from telegram import KeyboardButton, ReplyKeyboardMarkup
+
+# Тексты и клавиатуры бота. Все разметки и подсказки собираются один раз при импорте;
+# обработчики только берут готовые объекты из реестра нужного языка.
+
+DEFAULT_LOCALE = 'ru'
+
+BUTTONS = {
+    'ru': {
+        'contact': "📱 Отправить номер",
+        'location': "📍 Отправить местоположение",
+        'car_done': "🚗 Уже заполнил данные",
+        'accident_done': "📝 Уже заполнил описание",
+        'submit_without_photos': "✅ Отправить заявку без фото",
+        'attach_photos': "📷 Прикрепить фото",
+        'submit': "✅ Отправить заявку",
+        'start': "🚀 Начать оформление заявки",
+    },
+    'en': {
+        'contact': "📱 Share phone number",
+        'location': "📍 Share location",
+        'car_done': "🚗 Car details already entered",
+        'accident_done': "📝 Description already entered",
+        'submit_without_photos': "✅ Submit without photos",
+        'attach_photos': "📷 Attach photos",
+        'submit': "✅ Submit request",
+        'start': "🚀 Start a new request",
+    },
+}
+
+STEP_4_RU = (
+    "📝 **Шаг 4 из 5: Описание ДТП**\n\n"
+    "Пожалуйста, опишите обстоятельства ДТП:\n"
+    "• Дата и время ДТП\n"
+    "• Обстоятельства происшествия\n"
+    "• Есть ли пострадавшие\n"
+    "• Количество участников\n\n"
+    "Введите описание в одном сообщении:"
+)
+
+STEP_5_RU = (
+    "📷 **Шаг 5 из 5: Фотографии**\n\n"
+    "Вы можете прикрепить фотографии ДТП (до 5 фото):\n"
+    "• Фото места происшествия\n"
+    "• Фото повреждений\n"
+    "• Фото документов\n\n"
+    "Отправляйте фотографии по одной или нажмите кнопку ниже:"
+)
+
+STEP_4_EN = (
+    "📝 **Step 4 of 5: Accident description**\n\n"
+    "Please describe the accident:\n"
+    "• Date and time\n"
+    "• What happened\n"
+    "• Whether anyone is injured\n"
+    "• Number of vehicles involved\n\n"
+    "Send the description in one message:"
+)
+
+STEP_5_EN = (
+    "📷 **Step 5 of 5: Photos**\n\n"
+    "You can attach photos of the accident (up to 5):\n"
+    "• The accident scene\n"
+    "• The damage\n"
+    "• Documents\n\n"
+    "Send photos one at a time or press the button below:"
+)
+
+TEXTS = {
+    'ru': {
+        'welcome': (
+            "👋 Здравствуйте, {first_name}!\n\n"
+            "Я бот для оформления заявки вызова аварийного комиссара.\n"
+            "Пожалуйста, заполните данные для вызова комиссара.\n\n"
+            "После отправки заявки с вами свяжутся в течение 15 минут."
+        ),
+        'start_first': "Пожалуйста, начните с /start",
+        'step_1': (
+            "📱 **Шаг 1 из 5: Номер телефона**\n\n"
+            "Пожалуйста, нажмите кнопку ниже, чтобы отправить номер телефона для связи:"
+        ),
+        'phone_received': (
+            "✅ **Номер телефона получен:** `{phone}`\n\n"
+            "📍 **Шаг 2 из 5: Местоположение ДТП**\n\n"
+            "Пожалуйста, отправьте геолокацию места ДТП:"
+        ),
+        'location_received': (
+            "✅ **Местоположение получено!**\n\n"
+            "🚗 **Шаг 3 из 5: Данные автомобиля**\n\n"
+            "Пожалуйста, введите данные автомобиля:\n"
+            "• Марка и модель\n"
+            "• Госномер\n"
+            "• VIN (при наличии)\n\n"
+            "Пример: *Toyota Camry, А123ВС77, JTNBB46KX00345678*\n\n"
+            "Введите данные в одном сообщении:"
+        ),
+        'step_4': STEP_4_RU,
+        'car_saved': "✅ **Данные автомобиля сохранены!**\n\n" + STEP_4_RU,
+        'car_missing': "Вы еще не ввели данные автомобиля. Пожалуйста, введите данные:",
+        'step_5': STEP_5_RU,
+        'accident_saved': "✅ **Описание ДТП сохранено!**\n\n" + STEP_5_RU,
+        'accident_missing': "Вы еще не ввели описание ДТП. Пожалуйста, опишите обстоятельства:",
+        'attach_photos': (
+            "Пожалуйста, отправьте фотографии. Можно отправить до 5 фото.\n"
+            "После отправки фото нажмите '✅ Отправить заявку'"
+        ),
+        'photo_received': (
+            "✅ Фото #{count} получено.\n"
+            "Можно отправить еще {left} фото.\n\n"
+            "Продолжайте отправлять фото или нажмите '✅ Отправить заявку'"
+        ),
+        'photo_limit': (
+            "✅ Максимальное количество фото (5) достигнуто.\n"
+            "Нажмите '✅ Отправить заявку' для завершения"
+        ),
+        'photo_duplicate': (
+            "ℹ️ Это фото уже прикреплено к заявке.\n"
+            "Отправьте другое фото или нажмите '✅ Отправить заявку'"
+        ),
+        'album_received': (
+            "✅ Получено фото: {added}, всего в заявке {count}.\n"
+            "Можно отправить еще {left} фото.\n\n"
+            "Продолжайте отправлять фото или нажмите '✅ Отправить заявку'"
+        ),
+        'album_limit': (
+            "✅ Получено фото: {added}. Максимальное количество фото (5) достигнуто.\n"
+            "Нажмите '✅ Отправить заявку' для завершения"
+        ),
+        'album_skipped': "\n\nℹ️ Не добавлено (повторы или сверх лимита): {skipped}",
+        'commissioner_assigned': "👷 К вам выехал аварийный комиссар {name}. Ориентировочное время прибытия — {eta} мин.",
+        'commissioner_assigned_no_eta': "👷 Вашу заявку принял аварийный комиссар {name}. Он свяжется с вами в ближайшее время.",
+        'missing_header': "⚠️ **Не все данные заполнены!**\n\n",
+        'missing_phone': "📱 **Номер телефона:** не указан\n\nПожалуйста, отправьте номер телефона:",
+        'missing_location': "📍 **Местоположение:** не указано\n\nПожалуйста, отправьте местоположение:",
+        'missing_car': "🚗 **Данные автомобиля:** не указаны\n\nПожалуйста, введите данные автомобиля:",
+        'missing_accident': "📝 **Описание ДТП:** не указано\n\nПожалуйста, опишите обстоятельства ДТП:",
+        'submitted': (
+            "✅ *Заявка успешно отправлена!*\n\n"
+            "📞 *С вами свяжутся в течение 15 минут по номеру:* `{phone}`\n\n"
+            "Спасибо за обращение! 🚗\n\n"
+            "Для новой заявки нажмите /start"
+        ),
+        'submit_error': (
+            "⚠️ Произошла ошибка при отправке заявки. "
+            "Пожалуйста, попробуйте еще раз с помощью /start"
+        ),
+        'cancelled': "❌ Заявка отменена.\n\nДля новой заявки нажмите /start",
+        'help': (
+            "🤖 *Помощь по боту аварийного комиссара*\n\n"
+            "Доступные команды:\n"
+            "/start - Начать оформление заявки\n"
+            "/help - Показать это сообщение\n\n"
+            "После оформления заявки с вами свяжутся в течение 15 минут."
+        ),
+        'press_contact': "Пожалуйста, нажмите кнопку '📱 Отправить номер' для отправки контакта",
+        'press_location': "Пожалуйста, нажмите кнопку '📍 Отправить местоположение'",
+        'draft_expired': (
+            "⌛ Незавершенная заявка удалена из-за отсутствия активности.\n\n"
+            "Если помощь комиссара еще нужна, нажмите /start"
+        ),
+    },
+    'en': {
+        'welcome': (
+            "👋 Hello, {first_name}!\n\n"
+            "I can help you call a road accident commissioner.\n"
+            "Please fill in the details for the commissioner.\n\n"
+            "We will contact you within 15 minutes after you submit the request."
+        ),
+        'start_first': "Please start with /start",
+        'step_1': (
+            "📱 **Step 1 of 5: Phone number**\n\n"
+            "Please press the button below to share your contact phone number:"
+        ),
+        'phone_received': (
+            "✅ **Phone number received:** `{phone}`\n\n"
+            "📍 **Step 2 of 5: Accident location**\n\n"
+            "Please share the location of the accident:"
+        ),
+        'location_received': (
+            "✅ **Location received!**\n\n"
+            "🚗 **Step 3 of 5: Car details**\n\n"
+            "Please enter your car details:\n"
+            "• Make and model\n"
+            "• Licence plate\n"
+            "• VIN (if available)\n\n"
+            "Example: *Toyota Camry, А123ВС77, JTNBB46KX00345678*\n\n"
+            "Send the details in one message:"
+        ),
+        'step_4': STEP_4_EN,
+        'car_saved': "✅ **Car details saved!**\n\n" + STEP_4_EN,
+        'car_missing': "You have not entered the car details yet. Please enter them:",
+        'step_5': STEP_5_EN,
+        'accident_saved': "✅ **Accident description saved!**\n\n" + STEP_5_EN,
+        'accident_missing': "You have not described the accident yet. Please describe it:",
+        'attach_photos': (
+            "Please send the photos. You can send up to 5.\n"
+            "When you are done, press '✅ Submit request'"
+        ),
+        'photo_received': (
+            "✅ Photo #{count} received.\n"
+            "You can send {left} more.\n\n"
+            "Keep sending photos or press '✅ Submit request'"
+        ),
+        'photo_limit': (
+            "✅ Maximum number of photos (5) reached.\n"
+            "Press '✅ Submit request' to finish"
+        ),
+        'photo_duplicate': (
+            "ℹ️ This photo is already attached to the request.\n"
+            "Send another photo or press '✅ Submit request'"
+        ),
+        'album_received': (
+            "✅ Photos received: {added}, {count} in the request.\n"
+            "You can send {left} more.\n\n"
+            "Keep sending photos or press '✅ Submit request'"
+        ),
+        'album_limit': (
+            "✅ Photos received: {added}. Maximum number of photos (5) reached.\n"
+            "Press '✅ Submit request' to finish"
+        ),
+        'album_skipped': "\n\nℹ️ Not added (repeats or over the limit): {skipped}",
+        'commissioner_assigned': "👷 Claims adjuster {name} is on the way. Estimated arrival in {eta} min.",
+        'commissioner_assigned_no_eta': "👷 Claims adjuster {name} has taken your request and will contact you shortly.",
+        'missing_header': "⚠️ **Some details are missing!**\n\n",
+        'missing_phone': "📱 **Phone number:** not provided\n\nPlease share your phone number:",
+        'missing_location': "📍 **Location:** not provided\n\nPlease share the location:",
+        'missing_car': "🚗 **Car details:** not provided\n\nPlease enter the car details:",
+        'missing_accident': "📝 **Accident description:** not provided\n\nPlease describe the accident:",
+        'submitted': (
+            "✅ *Request submitted!*\n\n"
+            "📞 *We will call you within 15 minutes at:* `{phone}`\n\n"
+            "Thank you! 🚗\n\n"
+            "To file a new request press /start"
+        ),
+        'submit_error': (
+            "⚠️ Something went wrong while submitting the request. "
+            "Please try again with /start"
+        ),
+        'cancelled': "❌ Request cancelled.\n\nTo file a new request press /start",
+        'help': (
+            "🤖 *Road accident commissioner bot*\n\n"
+            "Available commands:\n"
+            "/start - File a request\n"
+            "/help - Show this message\n\n"
+            "We will contact you within 15 minutes after you submit the request."
+        ),
+        'press_contact': "Please press '📱 Share phone number' to send your contact",
+        'press_location': "Please press '📍 Share location'",
+        'draft_expired': (
+            "⌛ Your unfinished request was removed after a period of inactivity.\n\n"
+            "If you still need a commissioner, press /start"
+        ),
+    },
+}
+
+# Раскладки клавиатур: строки из ключей кнопок; словарь — параметры KeyboardButton
+KEYBOARD_LAYOUTS = {
+    'contact': [[('contact', {'request_contact': True})]],
+    'location': [[('location', {'request_location': True})]],
+    'car': [['car_done']],
+    'accident': [['accident_done']],
+    'photos': [['submit_without_photos'], ['attach_photos']],
+    'final': [['submit']],
+    'start': [['start']],
+}
+
+
+# Клавиатура с заранее посчитанным представлением для Bot API:
+# при каждой отправке библиотека берет готовый словарь вместо обхода объекта
+class CachedReplyKeyboardMarkup(ReplyKeyboardMarkup):
+    __slots__ = ('_cached_dict',)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        with self._unfrozen():
+            self._cached_dict = super().to_dict()
+
+    def to_dict(self, recursive=True):
+        if recursive:
+            return self._cached_dict
+        return super().to_dict(recursive=False)
+
+
+def build_keyboard(layout, buttons):
+    rows = []
+    for row in layout:
+        keys = []
+        for item in row:
+            if isinstance(item, tuple):
+                key, options = item
+                keys.append(KeyboardButton(buttons[key], **options))
+            else:
+                keys.append(buttons[item])
+        rows.append(keys)
+    return CachedReplyKeyboardMarkup(rows, resize_keyboard=True, one_time_keyboard=True)
+
+
+# Набор текстов и клавиатур одного языка
+class Templates:
+    def __init__(self, locale):
+        self.locale = locale
+        self.texts = TEXTS[locale]
+        self.buttons = BUTTONS[locale]
+        self.keyboards = {name: build_keyboard(layout, self.buttons) for name, layout in KEYBOARD_LAYOUTS.items()}
+
+    def text(self, key, **kwargs):
+        template = self.texts[key]
+        return template.format(**kwargs) if kwargs else template
+
+    def keyboard(self, name):
+        return self.keyboards[name]
+
+
+TEMPLATES = {locale: Templates(locale) for locale in TEXTS}
+
+
+# Набор по коду языка Telegram (по умолчанию русский)
+def templates_for_language(language_code):
+    return TEMPLATES.get((language_code or '')[:2]) or TEMPLATES[DEFAULT_LOCALE]
+
+
+# Язык пользователя по настройкам Telegram
+def get_templates(user):
+    return templates_for_language(getattr(user, 'language_code', None))
+
+
+# Все варианты подписи кнопки (на всех языках)
+def button_variants(key):
+    return frozenset(buttons[key] for buttons in BUTTONS.values())
+
+
+# Регулярное выражение для фильтра, совпадающее с кнопкой на любом языке
+def button_pattern(key):
+    return '^(?:' + '|'.join(re.escape(label) for label in sorted(button_variants(key))) + ')$'
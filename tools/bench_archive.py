@@ -0,0 +1,93 @@
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+# Поиск по архиву заявок: N исторических заявок, время /find (номер, телефон, текст) и /recent.
+#
+#   python tools/bench_archive.py --claims 300000
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from archive import ClaimArchive  # noqa: E402
+from models import ClaimDraft  # noqa: E402
+
+LETTERS = 'АВЕКМНОРСТУХ'
+CARS = ['Toyota Camry', 'Kia Rio', 'Hyundai Solaris', 'Lada Vesta', 'Skoda Octavia', 'VW Polo']
+ACCIDENTS = [
+    "Столкновение на перекрестке, пострадавших нет",
+    "Задел зеркало при перестроении",
+    "Наезд сзади в пробке на МКАД",
+    "Поцарапал бампер на парковке у торгового центра",
+    "Боковое столкновение при повороте налево",
+]
+
+
+def make_draft(i, rng):
+    plate = f"{rng.choice(LETTERS)}{rng.randint(0, 999):03d}{rng.choice(LETTERS)}{rng.choice(LETTERS)}{rng.choice((77, 97, 199, 777))}"
+    return ClaimDraft(
+        user_id=1_000_000 + i,
+        username=f"driver{i}",
+        full_name=f"Водитель {i}",
+        phone=f"+7999{i:07d}",
+        latitude=55.75 + rng.uniform(-0.3, 0.3),
+        longitude=37.61 + rng.uniform(-0.5, 0.5),
+        car_details=f"{rng.choice(CARS)}, {plate}",
+        accident_details=rng.choice(ACCIDENTS),
+        created_at=time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(1_700_000_000 + i * 60))
+    ), plate
+
+
+async def timed(func, repeat):
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        rows = await func()
+        samples.append((time.perf_counter() - started) * 1000)
+    return rows, samples
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Поиск по архиву заявок")
+    parser.add_argument('--claims', type=int, default=300_000)
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as directory:
+        archive = ClaimArchive(os.path.join(directory, 'archive.sqlite3'))
+        await archive.open()
+
+        started = time.perf_counter()
+        plates = []
+        for i in range(args.claims):
+            draft, plate = make_draft(i, rng)
+            plates.append(plate)
+            archive.add(draft)
+            if i % 10_000 == 9_999:
+                await archive._flush_pending()
+        await archive._flush_pending()
+        print(f"Загрузка {args.claims} заявок: {time.perf_counter() - started:.1f} с")
+
+        cases = {
+            'госномер': lambda: archive.find(rng.choice(plates)),
+            'телефон': lambda: archive.find(f"8 999 {rng.randrange(args.claims):07d}"),
+            'текст': lambda: archive.find(rng.choice(["зеркало", "МКАД", "парковк", "Solaris"])),
+            'текст, стр. 100': lambda: archive.find("перекрестке", offset=500),
+            'recent 10': lambda: archive.recent(10),
+        }
+        for name, func in cases.items():
+            rows, samples = await timed(func, args.queries)
+            samples.sort()
+            print(f"{name:<18} p50 {statistics.median(samples):6.2f} мс, "
+                  f"p99 {samples[int(len(samples) * 0.99) - 1]:6.2f} мс, строк: {len(rows)}")
+
+        await archive.close()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
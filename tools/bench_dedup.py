@@ -0,0 +1,60 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+# Поиск дублей при пиковой нагрузке: время match() + add() на заявку
+# при разном числе заявок в окне (оно не должно расти с размером индекса).
+#
+#   python tools/bench_dedup.py --claims 100000 --per-hour 20000
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from dedup import IncidentIndex  # noqa: E402
+from models import ClaimDraft  # noqa: E402
+
+LETTERS = 'АВЕКМНОРСТУХ'
+
+
+def make_draft(i, rng):
+    return ClaimDraft(
+        user_id=i,
+        phone=f"+7999{rng.randrange(10_000_000):07d}",
+        latitude=55.75 + rng.uniform(-0.3, 0.3),
+        longitude=37.61 + rng.uniform(-0.5, 0.5),
+        car_details=f"Kia Rio, {rng.choice(LETTERS)}{rng.randrange(1000):03d}{rng.choice(LETTERS)}{rng.choice(LETTERS)}77"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Поиск дублей заявок")
+    parser.add_argument('--claims', type=int, default=100_000)
+    parser.add_argument('--per-hour', type=int, default=20_000)
+    parser.add_argument('--window', type=float, default=1800)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    drafts = [make_draft(i, rng) for i in range(args.claims)]
+    index = IncidentIndex(window=args.window)
+    step = 3600 / args.per_hour
+
+    linked = 0
+    report_every = args.claims // 5
+    started = chunk_started = time.perf_counter()
+    for i, draft in enumerate(drafts):
+        now = i * step
+        incident, reasons = index.match(draft, now=now)
+        if incident is not None:
+            linked += 1
+        index.add(draft, incident, now=now)
+        if (i + 1) % report_every == 0:
+            elapsed = time.perf_counter() - chunk_started
+            print(f"{i + 1:>8} заявок, в окне {len(index):>6}: {elapsed / report_every * 1e6:6.1f} мкс на заявку")
+            chunk_started = time.perf_counter()
+
+    print(f"Всего {time.perf_counter() - started:.2f} с, связано с другими: {linked} ({linked / args.claims:.1%})")
+
+
+if __name__ == '__main__':
+    main()
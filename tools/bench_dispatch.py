@@ -0,0 +1,115 @@
+import os
+import sys
+import timeit
+
+# Стоимость выбора обработчика на шаге диалога: цепочка MessageHandler с фильтрами
+# Regex (как было) против StateDispatcher (поиск подписи кнопки в словаре).
+# Проверка идет так же, как в ConversationHandler: по порядку до первого совпадения.
+#
+#   python tools/bench_dispatch.py
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegram import Bot, Update  # noqa: E402
+from telegram.ext import MessageHandler, filters  # noqa: E402
+
+from dispatch import StateDispatcher  # noqa: E402
+from synthetic import contact_update, location_update, photo_update, text_update  # noqa: E402
+from templates import BUTTONS, button_pattern  # noqa: E402
+
+
+async def noop(update, context):
+    pass
+
+
+# Цепочки фильтров из прежней версии bot.py
+def filter_chains():
+    return {
+        'phone': [
+            MessageHandler(filters.CONTACT, noop),
+            MessageHandler(filters.TEXT & ~filters.COMMAND, noop)
+        ],
+        'location': [
+            MessageHandler(filters.LOCATION, noop),
+            MessageHandler(filters.TEXT & ~filters.COMMAND, noop)
+        ],
+        'car_details': [
+            MessageHandler(filters.TEXT & ~filters.COMMAND & ~filters.Regex(button_pattern('car_done')), noop),
+            MessageHandler(filters.TEXT & filters.Regex(button_pattern('car_done')), noop)
+        ],
+        'accident_details': [
+            MessageHandler(filters.TEXT & ~filters.COMMAND & ~filters.Regex(button_pattern('accident_done')), noop),
+            MessageHandler(filters.TEXT & filters.Regex(button_pattern('accident_done')), noop)
+        ],
+        'photos': [
+            MessageHandler(filters.PHOTO, noop),
+            MessageHandler(filters.TEXT & filters.Regex(button_pattern('submit')), noop),
+            MessageHandler(filters.TEXT & filters.Regex(button_pattern('submit_without_photos')), noop),
+            MessageHandler(filters.TEXT & filters.Regex(button_pattern('attach_photos')), noop)
+        ],
+    }
+
+
+def dispatchers():
+    return {
+        'phone': [StateDispatcher(contact=noop, text=noop)],
+        'location': [StateDispatcher(location=noop, text=noop)],
+        'car_details': [StateDispatcher(buttons={'car_done': noop}, text=noop)],
+        'accident_details': [StateDispatcher(buttons={'accident_done': noop}, text=noop)],
+        'photos': [StateDispatcher(
+            buttons={'submit': noop, 'submit_without_photos': noop, 'attach_photos': noop},
+            photo=noop
+        )],
+    }
+
+
+# Типичные обновления каждого шага: нажатия кнопок (ru/en), текст, медиа
+def workload(bot):
+    raw = {
+        'phone': [contact_update(1), text_update(1, "позвоните мне")],
+        'location': [location_update(1), text_update(1, "МКАД 45 км")],
+        'car_details': [
+            text_update(1, "Toyota Camry, А123ВС77, VIN JTDBR32E720012345"),
+            text_update(1, BUTTONS['ru']['car_done']),
+            text_update(1, BUTTONS['en']['car_done']),
+        ],
+        'accident_details': [
+            text_update(1, "Столкновение на перекрестке, пострадавших нет. " * 5),
+            text_update(1, BUTTONS['ru']['accident_done']),
+        ],
+        'photos': [
+            photo_update(1),
+            text_update(1, BUTTONS['ru']['submit']),
+            text_update(1, BUTTONS['en']['submit_without_photos']),
+            text_update(1, BUTTONS['ru']['attach_photos']),
+        ],
+    }
+    return [(state, Update.de_json(data, bot)) for state, updates in raw.items() for data in updates]
+
+
+def select(handlers, update):
+    for handler in handlers:
+        check = handler.check_update(update)
+        if check is not None and check is not False:
+            return handler, check
+    return None
+
+
+def main():
+    bot = Bot('1:x')
+    updates = workload(bot)
+
+    for name, table in (('filters + Regex', filter_chains()), ('StateDispatcher', dispatchers())):
+        # Все обновления должны находить обработчик в обеих схемах
+        assert all(select(table[state], update) for state, update in updates), name
+
+        number = 20_000
+        elapsed = timeit.timeit(
+            lambda: [select(table[state], update) for state, update in updates],
+            number=number
+        )
+        print(f"{name:<18}{elapsed / (number * len(updates)) * 1e6:7.2f} мкс на обновление")
+
+
+if __name__ == '__main__':
+    main()
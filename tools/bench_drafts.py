@@ -0,0 +1,74 @@
+import argparse
+import gc
+import os
+import sys
+import time
+import tracemalloc
+
+# Память на черновик: словарь с десятью строковыми ключами (как было) против ClaimDraft.
+#
+#   python tools/bench_drafts.py --drafts 100000
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from models import ClaimDraft  # noqa: E402
+
+
+def make_dict(i):
+    return {
+        'user_id': 1_000_000 + i,
+        'username': f"driver{i}",
+        'full_name': f"Водитель {i}",
+        'phone': f"+7999{i:07d}",
+        'location': {'latitude': 55.75 + i * 1e-6, 'longitude': 37.61 + i * 1e-6},
+        'car_details': None,
+        'accident_details': None,
+        'photos': [],
+        'created_at': "2026-01-01 12:00:00",
+        'status': 'new'
+    }
+
+
+def make_draft(i):
+    return ClaimDraft(
+        user_id=1_000_000 + i,
+        username=f"driver{i}",
+        full_name=f"Водитель {i}",
+        phone=f"+7999{i:07d}",
+        latitude=55.75 + i * 1e-6,
+        longitude=37.61 + i * 1e-6,
+        created_at="2026-01-01 12:00:00"
+    )
+
+
+def measure(factory, count):
+    gc.collect()
+    tracemalloc.start()
+    started = time.perf_counter()
+    store = {1_000_000 + i: factory(i) for i in range(count)}
+    elapsed = time.perf_counter() - started
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return store, current, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Память на черновик заявки")
+    parser.add_argument('--drafts', type=int, default=100_000)
+    args = parser.parse_args()
+
+    for name, factory in (('dict', make_dict), ('ClaimDraft', make_draft)):
+        store, size, elapsed = measure(factory, args.drafts)
+        print(f"{name:<12}{size / 2**20:8.1f} МБ всего, {size / args.drafts:6.0f} байт/черновик, "
+              f"создание {elapsed * 1000:.0f} мс")
+        del store
+
+    draft = make_draft(1)
+    started = time.perf_counter()
+    for _ in range(args.drafts):
+        draft.missing_fields()
+    print(f"missing_fields(): {(time.perf_counter() - started) / args.drafts * 1e9:.0f} нс")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,242 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Сквозной нагрузочный тест: настоящий бот (python bot.py, как в продакшене) работает
+# против поддельного Bot API (fake_bot_server.py) по HTTP. N водителей одновременно
+# проходят /start → контакт → место → автомобили → ДТП → фото → отправка.
+# Задержка шага — от отправки обновления до первого ответа бота в чат.
+# Печатает пропускную способность, p50/p95/p99 по шагам и память процесса бота;
+# --record дописывает итог строкой JSON, чтобы сравнивать прогоны между версиями.
+#
+#   python tools/bench_e2e.py --users 2000 --latency 0.03 --rate-429 0.01
+#   python tools/bench_e2e.py --users 2000 --workers 4 --record bench.jsonl
+#   python tools/bench_e2e.py --users 500 --photos 5 --album
+#   python tools/bench_e2e.py --users 100 --rate-429 0.05 --restart 300
+#     (после остановки бот запускается снова и досылает заявки, не доставленные администратору)
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_server import FakeBotServer  # noqa: E402
+from synthetic import claim_script  # noqa: E402
+
+ADMIN_CHAT_ID = -1000000000001
+
+# Сколько сообщений бот присылает в ответ на шаг (остальные шаги — одно)
+EXPECTED_REPLIES = {'start': 2}
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+# Память процесса и его дочерних процессов (воркеров), КиБ: (текущая, пиковая)
+def process_memory(pid):
+    rss = peak = 0
+    pids = [pid]
+    try:
+        with open(f"/proc/{pid}/task/{pid}/children") as f:
+            pids += [int(child) for child in f.read().split()]
+    except OSError:
+        pass
+    for current in pids:
+        try:
+            with open(f"/proc/{current}/status") as f:
+                for line in f:
+                    if line.startswith('VmRSS:'):
+                        rss += int(line.split()[1])
+                    elif line.startswith('VmHWM:'):
+                        peak += int(line.split()[1])
+        except OSError:
+            pass
+    return rss, peak
+
+
+# Процессорное время процесса (без дочерних), с
+def process_cpu(pid):
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            fields = f.read().rsplit(')', 1)[1].split()
+    except OSError:
+        return 0.0
+    return (int(fields[11]) + int(fields[12])) / os.sysconf('SC_CLK_TCK')
+
+
+def start_bot(api_url, data_dir, workers, log_level):
+    env = dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN='1:fake',
+        ADMIN_CHAT_ID=str(ADMIN_CHAT_ID),
+        BOT_API_URL=api_url,
+        STORAGE_BACKEND='sqlite',
+        STORAGE_PATH=os.path.join(data_dir, 'bot.sqlite3'),
+        BROKER_URL=f"sqlite:///{os.path.join(data_dir, 'broker.sqlite3')}",
+        WORKERS=str(workers),
+        PORT='0',
+        LOG_LEVEL=log_level
+    )
+    env.pop('WEBHOOK_URL', None)
+    return subprocess.Popen([sys.executable, os.path.join(ROOT, 'bot.py')], cwd=data_dir, env=env)
+
+
+async def stop_bot(bot):
+    # Сервер работает в этом же цикле событий: ждем остановки бота, не блокируя его
+    bot.send_signal(signal.SIGTERM)
+    try:
+        await asyncio.get_running_loop().run_in_executor(None, bot.wait, 30)
+    except subprocess.TimeoutExpired:
+        bot.kill()
+
+
+async def wait_admin_messages(server, count, timeout):
+    deadline = time.perf_counter() + timeout
+    while len(server.replies.get(ADMIN_CHAT_ID, [])) < count and time.perf_counter() < deadline:
+        await asyncio.sleep(0.1)
+    return len(server.replies.get(ADMIN_CHAT_ID, []))
+
+
+async def drive_user(server, user_id, photos, album, think_time, step_timeout, latencies, timeouts):
+    for step, build in claim_script(user_id, photos=photos, album=album):
+        await asyncio.sleep(random.uniform(0, think_time))
+        server.reset_replies(user_id)
+        started = time.perf_counter()
+        updates = build()
+        for update in updates if isinstance(updates, list) else [updates]:
+            server.push_update(update)
+        replied = await server.wait_replies(user_id, EXPECTED_REPLIES.get(step, 1), step_timeout)
+        if replied is None:
+            timeouts[step] = timeouts.get(step, 0) + 1
+            # Без ответа бот, скорее всего, не перешел на следующий шаг
+            return False
+        latencies.setdefault(step, []).append(replied - started)
+    return True
+
+
+async def run(args):
+    server = FakeBotServer(latency=args.latency, jitter=args.latency / 2, rate_429=args.rate_429)
+    port = server.listen(0)
+    api_url = f"http://127.0.0.1:{port}"
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        bot = start_bot(api_url, data_dir, args.workers, args.log_level)
+        try:
+            await asyncio.wait_for(server.polling.wait(), 60)
+            # Бот при старте сбрасывает накопившиеся обновления: даем ему дойти до поллинга
+            await asyncio.sleep(0.5)
+            _, startup_peak = process_memory(bot.pid)
+
+            latencies, timeouts = {}, {}
+            started = time.perf_counter()
+            cpu_started = process_cpu(bot.pid), time.process_time()
+            completed = await asyncio.gather(*(
+                drive_user(server, 1_000_000 + i, args.photos, args.album, args.think_time, args.step_timeout,
+                           latencies, timeouts)
+                for i in range(args.users)
+            ))
+            elapsed = time.perf_counter() - started
+            bot_cpu = process_cpu(bot.pid) - cpu_started[0]
+            harness_cpu = time.process_time() - cpu_started[1]
+            # Заявки администратору уходят через очередь отправки — ждем досылки
+            await wait_admin_messages(server, sum(completed), args.step_timeout)
+            rss, peak = process_memory(bot.pid)
+        finally:
+            await stop_bot(bot)
+
+        claims = sum(completed)
+        admin_messages = len(server.replies.get(ADMIN_CHAT_ID, []))
+        restart_messages = None
+        try:
+            if args.restart and admin_messages < claims:
+                bot = start_bot(api_url, data_dir, args.workers, args.log_level)
+                try:
+                    restart_messages = await wait_admin_messages(server, claims, args.restart) - admin_messages
+                finally:
+                    await stop_bot(bot)
+        finally:
+            await server.stop()
+
+    all_samples = [sample for samples in latencies.values() for sample in samples]
+    print(f"\n{args.users} пользователей, воркеров: {args.workers or 'нет'}, задержка API {args.latency * 1000:.0f} мс, "
+          f"429: {args.rate_429:.1%}")
+    print(f"шагов: {len(all_samples)} за {elapsed:.2f} с ({len(all_samples) / elapsed:.0f} шагов/с), "
+          f"заявок: {claims} ({claims / elapsed:.1f}/с), без ответа: {sum(timeouts.values())}")
+    print(f"{'шаг':<18}{'n':>7}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    report_steps = {}
+    for step, samples in list(latencies.items()) + [('все шаги', all_samples)]:
+        if not samples:
+            continue
+        row = {
+            'n': len(samples),
+            'p50_ms': round(statistics.median(samples) * 1000, 2),
+            'p95_ms': round(percentile(samples, 95) * 1000, 2),
+            'p99_ms': round(percentile(samples, 99) * 1000, 2),
+        }
+        report_steps[step] = row
+        print(f"{step:<18}{row['n']:>7}{row['p50_ms']:>10.1f}{row['p95_ms']:>10.1f}{row['p99_ms']:>10.1f}")
+    print(f"сообщений администратору: {admin_messages}, ответов 429: {server.throttled}, "
+          f"вызовов API: {sum(server.calls.values())}, скачано файлов: {server.downloads}")
+    if restart_messages is not None:
+        print(f"после перезапуска досланы администратору: {restart_messages}, "
+              f"всего {admin_messages + restart_messages} из {claims}")
+    print(f"процессор: бот {bot_cpu:.2f} с ({bot_cpu / max(len(all_samples), 1) * 1000:.2f} мс на шаг), "
+          f"харнесс с поддельным API {harness_cpu:.2f} с")
+    print(f"память бота: после старта {startup_peak / 1024:.1f} МиБ, "
+          f"в конце {rss / 1024:.1f} МиБ, пик {peak / 1024:.1f} МиБ")
+
+    if args.record:
+        record = {
+            'ts': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'users': args.users,
+            'workers': args.workers,
+            'photos': args.photos,
+            'album': args.album,
+            'latency': args.latency,
+            'rate_429': args.rate_429,
+            'elapsed_s': round(elapsed, 3),
+            'steps_per_s': round(len(all_samples) / elapsed, 1),
+            'claims_per_s': round(claims / elapsed, 2),
+            'timeouts': timeouts,
+            'admin_messages': admin_messages,
+            'throttled': server.throttled,
+            'api_calls': server.calls,
+            'downloads': server.downloads,
+            'bot_cpu_s': round(bot_cpu, 3),
+            'rss_kib': rss,
+            'peak_rss_kib': peak,
+            'startup_rss_kib': startup_peak,
+            'steps': report_steps,
+        }
+        with open(args.record, 'a') as f:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Сквозной нагрузочный тест с поддельным Bot API")
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--photos', type=int, default=1, help="фото в заявке (0 — отправка без фото)")
+    parser.add_argument('--album', action='store_true', help="фото одним альбомом (media_group_id)")
+    parser.add_argument('--latency', type=float, default=0.03, help="задержка Bot API, с")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="доля вызовов send* с ответом 429")
+    parser.add_argument('--think-time', type=float, default=0.5, help="пауза пользователя между шагами, с")
+    parser.add_argument('--step-timeout', type=float, default=30.0, help="ожидание ответа на шаг, с")
+    parser.add_argument('--workers', type=int, default=0, help="режим нескольких воркеров (cluster.py)")
+    parser.add_argument('--restart', type=float, default=0,
+                        help="перезапустить бот и ждать досылки заявок администратору столько секунд")
+    parser.add_argument('--log-level', default='WARNING')
+    parser.add_argument('--record', help="файл JSONL для истории результатов")
+    asyncio.run(run(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
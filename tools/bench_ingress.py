@@ -0,0 +1,68 @@
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+# Прием в режиме воркеров: --updates обновлений разом (пачка getUpdates или всплеск вебхуков)
+# публикуются в брокер SQLite. Печатает время публикации и число транзакций записи.
+#
+#   python tools/bench_ingress.py --updates 2000 --partitions 4
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+import logging  # noqa: E402
+
+from telegram import Update  # noqa: E402
+
+from broker import SQLiteBroker  # noqa: E402
+from cluster import build_ingress_application  # noqa: E402
+from fake_bot_api import FakeBotRequest  # noqa: E402
+from synthetic import text_update  # noqa: E402
+
+
+async def run(updates, partitions):
+    with tempfile.TemporaryDirectory() as data_dir:
+        broker = SQLiteBroker(os.path.join(data_dir, 'broker.sqlite3'))
+        await broker.open()
+        batches = []
+        insert = broker._insert
+
+        def counted_insert(rows):
+            batches.append(len(rows))
+            return insert(rows)
+
+        broker._insert = counted_insert
+        application = build_ingress_application('1:fake', broker, partitions, request=FakeBotRequest())
+        async with application:
+            await application.start()
+            pending = [Update.de_json(text_update(1_000_000 + i, '/start'), application.bot) for i in range(updates)]
+            started = time.perf_counter()
+            for update in pending:
+                application.update_queue.put_nowait(update)
+            while sum((await broker.depth()).values()) < updates:
+                await asyncio.sleep(0.005)
+            elapsed = time.perf_counter() - started
+            await application.stop()
+        await broker.close()
+
+    print(f"\n{updates} обновлений, разделов: {partitions}: опубликовано за {elapsed * 1000:.0f} мс "
+          f"({updates / elapsed:.0f}/с)")
+    print(f"транзакций записи: {len(batches)}, сообщений в транзакции: "
+          f"в среднем {sum(batches) / len(batches):.1f}, максимум {max(batches)}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Публикация обновлений приемом в брокер")
+    parser.add_argument('--updates', type=int, default=2000)
+    parser.add_argument('--partitions', type=int, default=4)
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    asyncio.run(run(args.updates, args.partitions))
+
+
+if __name__ == '__main__':
+    main()
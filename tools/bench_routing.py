@@ -0,0 +1,74 @@
+import argparse
+import os
+import random
+import sys
+import time
+
+# Бенчмарк маршрутизации: N зон комиссаров вокруг Москвы, 100 000 случайных точек ДТП.
+#
+#   python tools/bench_routing.py --operators 200 --points 100000
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from routing import OperatorRouter, Zone, haversine_km  # noqa: E402
+
+CENTER = (55.7558, 37.6173)
+
+
+def make_zones(count, rng):
+    zones = []
+    for i in range(count):
+        lat = CENTER[0] + rng.uniform(-0.35, 0.35)
+        lon = CENTER[1] + rng.uniform(-0.6, 0.6)
+        if i % 4:
+            zones.append(Zone(f"zone-{i}", -1000 - i, center=(lat, lon), radius_km=rng.uniform(2, 8)))
+        else:
+            size = rng.uniform(0.02, 0.08)
+            zones.append(Zone(f"zone-{i}", -1000 - i, polygon=[
+                (lat - size, lon - size), (lat - size, lon + size),
+                (lat + size, lon + size), (lat + size, lon - size)
+            ]))
+    return zones
+
+
+# Полный перебор для сравнения (и проверки результата)
+def route_linear(zones, lat, lon):
+    inside = [zone for zone in zones if zone.contains(lat, lon)]
+    candidates = inside or zones
+    return min(candidates, key=lambda zone: haversine_km(lat, lon, *zone.center))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк маршрутизации заявок")
+    parser.add_argument('--operators', type=int, default=200)
+    parser.add_argument('--points', type=int, default=100_000)
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    zones = make_zones(args.operators, rng)
+    points = [(CENTER[0] + rng.uniform(-0.5, 0.5), CENTER[1] + rng.uniform(-0.8, 0.8))
+              for _ in range(args.points)]
+
+    started = time.perf_counter()
+    router = OperatorRouter(zones)
+    build = time.perf_counter() - started
+
+    started = time.perf_counter()
+    routed = [router.route(lat, lon) for lat, lon in points]
+    elapsed = time.perf_counter() - started
+
+    sample = points[:2000]
+    started = time.perf_counter()
+    expected = [route_linear(zones, lat, lon) for lat, lon in sample]
+    linear = (time.perf_counter() - started) / len(sample)
+    mismatches = sum(1 for zone, want in zip(routed, expected) if zone is not want)
+
+    print(f"зон: {len(zones)}, точек: {len(points)}, построение индекса: {build * 1000:.1f} мс")
+    print(f"индекс: {elapsed:.2f} с всего, {elapsed / len(points) * 1e6:.1f} мкс/точка, "
+          f"{len(points) / elapsed:.0f} точек/с")
+    print(f"полный перебор: {linear * 1e6:.1f} мкс/точка; расхождений на {len(sample)} точках: {mismatches}")
+
+
+if __name__ == '__main__':
+    main()
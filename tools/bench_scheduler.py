@@ -0,0 +1,169 @@
+import argparse
+import heapq
+import itertools
+import logging
+import math
+import os
+import random
+import statistics
+import sys
+import time
+
+# Симуляция диспетчерской на модельных часах: поток заявок (по Пуассону) по городу,
+# комиссары едут к месту ДТП (фактическое время — ETA со случайным отклонением),
+# работают на месте и получают следующую заявку. Печатает ожидание назначения
+# по тяжести ДТП, ETA, нарушения SLA, длину очереди и стоимость операций диспетчера.
+#
+#   python tools/bench_scheduler.py --claims-per-hour 1000 --commissioners 50 --hours 4
+#   python tools/bench_scheduler.py --commissioners 400 --onsite-min 15
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from scheduler import INJURY, INJURY_NONE, INJURY_SEVERE, DispatchScheduler  # noqa: E402
+
+CENTER = (55.7558, 37.6173)
+
+DETAILS = {
+    INJURY_NONE: ["Столкновение на перекрестке, пострадавших нет", "Задел зеркало, без пострадавших"],
+    INJURY: ["Наезд сзади, у пассажира ушиб, вызвали скорую", "Водитель получил травму руки"],
+    INJURY_SEVERE: ["Лобовое столкновение, пострадавший без сознания", "Тяжелое ДТП, госпитализация"],
+}
+
+INJURY_NAMES = {INJURY_NONE: 'без пострадавших', INJURY: 'пострадавшие', INJURY_SEVERE: 'тяжелые'}
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+# Случайная точка в круге radius_km вокруг центра
+def random_point(rng, radius_km):
+    distance = radius_km * math.sqrt(rng.random())
+    angle = rng.uniform(0, 2 * math.pi)
+    lat = CENTER[0] + distance * math.cos(angle) / 111.32
+    lon = CENTER[1] + distance * math.sin(angle) / (111.32 * math.cos(math.radians(CENTER[0])))
+    return lat, lon
+
+
+class Simulation:
+    def __init__(self, args):
+        self.args = args
+        self.rng = random.Random(args.seed)
+        self.now = 0.0
+        self._events = []
+        self._seq = itertools.count()
+        self.op_time = 0.0
+        self.ops = 0
+        self.max_queue = 0
+        self.waits = {level: [] for level in INJURY_NAMES}
+        self.etas = []
+        self.breaches = []
+        self.scheduler = DispatchScheduler(
+            speed_kmh=args.speed,
+            schedule=self.schedule,
+            on_assign=self.on_assign,
+            on_breach=lambda claim, kind: self.breaches.append(kind),
+            clock=lambda: self.now
+        )
+
+    def schedule(self, delay, callback):
+        heapq.heappush(self._events, (self.now + delay, next(self._seq), callback))
+
+    # Вызов диспетчера с учетом затраченного процессорного времени
+    def call(self, func, *args):
+        started = time.perf_counter()
+        result = func(*args)
+        self.op_time += time.perf_counter() - started
+        self.ops += 1
+        return result
+
+    def on_assign(self, claim, commissioner):
+        self.waits[claim.injury].append(claim.wait(self.now))
+        eta = claim.eta_min if claim.eta_min is not None else 30
+        self.etas.append(eta)
+        travel = eta * 60 * self.rng.lognormvariate(0, self.args.traffic_sigma)
+        onsite = self.rng.expovariate(1 / (self.args.onsite_min * 60))
+        user_id = commissioner.user_id
+        self.schedule(travel, lambda: self.call(self.scheduler.mark_arrived, user_id))
+        self.schedule(travel + onsite, lambda: self.call(self.scheduler.complete, user_id))
+
+    def add_claim(self, index):
+        level = self.rng.choices(
+            (INJURY_NONE, INJURY, INJURY_SEVERE),
+            weights=(1 - self.args.injured - self.args.severe, self.args.injured, self.args.severe)
+        )[0]
+        lat, lon = random_point(self.rng, self.args.radius_km)
+        self.call(self.scheduler.add_claim, f"c{index}", index, lat, lon, self.rng.choice(DETAILS[level]))
+        self.max_queue = max(self.max_queue, self.scheduler.queued)
+
+    def run(self):
+        args = self.args
+        for user_id in range(args.commissioners):
+            self.scheduler.update_location(user_id, *random_point(self.rng, args.radius_km), now=0)
+            self.scheduler.set_online(user_id, f"Комиссар {user_id}", now=0)
+
+        # Поток заявок
+        t = 0.0
+        horizon = args.hours * 3600
+        for index in itertools.count():
+            t += self.rng.expovariate(args.claims_per_hour / 3600)
+            if t > horizon:
+                break
+            self.schedule(t, lambda index=index: self.add_claim(index))
+        claims = index
+
+        while self._events:
+            self.now, _, callback = heapq.heappop(self._events)
+            if self.now > horizon + args.drain_hours * 3600:
+                break
+            callback()
+        return claims
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Симуляция диспетчерской комиссаров")
+    parser.add_argument('--claims-per-hour', type=float, default=1000)
+    parser.add_argument('--commissioners', type=int, default=50)
+    parser.add_argument('--hours', type=float, default=4, help="длительность потока заявок")
+    parser.add_argument('--drain-hours', type=float, default=2, help="досчет после окончания потока")
+    parser.add_argument('--onsite-min', type=float, default=20, help="среднее время работы на месте, мин")
+    parser.add_argument('--speed', type=float, default=30, help="средняя скорость в городе, км/ч")
+    parser.add_argument('--traffic-sigma', type=float, default=0.3, help="разброс фактического времени в пути")
+    parser.add_argument('--radius-km', type=float, default=20)
+    parser.add_argument('--injured', type=float, default=0.15, help="доля ДТП с пострадавшими")
+    parser.add_argument('--severe', type=float, default=0.03, help="доля тяжелых ДТП")
+    parser.add_argument('--seed', type=int, default=1)
+    args = parser.parse_args()
+    # Каждое нарушение SLA диспетчер пишет в лог — в симуляции они только считаются
+    logging.disable(logging.WARNING)
+
+    simulation = Simulation(args)
+    started = time.perf_counter()
+    claims = simulation.run()
+    elapsed = time.perf_counter() - started
+    scheduler = simulation.scheduler
+
+    assigned = sum(len(waits) for waits in simulation.waits.values())
+    mean_eta = statistics.mean(simulation.etas) if simulation.etas else 0
+    capacity = args.commissioners * 60 / (mean_eta + args.onsite_min) if simulation.etas else 0
+    print(f"\n{claims} заявок за {args.hours:g} ч ({args.claims_per_hour:g}/ч), комиссаров: {args.commissioners}; "
+          f"пропускная способность ≈ {capacity:.0f} заявок/ч")
+    print(f"назначено: {assigned}, в очереди на конец: {scheduler.queued}, максимум очереди: {simulation.max_queue}")
+    print(f"{'ожидание назначения':<22}{'n':>7}{'p50, мин':>10}{'p95, мин':>10}{'p99, мин':>10}")
+    for level, waits in simulation.waits.items():
+        if waits:
+            print(f"{INJURY_NAMES[level]:<22}{len(waits):>7}{statistics.median(waits) / 60:>10.1f}"
+                  f"{percentile(waits, 95) / 60:>10.1f}{percentile(waits, 99) / 60:>10.1f}")
+    if simulation.etas:
+        print(f"ETA: p50 {statistics.median(simulation.etas):.0f} мин, p95 {percentile(simulation.etas, 95):.0f} мин")
+    contact = simulation.breaches.count('contact')
+    arrival = simulation.breaches.count('arrival')
+    print(f"нарушения SLA: без комиссара 15 мин — {contact} ({contact / max(claims, 1):.1%}), "
+          f"опоздание к ETA — {arrival} ({arrival / max(assigned, 1):.1%})")
+    print(f"диспетчер: {simulation.ops} операций, {simulation.op_time / max(simulation.ops, 1) * 1e6:.1f} мкс "
+          f"на операцию; симуляция {elapsed:.2f} с")
+
+
+if __name__ == '__main__':
+    main()
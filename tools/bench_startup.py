@@ -0,0 +1,137 @@
+import argparse
+import asyncio
+import os
+import re
+import signal
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Холодный старт бота, как на хостинге после простоя:
+# 1) время импорта bot.py (медиана по --runs запускам) и самые дорогие модули по python -X importtime;
+# 2) время от запуска процесса (python bot.py против поддельного Bot API) до первого ответа,
+#    когда за время простоя накопилось --pending обновлений, и до ответа на все из них.
+# Обновления, сброшенные ботом при старте, видны в строке «сброшено».
+#
+#   python tools/bench_startup.py --runs 5 --pending 50
+#   python tools/bench_startup.py --imports-only --top 25
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from bench_e2e import start_bot  # noqa: E402
+from fake_bot_server import FakeBotServer  # noqa: E402
+from synthetic import text_update  # noqa: E402
+
+IMPORT_TIME_RE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def bot_env(data_dir):
+    return dict(
+        os.environ,
+        TELEGRAM_BOT_TOKEN='1:fake',
+        STORAGE_PATH=os.path.join(data_dir, 'bot.sqlite3'),
+        PHOTO_STORE_DIR=os.path.join(data_dir, 'photos')
+    )
+
+
+# Время импорта bot.py в отдельном процессе, с
+def measure_import(data_dir):
+    code = "import time; started = time.perf_counter(); import bot; print(time.perf_counter() - started)"
+    output = subprocess.run([sys.executable, '-c', code], cwd=data_dir, env=dict(bot_env(data_dir), PYTHONPATH=ROOT),
+                            capture_output=True, text=True, check=True).stdout
+    return float(output.strip().splitlines()[-1])
+
+
+# Модули верхнего уровня (импортированные самим bot.py) и их полное время, мкс
+def import_breakdown(data_dir):
+    stderr = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import bot'], cwd=data_dir,
+                            env=dict(bot_env(data_dir), PYTHONPATH=ROOT), capture_output=True, text=True).stderr
+    modules = {}
+    for line in stderr.splitlines():
+        match = IMPORT_TIME_RE.match(line)
+        # Отступ в 3 пробела — импорт из bot.py (и из интерпретатора до него)
+        if match and len(match.group(3)) <= 3:
+            modules[match.group(4)] = int(match.group(2))
+    return modules
+
+
+def interpreter_startup():
+    started = time.perf_counter()
+    subprocess.run([sys.executable, '-c', 'pass'], check=True)
+    return time.perf_counter() - started
+
+
+async def measure_cold_start(pending, step_timeout, log_level):
+    server = FakeBotServer()
+    port = server.listen(0)
+    users = [2_000_000 + i for i in range(pending)]
+    # Сообщения, отправленные, пока бот не работал
+    for user_id in users:
+        server.push_update(text_update(user_id, '/start'))
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        started = time.perf_counter()
+        bot = start_bot(f"http://127.0.0.1:{port}", data_dir, 0, log_level)
+        try:
+            replies = await asyncio.gather(*(server.wait_replies(user_id, 1, step_timeout) for user_id in users))
+        finally:
+            bot.send_signal(signal.SIGTERM)
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, bot.wait, 30)
+            except subprocess.TimeoutExpired:
+                bot.kill()
+            await server.stop()
+
+    answered = [reply - started for reply in replies if reply is not None]
+    return {
+        'first': min(answered) if answered else None,
+        'all': max(answered) if len(answered) == pending else None,
+        'answered': len(answered),
+        'dropped': server.dropped_updates,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Холодный старт: импорт и время до первого обновления")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--pending', type=int, default=50, help="обновлений, накопившихся до запуска")
+    parser.add_argument('--top', type=int, default=15, help="сколько модулей показать")
+    parser.add_argument('--step-timeout', type=float, default=30.0)
+    parser.add_argument('--imports-only', action='store_true')
+    parser.add_argument('--log-level', default='WARNING')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as data_dir:
+        interpreter = statistics.median(interpreter_startup() for _ in range(args.runs))
+        imports = [measure_import(data_dir) for _ in range(args.runs)]
+        modules = import_breakdown(data_dir)
+
+    print(f"\nзапуск интерпретатора: {interpreter * 1000:.0f} мс")
+    print(f"импорт bot.py: медиана {statistics.median(imports) * 1000:.0f} мс, "
+          f"мин {min(imports) * 1000:.0f} мс, макс {max(imports) * 1000:.0f} мс ({args.runs} запусков)")
+    print(f"{'модуль':<32}{'мс':>8}")
+    for name, micros in sorted(modules.items(), key=lambda item: -item[1])[:args.top]:
+        print(f"{name:<32}{micros / 1000:>8.1f}")
+
+    if args.imports_only:
+        return
+
+    results = [asyncio.run(measure_cold_start(args.pending, args.step_timeout, args.log_level))
+               for _ in range(args.runs)]
+    firsts = [result['first'] for result in results if result['first'] is not None]
+    alls = [result['all'] for result in results if result['all'] is not None]
+    print(f"\nхолодный старт с {args.pending} накопившимися обновлениями ({args.runs} запусков):")
+    if firsts:
+        print(f"до первого ответа: медиана {statistics.median(firsts) * 1000:.0f} мс, макс {max(firsts) * 1000:.0f} мс")
+    if alls:
+        print(f"до ответа на все: медиана {statistics.median(alls) * 1000:.0f} мс, макс {max(alls) * 1000:.0f} мс")
+    print(f"ответов: {sum(result['answered'] for result in results)} из {args.pending * args.runs}, "
+          f"сброшено при старте: {sum(result['dropped'] for result in results)}")
+
+
+if __name__ == '__main__':
+    main()
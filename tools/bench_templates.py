@@ -0,0 +1,77 @@
+import os
+import sys
+import timeit
+
+# Микробенчмарк накладных расходов на ответ пользователю: построение клавиатуры,
+# текста подсказки и сериализация параметров запроса к Bot API.
+# «до» — клавиатура собирается на каждое обновление, «после» — готовая из реестра.
+#
+#   python tools/bench_templates.py
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from telegram import KeyboardButton, ReplyKeyboardMarkup  # noqa: E402
+from telegram.request import RequestData  # noqa: E402
+from telegram.request._requestparameter import RequestParameter  # noqa: E402
+
+from templates import TEMPLATES  # noqa: E402
+
+
+def request_payload(text, markup):
+    params = [
+        RequestParameter.from_input('chat_id', 42),
+        RequestParameter.from_input('text', text),
+        RequestParameter.from_input('reply_markup', markup),
+        RequestParameter.from_input('parse_mode', 'Markdown'),
+    ]
+    return RequestData(params).json_payload
+
+
+def before():
+    markup = ReplyKeyboardMarkup([
+        [KeyboardButton("📱 Отправить номер", request_contact=True)]
+    ], resize_keyboard=True, one_time_keyboard=True)
+    text = (
+        "📱 **Шаг 1 из 5: Номер телефона**\n\n"
+        "Пожалуйста, нажмите кнопку ниже, чтобы отправить номер телефона для связи:"
+    )
+    return request_payload(text, markup)
+
+
+def before_photos():
+    markup = ReplyKeyboardMarkup([
+        ["✅ Отправить заявку без фото"],
+        ["📷 Прикрепить фото"]
+    ], resize_keyboard=True, one_time_keyboard=True)
+    text = (
+        f"✅ **Описание ДТП сохранено!**\n\n"
+        "📷 **Шаг 5 из 5: Фотографии**\n\n"
+        "Вы можете прикрепить фотографии ДТП (до 5 фото):\n"
+        "• Фото места происшествия\n"
+        "• Фото повреждений\n"
+        "• Фото документов\n\n"
+        "Отправляйте фотографии по одной или нажмите кнопку ниже:"
+    )
+    return request_payload(text, markup)
+
+
+def after():
+    t = TEMPLATES['ru']
+    return request_payload(t.text('step_1'), t.keyboard('contact'))
+
+
+def after_photos():
+    t = TEMPLATES['ru']
+    return request_payload(t.text('accident_saved'), t.keyboard('photos'))
+
+
+def main():
+    number = 20_000
+    for name, func in (('до: контакт', before), ('после: контакт', after),
+                       ('до: фото', before_photos), ('после: фото', after_photos)):
+        best = min(timeit.repeat(func, number=number, repeat=5)) / number
+        print(f"{name:<18}{best * 1e6:8.2f} мкс на ответ")
+
+
+if __name__ == '__main__':
+    main()
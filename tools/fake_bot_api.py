@@ -0,0 +1,81 @@
+import asyncio
+import itertools
+import json
+import random
+import time
+
+from telegram.request import BaseRequest
+
+# Поддельный Bot API внутри процесса: подставляется в Application.builder().request(...)
+# и отвечает на вызовы бота без сети, с настраиваемой задержкой.
+
+BOT_USER = {'id': 1, 'is_bot': True, 'first_name': 'FakeBot', 'username': 'fake_bot'}
+
+_message_ids = itertools.count(1)
+
+
+def fake_message(chat_id, **fields):
+    message = {
+        'message_id': next(_message_ids),
+        'date': int(time.time()),
+        'chat': {'id': int(chat_id) if str(chat_id).lstrip('-').isdigit() else 0, 'type': 'private'},
+        'from': BOT_USER,
+    }
+    message.update(fields)
+    return message
+
+
+def fake_photo(file_id):
+    return [{'file_id': file_id, 'file_unique_id': file_id, 'width': 1280, 'height': 960}]
+
+
+# Ответ на вызов метода Bot API (результат поля "result")
+def fake_result(method, params):
+    if method == 'getMe':
+        return BOT_USER
+    if method == 'sendMessage':
+        return fake_message(params.get('chat_id'), text=params.get('text', ''))
+    if method == 'sendPhoto':
+        return fake_message(params.get('chat_id'), photo=fake_photo(str(params.get('photo'))))
+    if method == 'sendMediaGroup':
+        media = params.get('media') or []
+        if isinstance(media, str):
+            media = json.loads(media)
+        return [fake_message(params.get('chat_id'), photo=fake_photo(str(item.get('media'))))
+                for item in media]
+    if method == 'getUpdates':
+        return []
+    if method == 'getFile':
+        file_id = str(params.get('file_id'))
+        return {'file_id': file_id, 'file_unique_id': file_id, 'file_size': 0, 'file_path': f"photos/{file_id}.jpg"}
+    return True
+
+
+class FakeBotRequest(BaseRequest):
+    def __init__(self, latency=0.0, jitter=0.0):
+        self.latency = latency
+        self.jitter = jitter
+        self.calls = []
+
+    @property
+    def read_timeout(self):
+        return None
+
+    async def initialize(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def do_request(self, url, method, request_data=None, read_timeout=None,
+                         write_timeout=None, connect_timeout=None, pool_timeout=None):
+        api_method = url.rsplit('/', 1)[-1]
+        params = request_data.parameters if request_data else {}
+        self.calls.append((api_method, params))
+
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        body = {'ok': True, 'result': fake_result(api_method, params)}
+        return 200, json.dumps(body).encode()
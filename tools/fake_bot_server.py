@@ -0,0 +1,225 @@
+import argparse
+import asyncio
+import io
+import json
+import random
+import time
+import zlib
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+
+from fake_bot_api import fake_result
+
+# Поддельный сервер Bot API по HTTP: бот подключается к нему через BOT_API_URL
+# как к api.telegram.org. getUpdates отдает обновления, добавленные push_update(),
+# с длинным опросом; ответы бота записываются, и харнесс может их дождаться.
+# Задержка ответа и доля ответов 429 (Too Many Requests) настраиваются.
+#
+#   python tools/fake_bot_server.py --port 8081 --latency 0.05 --rate-429 0.01
+
+# Скачивание файлов (/file/bot<token>/<путь>) отдает JPEG, одинаковый для одного пути,
+# если установлен Pillow, иначе псевдослучайные байты.
+
+# Параметры, которые PTB передает строкой JSON
+JSON_PARAMS = {'media', 'reply_markup', 'reply_parameters', 'allowed_updates', 'entities'}
+
+SEND_METHODS = {'sendMessage', 'sendPhoto', 'sendMediaGroup'}
+
+
+# Содержимое файла по пути: детерминированное, разное для разных путей
+def fake_file(path, size=(1280, 960)):
+    seed = zlib.crc32(path.encode())
+    try:
+        from PIL import Image, ImageDraw
+    except ImportError:
+        return random.Random(seed).randbytes(200 * 1024)
+    rng = random.Random(seed)
+    image = Image.new('RGB', size, tuple(rng.randrange(256) for _ in range(3)))
+    draw = ImageDraw.Draw(image)
+    for _ in range(12):
+        x, y = rng.randrange(size[0]), rng.randrange(size[1])
+        draw.rectangle((x, y, x + rng.randrange(50, 400), y + rng.randrange(50, 300)),
+                       fill=tuple(rng.randrange(256) for _ in range(3)))
+    out = io.BytesIO()
+    image.save(out, 'JPEG', quality=85)
+    return out.getvalue()
+
+
+class FakeBotServer:
+    def __init__(self, latency=0.0, jitter=0.0, rate_429=0.0, retry_after=1):
+        self.latency = latency
+        self.jitter = jitter
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+
+        self._updates = []
+        self._next_update_id = 1
+        self._new_updates = asyncio.Event()
+        self._waiters = {}
+        self.replies = {}
+        self.calls = {}
+        self.throttled = 0
+        self.polling = asyncio.Event()
+        self._server = None
+        # Путь файла → байты (по умолчанию fake_file)
+        self.files = {}
+        self.downloads = 0
+        # Обновления, сброшенные deleteWebhook(drop_pending_updates=True)
+        self.dropped_updates = 0
+
+    # Обновление от «пользователя»; update_id проставляется сервером
+    def push_update(self, update):
+        update['update_id'] = self._next_update_id
+        self._next_update_id += 1
+        self._updates.append(update)
+        self._new_updates.set()
+
+    # Забыть прежние ответы в чат (перед следующим шагом сценария)
+    def reset_replies(self, chat_id):
+        self.replies[chat_id] = []
+
+    # Ждет count ответов бота в чат; время первого ответа (time.perf_counter) или None по таймауту
+    async def wait_replies(self, chat_id, count=1, timeout=10.0):
+        received = self.replies.setdefault(chat_id, [])
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        while len(received) < count:
+            waiter = self._waiters.setdefault(chat_id, loop.create_future())
+            remaining = deadline - loop.time()
+            if remaining <= 0:
+                return None
+            try:
+                await asyncio.wait_for(asyncio.shield(waiter), remaining)
+            except asyncio.TimeoutError:
+                return None
+        return received[0]
+
+    def _record_reply(self, chat_id):
+        self.replies.setdefault(chat_id, []).append(time.perf_counter())
+        waiter = self._waiters.pop(chat_id, None)
+        if waiter is not None and not waiter.done():
+            waiter.set_result(None)
+
+    async def get_updates(self, params):
+        self.polling.set()
+        offset = int(params.get('offset') or 0)
+        limit = int(params.get('limit') or 100)
+        timeout = float(params.get('timeout') or 0)
+
+        if offset:
+            self._updates = [update for update in self._updates if update['update_id'] >= offset]
+        if not self._updates and timeout:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), timeout)
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:limit]
+
+    async def handle(self, method, params):
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if method == 'getUpdates':
+            return 200, {'ok': True, 'result': await self.get_updates(params)}
+        if method == 'deleteWebhook' and str(params.get('drop_pending_updates')).lower() == 'true':
+            # Как Telegram: накопившиеся обновления пропадают
+            self.dropped_updates += len(self._updates)
+            self._updates = []
+
+        delay = self.latency + (random.uniform(0, self.jitter) if self.jitter else 0)
+        if delay:
+            await asyncio.sleep(delay)
+
+        if method in SEND_METHODS and self.rate_429 and random.random() < self.rate_429:
+            self.throttled += 1
+            return 429, {
+                'ok': False,
+                'error_code': 429,
+                'description': f"Too Many Requests: retry after {self.retry_after}",
+                'parameters': {'retry_after': self.retry_after}
+            }
+
+        if method in SEND_METHODS:
+            chat_id = params.get('chat_id')
+            self._record_reply(int(chat_id) if str(chat_id).lstrip('-').isdigit() else chat_id)
+        return 200, {'ok': True, 'result': fake_result(method, params)}
+
+    def file_content(self, path):
+        self.downloads += 1
+        if path not in self.files:
+            self.files[path] = fake_file(path)
+        return self.files[path]
+
+    def make_app(self):
+        return tornado.web.Application([
+            (r"/bot[^/]+/(\w+)", _MethodHandler, {'server': self}),
+            (r"/file/bot[^/]+/(.+)", _FileHandler, {'server': self}),
+        ])
+
+    def listen(self, port, address='127.0.0.1'):
+        self._server = HTTPServer(self.make_app())
+        self._server.listen(port, address=address)
+        # Порт 0 — свободный порт, выбранный системой
+        return next(iter(self._server._sockets.values())).getsockname()[1]
+
+    # Останавливает прием соединений и отпускает висящие длинные опросы getUpdates
+    async def stop(self):
+        if self._server is not None:
+            self._server.stop()
+            self._server = None
+        self._new_updates.set()
+        await asyncio.sleep(0.05)
+
+
+class _MethodHandler(tornado.web.RequestHandler):
+    def initialize(self, server):
+        self.server = server
+
+    def _params(self):
+        if self.request.headers.get('Content-Type', '').startswith('application/json'):
+            return json.loads(self.request.body or b'{}')
+        params = {}
+        for name, values in self.request.body_arguments.items():
+            value = values[-1].decode()
+            params[name] = json.loads(value) if name in JSON_PARAMS else value
+        return params
+
+    async def post(self, method):
+        status, body = await self.server.handle(method, self._params())
+        self.set_status(status)
+        self.write(body)
+
+    async def get(self, method):
+        await self.post(method)
+
+
+class _FileHandler(tornado.web.RequestHandler):
+    def initialize(self, server):
+        self.server = server
+
+    async def get(self, path):
+        if self.server.latency:
+            await asyncio.sleep(self.server.latency)
+        self.set_header('Content-Type', 'image/jpeg')
+        self.write(self.server.file_content(path))
+
+
+async def serve(args):
+    server = FakeBotServer(latency=args.latency, jitter=args.jitter, rate_429=args.rate_429)
+    port = server.listen(args.port, args.host)
+    print(f"Поддельный Bot API: BOT_API_URL=http://{args.host}:{port}")
+    await asyncio.Event().wait()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Поддельный сервер Telegram Bot API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8081)
+    parser.add_argument('--latency', type=float, default=0.0, help="задержка ответа, с")
+    parser.add_argument('--jitter', type=float, default=0.0, help="случайная добавка к задержке, с")
+    parser.add_argument('--rate-429', type=float, default=0.0, help="доля вызовов send* с ответом 429")
+    asyncio.run(serve(parser.parse_args()))
+
+
+if __name__ == '__main__':
+    main()
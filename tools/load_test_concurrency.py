@@ -0,0 +1,98 @@
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import sys
+import time
+
+# Нагрузочный тест параллельной обработки: N водителей одновременно проходят
+# все шаги заявки, Bot API подменен задержкой. Печатает p50/p95/p99 задержки шага.
+#
+#   python tools/load_test_concurrency.py --users 500 --latency 0.05
+#   python tools/load_test_concurrency.py --max-concurrent 1 256   # сравнение с последовательной обработкой
+#   python tools/load_test_concurrency.py --users 50 --flood 1000 --max-concurrent 32
+#     (один пользователь присылает 1000 обновлений разом — задержка остальных не должна расти)
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+os.environ.setdefault('TELEGRAM_BOT_TOKEN', '1:fake')
+os.environ.setdefault('ADMIN_CHAT_ID', '-1000000000001')
+os.environ['STORAGE_BACKEND'] = 'memory'
+os.environ['PORT'] = '0'
+
+import logging  # noqa: E402
+
+from telegram import Update  # noqa: E402
+
+import bot  # noqa: E402
+from fake_bot_api import FakeBotRequest  # noqa: E402
+from synthetic import claim_script, text_update  # noqa: E402
+
+
+def percentile(samples, p):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * p / 100))]
+
+
+async def drive_user(application, user_id, think_time, latencies):
+    processor = application.update_processor
+    for step, build in claim_script(user_id):
+        await asyncio.sleep(random.uniform(0, think_time))
+        update = Update.de_json(build(), application.bot)
+        started = time.perf_counter()
+        await processor.process_update(update, application.process_update(update))
+        latencies.setdefault(step, []).append(time.perf_counter() - started)
+
+
+# Один пользователь присылает count обновлений разом (кнопки, большой альбом)
+async def flood_user(application, user_id, count):
+    processor = application.update_processor
+    updates = [Update.de_json(text_update(user_id, '/help'), application.bot) for _ in range(count)]
+    await asyncio.gather(*(processor.process_update(update, application.process_update(update)) for update in updates))
+
+
+async def run(users, latency, think_time, max_concurrent, flood=0):
+    application = bot.build_application(
+        request=FakeBotRequest(latency=latency, jitter=latency / 2),
+        max_concurrent_updates=max_concurrent
+    )
+    latencies = {}
+    async with application:
+        await application.post_init(application)
+        started = time.perf_counter()
+        flooding = asyncio.create_task(flood_user(application, 999_999, flood)) if flood else None
+        await asyncio.gather(*(
+            drive_user(application, 1_000_000 + i, think_time, latencies) for i in range(users)
+        ))
+        elapsed = time.perf_counter() - started
+        if flooding is not None:
+            await flooding
+
+    all_samples = [sample for samples in latencies.values() for sample in samples]
+    print(f"\nmax_concurrent_updates={max_concurrent}: {users} пользователей, "
+          f"{len(all_samples)} шагов за {elapsed:.2f} с ({len(all_samples) / elapsed:.0f} шагов/с), "
+          f"незавершенных черновиков: {len(bot.user_data_store)}")
+    if flood:
+        print(f"параллельно один пользователь прислал {flood} обновлений разом")
+    print(f"{'шаг':<18}{'p50, мс':>10}{'p95, мс':>10}{'p99, мс':>10}")
+    for step, samples in list(latencies.items()) + [('все шаги', all_samples)]:
+        print(f"{step:<18}{statistics.median(samples) * 1000:>10.1f}"
+              f"{percentile(samples, 95) * 1000:>10.1f}{percentile(samples, 99) * 1000:>10.1f}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузочный тест параллельной обработки")
+    parser.add_argument('--users', type=int, default=500)
+    parser.add_argument('--latency', type=float, default=0.05, help="задержка Bot API, с")
+    parser.add_argument('--think-time', type=float, default=0.2, help="пауза пользователя между шагами, с")
+    parser.add_argument('--max-concurrent', type=int, nargs='+', default=[bot.MAX_CONCURRENT_UPDATES])
+    parser.add_argument('--flood', type=int, default=0, help="обновлений разом от одного пользователя")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+    for max_concurrent in args.max_concurrent:
+        asyncio.run(run(args.users, args.latency, args.think_time, max_concurrent, args.flood))
+
+
+if __name__ == '__main__':
+    main()
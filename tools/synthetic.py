@@ -0,0 +1,84 @@
+import itertools
+import time
+
+# Генерация синтетических обновлений Telegram (JSON) для харнессов и бенчмарков
+
+_update_ids = itertools.count(1)
+_message_ids = itertools.count(1)
+
+
+def make_user(user_id):
+    return {
+        'id': user_id,
+        'is_bot': False,
+        'first_name': f"Тест{user_id}",
+        'last_name': "Водитель",
+        'username': f"driver{user_id}",
+        'language_code': 'ru'
+    }
+
+
+def make_update(user_id, **message_fields):
+    message = {
+        'message_id': next(_message_ids),
+        'date': int(time.time()),
+        'chat': {'id': user_id, 'type': 'private', 'first_name': f"Тест{user_id}"},
+        'from': make_user(user_id),
+    }
+    message.update(message_fields)
+    return {'update_id': next(_update_ids), 'message': message}
+
+
+def text_update(user_id, text):
+    fields = {'text': text}
+    if text.startswith('/'):
+        command = text.split()[0]
+        fields['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(command)}]
+    return make_update(user_id, **fields)
+
+
+def contact_update(user_id, phone=None):
+    return make_update(user_id, contact={
+        'phone_number': phone or f"+7999{user_id % 10_000_000:07d}",
+        'first_name': f"Тест{user_id}",
+        'user_id': user_id
+    })
+
+
+def location_update(user_id, latitude=55.7558, longitude=37.6173):
+    return make_update(user_id, location={'latitude': latitude, 'longitude': longitude})
+
+
+def photo_update(user_id, n=1, media_group_id=None):
+    fields = {'photo': [
+        {'file_id': f"small-{user_id}-{n}", 'file_unique_id': f"us-{user_id}-{n}", 'width': 90, 'height': 90},
+        {'file_id': f"photo-{user_id}-{n}", 'file_unique_id': f"u-{user_id}-{n}", 'width': 1280, 'height': 960},
+    ]}
+    if media_group_id:
+        fields['media_group_id'] = media_group_id
+    return make_update(user_id, **fields)
+
+
+# Полный сценарий оформления заявки: (название шага, функция построения обновления).
+# album=True — все фото одним альбомом: функция шага возвращает список обновлений
+def claim_script(user_id, photos=0, album=False):
+    steps = [
+        ('start', lambda: text_update(user_id, '/start')),
+        ('phone', lambda: contact_update(user_id)),
+        ('location', lambda: location_update(user_id)),
+        ('car_details', lambda: text_update(user_id, f"Toyota Camry, А{user_id % 1000:03d}ВС77")),
+        ('accident_details', lambda: text_update(user_id, "Столкновение на перекрестке, пострадавших нет")),
+    ]
+    if photos:
+        steps.append(('attach', lambda: text_update(user_id, "📷 Прикрепить фото")))
+        if album:
+            steps.append(('album', lambda: [
+                photo_update(user_id, n, media_group_id=f"album-{user_id}") for n in range(1, photos + 1)
+            ]))
+        else:
+            for n in range(1, photos + 1):
+                steps.append(('photo', lambda n=n: photo_update(user_id, n)))
+        steps.append(('submit', lambda: text_update(user_id, "✅ Отправить заявку")))
+    else:
+        steps.append(('submit', lambda: text_update(user_id, "✅ Отправить заявку без фото")))
+    return steps
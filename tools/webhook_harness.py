@@ -0,0 +1,68 @@
+import argparse
+import asyncio
+import time
+
+import httpx
+
+from synthetic import claim_script, text_update
+
+# Локальная проверка вебхук-режима: отправляет синтетические Update в эндпоинт бота.
+#
+# Запуск (в другом терминале бот с WEBHOOK_URL=http://localhost:8443 и WEBHOOK_SECRET —
+# без него бот создает случайный секрет и отвечает 403 на все запросы):
+#   python tools/webhook_harness.py --url http://localhost:8443/telegram --secret <WEBHOOK_SECRET>
+
+
+async def post_update(client, url, secret, update):
+    headers = {'X-Telegram-Bot-Api-Secret-Token': secret} if secret else {}
+    response = await client.post(url, json=update, headers=headers)
+    return response.status_code
+
+
+async def check_endpoint(client, url, secret, health_url):
+    # Проверки протокола: секрет, некорректное тело, health
+    results = {}
+    if secret:
+        results['wrong_secret'] = await post_update(client, url, secret + 'x', text_update(1, '/help'))
+    response = await client.post(url, content=b'not json', headers={
+        'X-Telegram-Bot-Api-Secret-Token': secret or ''
+    })
+    results['bad_body'] = response.status_code
+    results['health'] = (await client.get(health_url)).status_code
+    return results
+
+
+async def run_user(client, url, secret, user_id, photos, statuses):
+    for _, build in claim_script(user_id, photos=photos):
+        statuses.append(await post_update(client, url, secret, build()))
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="POST синтетических обновлений в вебхук бота")
+    parser.add_argument('--url', default='http://localhost:8443/telegram')
+    parser.add_argument('--secret', required=True)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--photos', type=int, default=0)
+    parser.add_argument('--first-user-id', type=int, default=900_000_000)
+    args = parser.parse_args()
+
+    health_url = args.url.rsplit('/', 1)[0] + '/health'
+    statuses = []
+
+    async with httpx.AsyncClient(timeout=10) as client:
+        print("Проверки:", await check_endpoint(client, args.url, args.secret, health_url))
+
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            run_user(client, args.url, args.secret, args.first_user_id + i, args.photos, statuses)
+            for i in range(args.users)
+        ))
+        elapsed = time.perf_counter() - started
+
+    ok = sum(1 for status in statuses if status == 200)
+    print(f"Отправлено обновлений: {len(statuses)}, успешно: {ok}, за {elapsed:.2f} с "
+          f"({len(statuses) / elapsed:.0f} обновл./с)")
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,195 @@
+import asyncio
+import hmac
+import json
+import logging
+import signal
+
+import tornado.web
+from tornado.httpserver import HTTPServer
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Заголовок, в котором Telegram присылает секрет вебхука
+SECRET_HEADER = 'X-Telegram-Bot-Api-Secret-Token'
+
+
+# Общее состояние HTTP-сервера (нужно для корректной остановки)
+class ServerState:
+    def __init__(self):
+        self.draining = False
+
+
+# Приём обновлений от Telegram
+class WebhookHandler(tornado.web.RequestHandler):
+    def initialize(self, bot_app, secret_token, state):
+        self.bot_app = bot_app
+        self.secret_token = secret_token
+        self.state = state
+
+    async def post(self):
+        # До старта бота и во время остановки не принимаем обновления: Telegram повторит их позже
+        if self.state.draining or not self.bot_app.running:
+            self.set_status(503)
+            return
+
+        # Без секрета эндпоинт не принимает ничего: иначе обновления мог бы подделать любой
+        received = self.request.headers.get(SECRET_HEADER, '')
+        if not self.secret_token or not hmac.compare_digest(received, self.secret_token):
+            logger.warning("Запрос к вебхуку с неверным секретом от %s", self.request.remote_ip)
+            self.set_status(403)
+            return
+
+        try:
+            data = json.loads(self.request.body)
+            update = Update.de_json(data, self.bot_app.bot)
+        except Exception as e:
+            logger.warning("Некорректное тело запроса вебхука: %s", e)
+            self.set_status(400)
+            return
+
+        if update is None:
+            self.set_status(400)
+            return
+
+        await self.bot_app.update_queue.put(update)
+        self.set_status(200)
+
+    def log_exception(self, typ, value, tb):
+        logger.error("Ошибка обработки запроса вебхука", exc_info=(typ, value, tb))
+
+
+# Проверка работоспособности для хостинга
+class HealthHandler(tornado.web.RequestHandler):
+    def initialize(self, bot_app, state, stats=None):
+        self.bot_app = bot_app
+        self.state = state
+        self.stats = stats
+
+    def get(self):
+        if self.state.draining:
+            self.set_status(503)
+            self.write({'status': 'draining'})
+            return
+        body = {
+            'status': 'ok',
+            'pending_updates': self.bot_app.update_queue.qsize()
+        }
+        if self.stats:
+            body.update(self.stats())
+        self.write(body)
+
+
+# Метрики в формате Prometheus
+class MetricsHandler(tornado.web.RequestHandler):
+    def initialize(self, render):
+        self.render_metrics = render
+
+    def get(self):
+        self.set_header('Content-Type', 'text/plain; version=0.0.4; charset=utf-8')
+        self.write(self.render_metrics())
+
+
+# Маршруты служебного HTTP-сервера; url_path=None — без приема обновлений (режим polling)
+def make_web_app(application, state, url_path=None, secret_token=None, stats=None, metrics=None):
+    routes = [(r"/health/?", HealthHandler, {'bot_app': application, 'state': state, 'stats': stats})]
+    if url_path is not None:
+        routes.append((rf"/{url_path.strip('/')}/?", WebhookHandler,
+                       {'bot_app': application, 'secret_token': secret_token, 'state': state}))
+    if metrics is not None:
+        routes.append((r"/metrics/?", MetricsHandler, {'render': metrics}))
+    return tornado.web.Application(routes)
+
+
+# Служебный сервер (/health, /metrics) для режима polling
+def start_status_server(application, listen, port, stats=None, metrics=None):
+    server = HTTPServer(make_web_app(application, ServerState(), stats=stats, metrics=metrics))
+    server.listen(port, address=listen)
+    return server
+
+
+# Ожидание обработки уже принятых обновлений
+async def drain_updates(application, timeout):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+    while application.update_queue.qsize() and loop.time() < deadline:
+        await asyncio.sleep(0.1)
+
+    left = application.update_queue.qsize()
+    if left:
+        logger.warning("Остановка: не обработано обновлений в очереди: %s", left)
+
+
+# listen_early — порт открывается до инициализации бота: хостинг сразу видит /health,
+# а обновления до старта бота получают 503, и Telegram присылает их повторно.
+# drop_pending_updates — сбросить обновления, которые Telegram копил, пока бот не работал.
+async def serve_webhook(application, webhook_url, listen, port, url_path,
+                        secret_token=None, drain_timeout=25, stats=None, metrics=None, listen_early=False,
+                        drop_pending_updates=False):
+    state = ServerState()
+    stop_event = asyncio.Event()
+
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        try:
+            loop.add_signal_handler(sig, stop_event.set)
+        except NotImplementedError:
+            pass
+
+    server = HTTPServer(make_web_app(application, state, url_path, secret_token, stats, metrics), xheaders=True)
+    try:
+        if listen_early:
+            server.listen(port, address=listen)
+
+        await application.initialize()
+        if application.post_init:
+            await application.post_init(application)
+
+        await application.start()
+        if not listen_early:
+            server.listen(port, address=listen)
+
+        await application.bot.set_webhook(
+            url=webhook_url,
+            secret_token=secret_token,
+            allowed_updates=Update.ALL_TYPES,
+            drop_pending_updates=drop_pending_updates
+        )
+        logger.info("🌐 Вебхук установлен: %s (порт %s)", webhook_url, port)
+
+        await stop_event.wait()
+
+        # Плавная остановка: перестаем принимать новые обновления и дорабатываем очередь.
+        # Вебхук не удаляем — Telegram придержит обновления до следующего запуска.
+        logger.info("🛑 Остановка вебхук-сервера...")
+        state.draining = True
+        server.stop()
+        await drain_updates(application, drain_timeout)
+    finally:
+        server.stop()
+        if application.running:
+            await application.stop()
+            if application.post_stop:
+                await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+        await server.close_all_connections()
+
+
+def run_webhook(application, webhook_url, listen, port, url_path,
+                secret_token=None, drain_timeout=25, stats=None, metrics=None, listen_early=False,
+                drop_pending_updates=False):
+    asyncio.run(serve_webhook(
+        application,
+        webhook_url=webhook_url,
+        listen=listen,
+        port=port,
+        url_path=url_path,
+        secret_token=secret_token,
+        drain_timeout=drain_timeout,
+        stats=stats,
+        metrics=metrics,
+        listen_early=listen_early,
+        drop_pending_updates=drop_pending_updates
+    ))